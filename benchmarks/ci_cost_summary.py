@@ -0,0 +1,55 @@
+'''Micro-benchmark of get.get_ci_cost_summary against the number of C&I assets
+
+    python -m benchmarks.ci_cost_summary --buses 1,10,50,100 --technologies 6
+'''
+import logging
+import time
+
+import click
+import pandas as pd
+
+from docs import simple_model
+from src import cfe, get
+
+
+def time_cost_summary(n_buses: int, n_technologies: int, n_snapshots: int, repeats: int) -> dict:
+    '''Returns the best of `repeats` timings of get_ci_cost_summary on a synthetic solved network
+    '''
+    n = simple_model.MakeStockNetwork(n_buses, n_technologies, n_snapshots)
+    cfe.PrepareNetworkForCFE(n, list(n.buses.index), 0.2, simple_model.palette(n, n_technologies), True)
+    simple_model.add_solution(n)
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        summary = get.get_ci_cost_summary(n)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'buses': n_buses,
+        'technologies': n_technologies,
+        'snapshots': n_snapshots,
+        'ci_assets': len(summary),
+        'seconds': min(timings),
+    }
+
+
+@click.command()
+@click.option('--buses', default='1,10,50,100', help='Comma-separated numbers of C&I buses.')
+@click.option('--technologies', default='6', help='Comma-separated palette sizes.')
+@click.option('--snapshots', type=int, default=8760, help='Number of snapshots.')
+@click.option('--repeats', type=int, default=3, help='Timings per case (the best is reported).')
+def main(buses, technologies, snapshots, repeats):
+    # n.add warns for every attribute of the synthetic model that is not a pypsa default
+    logging.getLogger('pypsa').setLevel(logging.ERROR)
+
+    results = pd.DataFrame([
+        time_cost_summary(int(b), int(t), snapshots, repeats)
+        for b in buses.split(',') for t in technologies.split(',')
+    ])
+    results['ms_per_asset'] = 1e3 * results.seconds / results.ci_assets
+    print(results.to_string(index=False, float_format='{:.3f}'.format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''Micro-benchmark of PrepareNetworkForCFE against the number of C&I buses and the palette size
+
+    python -m benchmarks.prepare_network --buses 1,10,50 --technologies 2,6,12
+'''
+import logging
+import time
+
+import click
+import pandas as pd
+
+from docs import simple_model
+from src import cfe
+
+
+def time_prepare(n_buses: int, n_technologies: int, n_snapshots: int, repeats: int) -> dict:
+    '''Returns the best of `repeats` timings of PrepareNetworkForCFE on a synthetic stock model
+    '''
+    base = simple_model.MakeStockNetwork(n_buses, n_technologies, n_snapshots)
+    palette = simple_model.palette(base, n_technologies)
+
+    timings = []
+    for _ in range(repeats):
+        n = base.copy()
+        start = time.perf_counter()
+        cfe.PrepareNetworkForCFE(n, list(base.buses.index), 0.2, palette, True)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'buses': n_buses,
+        'technologies': len(palette),
+        'snapshots': n_snapshots,
+        'components_added': sum(len(n.static(c)) - len(base.static(c)) for c in cfe.CI_COMPONENTS),
+        'seconds': min(timings),
+    }
+
+
+@click.command()
+@click.option('--buses', default='1,5,20,50', help='Comma-separated numbers of C&I buses.')
+@click.option('--technologies', default='2,6,12', help='Comma-separated palette sizes.')
+@click.option('--snapshots', type=int, default=8760, help='Number of snapshots.')
+@click.option('--repeats', type=int, default=3, help='Timings per case (the best is reported).')
+def main(buses, technologies, snapshots, repeats):
+    # n.add warns for every attribute of the synthetic model that is not a pypsa default
+    logging.getLogger('pypsa').setLevel(logging.ERROR)
+
+    results = pd.DataFrame([
+        time_prepare(int(b), int(t), snapshots, repeats)
+        for b in buses.split(',') for t in technologies.split(',')
+    ])
+    results['ms_per_bus'] = 1e3 * results.seconds / results.buses
+    print(results.to_string(index=False, float_format='{:.3f}'.format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+'''End-to-end benchmark of the CFE pipeline on reduced slices of the bundled stock models
+
+    python -m benchmarks.stock_models run --tier week --output stock.json
+    python -m benchmarks.stock_models run --tier japan --update-references
+
+Every case runs build -> brownfield -> RES100 -> CFE -> postprocess on the first run of the example
+config of a stock model (see MODELS), cut to the first `hours` snapshots and solved with HiGHS. The
+stages are recorded with trace.Tracer, so each case reports the wall time, CPU time and peak memory
+of every stage. Cases run one at a time in a fresh process, so that the peak memory of a case is its
+own.
+
+The key outputs of each case (objectives, CFE score, C&I capacity and cost) are checked against
+the reference values in REFERENCES: a speed-up must not change the results. A case without reference
+values fails before anything runs, until they are recorded with --update-references. Run from the root
+of the repository (the plots read their fonts from ./assets).
+'''
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import pandas as pd
+
+from benchmarks.suite import metadata
+from src import helpers, trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# example config of each stock model, of which the first run is benchmarked
+MODELS = {
+    'ASEAN': 'configs.asean.example.yaml',
+    'India': 'configs.india.example.yaml',
+    'Japan': 'configs.japan.example.yaml',
+    'Taiwan': 'configs.taiwan.example.yaml',
+}
+
+# (stock model, hours) of the cases of each tier; None is every snapshot of the stock model
+TIERS = {
+    'week': [(model, 168) for model in MODELS],
+    'month': [(model, 672) for model in MODELS],
+    # the largest model (361 generators, 17,520 snapshots) at increasing lengths
+    'japan': [('Japan', hours) for hours in [168, 672, 2184, 8760, None]],
+}
+
+CFE_SCORE = 0.9
+
+# stages of the pipeline, as recorded in the trace of a case
+PIPELINE = ['build', 'brownfield', 'RES100', 'CFE', 'postprocess']
+
+REFERENCES = os.path.join(ROOT, 'benchmarks', 'references', 'stock_models.json')
+
+# relative tolerance of the outputs against their reference values (HiGHS ipm_optimality_tolerance is 1e-4)
+RTOL = 1e-3
+
+
+def case_name(model: str, hours: int) -> str:
+    return f'{model}-{hours or "full"}'
+
+
+def make_configs(model: str, hours: int, path_to_output: str) -> tuple:
+    '''Returns the run and configs of a case: the first run of the example config of `model`, on its
+    first `hours` snapshots, with a single CFE score and HiGHS
+    '''
+    configs = helpers.load_configs(os.path.join(ROOT, MODELS[model]))
+    name = case_name(model, hours)
+    path_to_model = os.path.join(ROOT, 'stock_models', model)
+    if hours is None:
+        hours = len(pd.read_csv(os.path.join(path_to_model, 'snapshots.csv')))
+
+    configs['paths'].update(
+        path_to_model=path_to_model,
+        brownfield_models=os.path.join(path_to_output, 'brownfield') + os.sep,
+        output_model_runs=path_to_output + os.sep,
+    )
+    configs['global_vars'].update(
+        timesteps=hours,
+        background_export=False,
+        parametric_cfe_sweep=False,
+    )
+    configs.setdefault('time_aggregation', {})['enable'] = False
+    configs.setdefault('cache', {})['enable'] = False
+    configs['cache'].setdefault('stock_models', {})['enable'] = False
+    if configs['solver']['name'] != 'highs':
+        configs['solver'] = {'name': 'highs', 'options': 'highs-default'}
+
+    run = {**configs['model_runs'][0], 'name': name, 'cfe_score': [CFE_SCORE]}
+    configs['model_runs'] = [run]
+    return run, configs
+
+
+def run_case(model: str, hours: int) -> dict:
+    '''Runs the pipeline on a case and returns the time and memory of its stages and its key outputs
+    '''
+    # the full stack is only loaded in the process of the case
+    import main
+    from run import run_scenarios
+    from src import cfe, get, postprocess, solver
+
+    logging.getLogger('pypsa').setLevel(logging.ERROR)
+    logging.getLogger('linopy').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run, configs = make_configs(model, hours, tmp)
+        ci_identifier = configs['global_vars']['ci_label']
+        path_to_run_dir = os.path.join(tmp, run['name'])
+        helpers.setup_dir(os.path.join(path_to_run_dir, 'solved_networks'))
+
+        with trace.Tracer(path_to_run_dir, run=run['name']) as tracer:
+            with trace.stage('build'):
+                main.build_brownfield_network(run, configs)
+            with trace.stage('brownfield'):
+                N_BROWNFIELD = run_scenarios.RunBrownfieldSimulation(run, configs)
+            with trace.stage('RES100'):
+                N_RES_100 = run_scenarios.RunRES100(
+                    helpers.fork_network(N_BROWNFIELD), ci_identifier=ci_identifier, run=run, configs=configs,
+                )
+            with trace.stage('CFE'):
+                N_CFE = run_scenarios.RunCFE(
+                    helpers.fork_network(N_BROWNFIELD), CFE_SCORE, ci_identifier, run, configs,
+                )
+            with trace.stage('postprocess'):
+                postprocess.plot_results(path_to_run_dir, run, run['nodes_with_ci_load'][0])
+
+        records = trace.read(path_to_run_dir)
+        stages = tracer.summary()
+        solves = solver.collect_stats(path_to_run_dir)
+
+    pipeline = records[records.parent.isna()].set_index('stage').reindex(PIPELINE)
+    ci_generators = cfe.get_ci_components(N_CFE, 'Generator', ci_identifier=ci_identifier)
+    ci_storage_units = cfe.get_ci_components(N_CFE, 'StorageUnit', ci_identifier=ci_identifier)
+    return {
+        'case': run['name'],
+        'model': model,
+        'hours': configs['global_vars']['timesteps'],
+        'size': {
+            'buses': len(N_CFE.buses),
+            'generators': len(N_CFE.generators),
+            'storage_units': len(N_CFE.storage_units),
+            'links': len(N_CFE.links),
+            'snapshots': len(N_CFE.snapshots),
+        },
+        'pipeline': pipeline[['wall_s', 'cpu_s', 'peak_rss_mb']].to_dict(orient='index'),
+        'stages': stages.to_dict(orient='index'),
+        'peak_rss_mb': float(records.peak_rss_mb.max()),
+        'solves': len(solves),
+        'outputs': {
+            'objective_brownfield': float(N_BROWNFIELD.objective),
+            'objective_res100': float(N_RES_100.objective),
+            'objective_cfe': float(N_CFE.objective),
+            'cfe_score': float(get.get_cfe_score_ts(N_CFE, run, ci_identifier)['CFE Score'].mean()),
+            'ci_generator_capacity_mw': float(N_CFE.generators.p_nom_opt[ci_generators].sum()),
+            'ci_storage_capacity_mw': float(N_CFE.storage_units.p_nom_opt[ci_storage_units].sum()),
+            'ci_procurement_cost_musd': float(
+                get.get_total_ci_procurement_cost(N_CFE)['annual_system_cost [M$]'].sum()
+            ),
+            'annual_system_cost_musd': float(
+                get.get_total_annual_system_cost(N_CFE)['annual_system_cost [M$]'].sum()
+            ),
+        },
+    }
+
+
+def check_outputs(outputs: dict, reference: dict, rtol: float) -> pd.DataFrame:
+    '''Returns the outputs of a case next to their reference values, and whether they are within `rtol`
+    '''
+    check = pd.DataFrame({'value': pd.Series(outputs, dtype=float), 'reference': pd.Series(reference, dtype=float)})
+    scale = check[['value', 'reference']].abs().max(axis=1).clip(lower=1.0)
+    check['ok'] = (check.value - check.reference).abs() <= rtol * scale
+    return check
+
+
+def load_references() -> dict:
+    if not os.path.exists(REFERENCES):
+        return {}
+    with open(REFERENCES) as f:
+        return json.load(f)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--tier', type=click.Choice(list(TIERS)), default='week', help='Cases to run (see TIERS).')
+@click.option('--models', default=','.join(MODELS), help='Comma-separated stock models of the tier to run.')
+@click.option('--rtol', type=float, default=RTOL, help='Relative tolerance of the outputs against their references.')
+@click.option('--update-references', is_flag=True, help='Store the outputs of these cases as their reference values.')
+@click.option('--output', default='benchmark_stock_models.json', help='Path of the JSON file with the results.')
+def run(tier, models, rtol, update_references, output):
+    '''Runs the pipeline on the cases of a tier and checks their outputs against the references
+    '''
+    models = [m for m in models.split(',') if m]
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise click.BadParameter(f'unknown stock models {sorted(unknown)}', param_hint='--models')
+
+    references = load_references()
+    cases = [(m, h) for m, h in TIERS[tier] if m in models]
+    missing = [case_name(m, h) for m, h in cases if case_name(m, h) not in references]
+    if missing and not update_references:
+        # without references, a change of the results would go unnoticed
+        raise click.ClickException(
+            f'No reference values for {", ".join(missing)} in {REFERENCES}: '
+            'record them with --update-references on a trusted commit'
+        )
+
+    benchmark = {'metadata': metadata(), 'tier': tier, 'rtol': rtol, 'cases': []}
+    failed = []
+    for model, hours in cases:
+        name = case_name(model, hours)
+        print(f'Benchmarking {name}')
+        # in a fresh process, so that the peak memory is that of this case only
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            case = pool.submit(run_case, model, hours).result()
+        benchmark['cases'].append(case)
+
+        print(pd.DataFrame(case['pipeline']).T.to_string(float_format='{:.2f}'.format))
+        if not update_references:
+            check = check_outputs(case['outputs'], references[name], rtol)
+            case['check'] = bool(check.ok.all())
+            print(check.to_string(float_format='{:.4g}'.format))
+            if not case['check']:
+                failed.append(name)
+
+    with open(output, 'w') as f:
+        json.dump(benchmark, f, indent=2)
+    print(f'Saved results to {output}')
+
+    if update_references:
+        references.update({case['case']: case['outputs'] for case in benchmark['cases']})
+        os.makedirs(os.path.dirname(REFERENCES), exist_ok=True)
+        with open(REFERENCES, 'w') as f:
+            json.dump(references, f, indent=2, sort_keys=True)
+        print(f'Updated the reference values in {REFERENCES}')
+
+    if failed:
+        print(f'Outputs differ from their references for {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
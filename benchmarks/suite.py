@@ -0,0 +1,405 @@
+'''Benchmark suite of the CFE pipeline on synthetic networks of increasing size
+
+    python -m benchmarks.suite run --scale buses,snapshots --output bench.json
+    python -m benchmarks.suite compare base.json bench.json
+    python -m benchmarks.suite startup
+
+Every case is a synthetic stock model (see simple_model.MakeStockNetwork) that differs from BASE_CASE
+in one dimension of SCALING. For each case, PrepareNetworkForCFE, create_model, apply_cfe_constraint,
+GetGridCFE, one full RunCFE and the get.py metrics are timed with HiGHS, so no Gurobi licence is
+needed. Results are written as JSON, with the git commit and package versions, so that the files of
+two commits can be compared.
+
+`startup` times `main.py <subcommand> --help` for every subcommand, and fails if importing main.py
+loads any of HEAVY_MODULES: subcommands import the solve and plotting code when they run.
+'''
+import importlib.metadata
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import pandas as pd
+
+# parameters of the synthetic network of every case, unless scaled
+BASE_CASE = {
+    'buses': 4,
+    'technologies': 6,
+    'generators': 1,  # per technology and bus
+    'snapshots': 168,
+    'ci_buses': 1,
+    'palette': 4,  # generator technologies procured by C&I buses (plus batteries)
+}
+
+# values of each dimension that is scaled, one case per value
+SCALING = {
+    'buses': [1, 4, 16, 32],
+    'generators': [1, 2, 4],
+    'snapshots': [168, 672, 2184],
+    'ci_buses': [1, 2, 4],
+    'palette': [2, 4, 6],
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# subcommands of main.py whose startup is timed
+COMMANDS = ['build-brownfield', 'solve-brownfield', 'solve-brownfield-cfe', 'run-full-cfe', 'run-plots']
+
+# modules that must not be loaded by importing main.py
+HEAVY_MODULES = [
+    'gurobipy', 'highspy', 'pypsa', 'linopy', 'tz_pypsa', 'xarray', 'pyarrow', 'matplotlib', 'seaborn', 'plotly',
+]
+
+CFE_SCORE = 0.9
+CI_LOAD_FRACTION = 0.2
+CI_IDENTIFIER = 'C&I'
+
+# HiGHS options of the solves (as `highs-default` in the example configs, single-threaded so that
+# timings are comparable across machines). With crossover, the brownfield capacities are a vertex:
+# without it they fall slightly short of the load, which the synthetic model (without load shedding)
+# cannot meet once PostProcessBrownfield fixes them.
+SOLVER_OPTIONS = {
+    'threads': 1,
+    'solver': 'ipm',
+    'run_crossover': 'on',
+    'primal_feasibility_tolerance': 1e-5,
+    'dual_feasibility_tolerance': 1e-5,
+    'ipm_optimality_tolerance': 1e-4,
+    'random_seed': 123,
+    'log_to_console': False,
+}
+
+# get.py metrics timed on the solved CFE network, with their arguments after the network
+METRICS = {
+    'get_cfe_score_ts': lambda run: (run, CI_IDENTIFIER),
+    'get_ci_cost_summary': lambda run: (),
+    'get_emissions': lambda run: (),
+    'get_unit_cost': lambda run: (),
+    'get_ci_generation': lambda run: (),
+    'get_total_ci_procurement_cost': lambda run: (),
+    'get_total_annual_system_cost': lambda run: (),
+    'get_ci_procurement': lambda run: (CI_IDENTIFIER,),
+    'get_ci_carriers': lambda run: (),
+}
+
+
+def cases(scale: list) -> dict:
+    '''Returns the parameters of the cases that scale each of the `scale` dimensions, by case name
+    '''
+    cases = {'base': dict(BASE_CASE)}
+    for dimension in scale:
+        for value in SCALING[dimension]:
+            params = {**BASE_CASE, dimension: value}
+            params['ci_buses'] = min(params['ci_buses'], params['buses'])
+            params['palette'] = min(params['palette'], params['technologies'])
+            if params not in cases.values():
+                cases[f'{dimension}-{value}'] = params
+    return cases
+
+
+def make_configs(path_to_output: str, persistent_solver: bool = False) -> dict:
+    '''Returns the configs of a RunCFE on a synthetic network, with every brownfield constraint disabled
+    '''
+    return {
+        'paths': {'output_model_runs': path_to_output},
+        'global_vars': {
+            'year': 2030,
+            'maximum_excess_export_cfe': 0.15,
+            'persistent_solver': persistent_solver,
+        },
+        'constraints': {
+            name: {'enable': False}
+            for name in [
+                'bus_self_sufficiency', 'bus_individual_self_sufficiency', 'policy_targets',
+                'min_annual_generation', 'min_utilisation_links', 'max_utilisation_links',
+                'min_utilisation_generator', 'max_utilisation_generator', 'max_utilisation',
+                'cofiring_ccs_gen',
+            ]
+        },
+        'solver': {'name': 'highs', 'options': 'highs-benchmark'},
+        'solver_options': {'highs-benchmark': SOLVER_OPTIONS},
+    }
+
+
+def time_stage(func, repeats: int, setup=None) -> dict:
+    '''Times `func(*setup())` `repeats` times, each on new arguments from `setup` (not timed)
+
+    Returns the timings, and the result of the last call under 'result'.
+    '''
+    timings = []
+    for _ in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return {
+        'best_s': min(timings),
+        'median_s': statistics.median(timings),
+        'timings_s': timings,
+        'result': result,
+    }
+
+
+def run_case(name: str, params: dict, repeats: int, solve_repeats: int, persistent_solver: bool) -> dict:
+    '''Returns the timings of every stage of the pipeline on the synthetic network of a case
+    '''
+    # imported here, so that `compare` and `startup` do not load pypsa and the solvers
+    from docs import simple_model
+    from run import run_scenarios
+    from src import cfe, get, helpers, solver
+
+    base = simple_model.MakeStockNetwork(
+        params['buses'], params['technologies'], params['snapshots'], params['generators'],
+    )
+    ci_buses = list(base.buses.index[:params['ci_buses']])
+    palette = simple_model.palette(base, params['palette'])
+    run = {
+        'name': name,
+        'stock_model': 'synthetic',
+        'palette': 'synthetic',
+        'nodes_with_ci_load': ci_buses,
+        'ci_load_fraction': CI_LOAD_FRACTION,
+        'cfe_score': [CFE_SCORE],
+    }
+    stages = {}
+
+    def prepared():
+        n = base.copy()
+        return (n, ci_buses, CI_LOAD_FRACTION, palette, False)
+
+    stages['PrepareNetworkForCFE'] = time_stage(cfe.PrepareNetworkForCFE, repeats, prepared)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configs = make_configs(tmp, persistent_solver)
+        os.makedirs(os.path.join(tmp, name, 'solved_networks'))
+
+        # the solved brownfield network, as RunBrownfieldSimulation returns it
+        brownfield = stages['PrepareNetworkForCFE']['result']
+        brownfield.optimize.create_model()
+        stages['solve_brownfield'] = time_stage(lambda: solver.solve_network(brownfield, configs), 1)
+
+        def post_processed():
+            return (run_scenarios.PostProcessBrownfield(helpers.fork_network(brownfield), CI_IDENTIFIER),)
+
+        stages['create_model'] = time_stage(lambda n: n.optimize.create_model(), repeats, post_processed)
+
+        def with_model():
+            n = run_scenarios.PostProcessBrownfield(helpers.fork_network(brownfield), CI_IDENTIFIER)
+            n.optimize.create_model()
+            return (n, cfe.grid_cfe_matrix(0.0, ci_buses, n.snapshots))
+
+        stages['apply_cfe_constraint'] = time_stage(
+            lambda n, GridCFE: cfe.apply_cfe_constraint(
+                n, GridCFE, ci_buses, CI_IDENTIFIER, CFE_SCORE, configs['global_vars']['maximum_excess_export_cfe'],
+            ),
+            repeats,
+            with_model,
+        )
+
+        # on a fork, so that the generator map of the grid of each bus is built in every repeat
+        stages['GetGridCFE'] = time_stage(
+            lambda n: cfe.GetGridCFE(n, ci_buses, CI_IDENTIFIER), repeats, lambda: (helpers.fork_network(brownfield),),
+        )
+
+        stages['RunCFE'] = time_stage(
+            lambda n: run_scenarios.RunCFE(n, CFE_SCORE, CI_IDENTIFIER, run, configs),
+            solve_repeats,
+            lambda: (helpers.fork_network(brownfield),),
+        )
+        n_cfe = stages['RunCFE']['result']
+        solves = solver.collect_stats(os.path.join(tmp, name))
+        solves = solves[solves.network.str.startswith('hourly_matching')]
+
+    for metric, args in METRICS.items():
+        stages[f'get.{metric}'] = time_stage(lambda: getattr(get, metric)(n_cfe, *args(run)), repeats)
+
+    ci_generators = cfe.get_ci_components(n_cfe, 'Generator', ci_identifier=CI_IDENTIFIER)
+    cfe_score = stages['get.get_cfe_score_ts']['result']
+    return {
+        'case': name,
+        'params': params,
+        'size': {
+            'buses': len(n_cfe.buses),
+            'generators': len(n_cfe.generators),
+            'storage_units': len(n_cfe.storage_units),
+            'links': len(n_cfe.links),
+            'snapshots': len(n_cfe.snapshots),
+            'ci_components': sum(len(cfe.get_ci_components(n_cfe, c, ci_identifier=CI_IDENTIFIER)) for c in cfe.CI_COMPONENTS),
+        },
+        'stages': {
+            stage: {k: v for k, v in timing.items() if k != 'result'} for stage, timing in stages.items()
+        },
+        'results': {
+            'objective_brownfield': stages['solve_brownfield']['result']['objective'],
+            'objective_cfe': float(n_cfe.objective),
+            'iterations': len(solves),
+            'solver_time_s': float(solves.solver_time_s.sum()),
+            'cfe_score': float(cfe_score['CFE Score'].mean()),
+            'ci_capacity_mw': float(n_cfe.generators.p_nom_opt[ci_generators].sum()),
+        },
+    }
+
+
+def metadata() -> dict:
+    '''Returns the commit, package versions and machine of a benchmark run
+    '''
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    versions = {}
+    for package in ['pypsa', 'linopy', 'highspy', 'pandas', 'numpy', 'xarray']:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': None if status is None else bool(status),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+    }
+
+
+def to_frame(benchmark: dict) -> pd.DataFrame:
+    '''Returns the best timing of every case and stage of a benchmark file, one row each
+    '''
+    return pd.DataFrame([
+        {'case': case['case'], 'stage': stage, 'best_s': timing['best_s']}
+        for case in benchmark['cases'] for stage, timing in case['stages'].items()
+    ])
+
+
+@click.group()
+def cli():
+    # n.add warns for every attribute of the synthetic model that is not a pypsa default
+    logging.getLogger('pypsa').setLevel(logging.ERROR)
+    logging.getLogger('linopy').setLevel(logging.ERROR)
+
+
+@cli.command()
+@click.option('--scale', default=','.join(SCALING), help=f'Comma-separated dimensions to scale ({", ".join(SCALING)}).')
+@click.option('--repeats', type=int, default=3, help='Timings per stage (the best is reported).')
+@click.option('--solve-repeats', type=int, default=1, help='Timings of RunCFE per case.')
+@click.option('--persistent-solver', is_flag=True, help='Solve the GridCFE iterations with a persistent HiGHS model.')
+@click.option('--output', default='benchmark.json', help='Path of the JSON file with the results.')
+def run(scale, repeats, solve_repeats, persistent_solver, output):
+    '''Times the pipeline on the synthetic cases and writes the results to a JSON file
+    '''
+    scale = [s for s in scale.split(',') if s]
+    unknown = set(scale) - set(SCALING)
+    if unknown:
+        raise click.BadParameter(f'unknown dimensions {sorted(unknown)}', param_hint='--scale')
+
+    benchmark = {'metadata': metadata(), 'cases': []}
+    for name, params in cases(scale).items():
+        print(f'Benchmarking {name}: {params}')
+        benchmark['cases'].append(run_case(name, params, repeats, solve_repeats, persistent_solver))
+
+    with open(output, 'w') as f:
+        json.dump(benchmark, f, indent=2)
+
+    results = to_frame(benchmark).pivot(index='stage', columns='case', values='best_s')
+    print(results[list(cases(scale))].to_string(float_format='{:.3f}'.format))
+    print(f'Saved results to {output}')
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True))
+@click.argument('candidate', type=click.Path(exists=True))
+@click.option('--threshold', type=float, default=0.1, help='Relative change of a timing reported as a regression or speed-up.')
+def compare(baseline, candidate, threshold):
+    '''Compares the timings and results of two benchmark files (e.g. of two commits)
+    '''
+    with open(baseline) as f:
+        old = json.load(f)
+    with open(candidate) as f:
+        new = json.load(f)
+
+    print(f"baseline:  {old['metadata']['commit']} ({old['metadata']['timestamp']})")
+    print(f"candidate: {new['metadata']['commit']} ({new['metadata']['timestamp']})")
+    for package, version in new['metadata']['versions'].items():
+        if old['metadata']['versions'].get(package) != version:
+            print(f"  {package}: {old['metadata']['versions'].get(package)} -> {version}")
+
+    timings = to_frame(old).merge(to_frame(new), on=['case', 'stage'], how='outer', suffixes=('_old', '_new'))
+    timings['ratio'] = timings.best_s_new / timings.best_s_old
+    timings['change'] = ''
+    timings.loc[timings.ratio > 1 + threshold, 'change'] = 'slower'
+    timings.loc[timings.ratio < 1 - threshold, 'change'] = 'faster'
+    print(timings.to_string(index=False, float_format='{:.3f}'.format))
+
+    # the outputs of the solves must not change with a speed-up
+    results = pd.DataFrame(
+        {case['case']: case['results'] for case in old['cases']}
+    ).stack().rename('old').to_frame().join(
+        pd.DataFrame({case['case']: case['results'] for case in new['cases']}).stack().rename('new'), how='outer',
+    )
+    changed = results[~results.apply(lambda r: _close(r.old, r.new), axis=1)]
+    if changed.empty:
+        print('Results are unchanged.')
+    else:
+        print('Results changed:')
+        print(changed.to_string())
+
+
+@cli.command()
+@click.option('--repeats', type=int, default=5, help='Timings per command (the best is reported).')
+@click.option('--max-seconds', type=float, default=1.0, help='Startup time above which a command fails the check.')
+@click.option('--output', default=None, help='Path of a JSON file with the results.')
+def startup(repeats, max_seconds, output):
+    '''Times the startup of every subcommand of main.py and checks which modules it loads
+    '''
+    commands = {'import main': ['-c', 'import main']}
+    commands.update({command: ['main.py', command, '--help'] for command in COMMANDS})
+    timings = {
+        command: {k: v for k, v in time_stage(lambda: _run_python(args), repeats).items() if k != 'result'}
+        for command, args in commands.items()
+    }
+    loaded = [
+        module for module in _run_python(['-c', 'import sys, main; print(*sys.modules)']).split()
+        if module in HEAVY_MODULES
+    ]
+
+    results = pd.DataFrame(timings).T[['best_s', 'median_s']]
+    print(results.to_string(float_format='{:.3f}'.format))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'metadata': metadata(), 'startup': timings, 'loaded': loaded}, f, indent=2)
+        print(f'Saved results to {output}')
+
+    slow = list(results.index[results.best_s > max_seconds])
+    if loaded:
+        print(f'Importing main.py loads {", ".join(loaded)}')
+    if slow:
+        print(f'Startup above {max_seconds}s: {", ".join(slow)}')
+    if loaded or slow:
+        sys.exit(1)
+
+
+def _run_python(args: list) -> str:
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+
+
+def _close(old, new, rtol: float = 1e-4) -> bool:
+    if pd.isna(old) or pd.isna(new):
+        return pd.isna(old) and pd.isna(new)
+    return abs(new - old) <= rtol * max(abs(old), abs(new), 1.0)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,11 +1,44 @@
-import pypsa
+'''A simple model to explain the methodology (see README.md), and a scalable synthetic stock model
+
+MakeNetwork builds the four-snapshot example of the README; running this file solves it for the
+brownfield, 100% RES and CFE scenarios with Gurobi. MakeStockNetwork builds a network with the
+attributes of a tza-pypsa stock model at any size, on which the CFE pipeline runs as on a stock model.
+'''
 import logging
+
+import numpy as np
 import pandas as pd
+import pypsa
+
+# (type, carrier, co2 emissions, renewable) of the generator technologies in a synthetic stock model
+GENERATOR_TECHNOLOGIES = [
+    ('solar-unspecified', 'solar', 0.0, True),
+    ('onshorewind-unspecified', 'onwind', 0.0, True),
+    ('offshorewind-unspecified', 'offwind', 0.0, True),
+    ('nuclear-unspecified', 'nuclear', 0.0, False),
+    ('gas-ccgt', 'gas', 0.37, False),
+    ('coal-unspecified', 'coal', 0.9, False),
+]
+
+# (type, carrier, max hours) of the storage technologies
+STORAGE_TECHNOLOGIES = [
+    ('lithium-ion', 'Batteries', 4),
+    ('pumped-hydro', 'PHS', 8),
+]
+
+# nice names of the carriers, as used by the plotting colour palette
+NICE_NAMES = {
+    'solar': 'Solar',
+    'onwind': 'Onshore Wind',
+    'offwind': 'Offshore Wind',
+    'nuclear': 'Nuclear',
+    'gas': 'Gas',
+    'coal': 'Coal',
+    'Batteries': 'Batteries',
+    'PHS': 'Pumped Hydro',
+    'AC': 'AC',
+}
 
-logging.basicConfig(level=logging.CRITICAL + 1)
-logging.getLogger("gurobipy").disabled = True
-logging.getLogger("linopy").disabled = True
-logging.getLogger("pypsa").disabled = True
 
 def MakeNetwork():
 
@@ -119,71 +152,227 @@ def MakeNetwork():
 
     return n
 
-brownfield = MakeNetwork()
-# optimise
-brownfield.optimize(solver_name='gurobi', solver_options={'log_to_console': False})
 
-res_100 = MakeNetwork()
+def MakeStockNetwork(
+        n_buses: int = 1,
+        n_technologies: int = 4,
+        n_snapshots: int = 8760,
+        generators_per_technology: int = 1,
+        seed: int = 0,
+    ) -> pypsa.Network:
+    '''Returns a synthetic network with the attributes of a tza-pypsa stock model, scaled in buses,
+    technologies, generators and snapshots (e.g. for the benchmarks and tests)
+
+    Every bus has a load named after the bus, fixed and extendable generators of `n_technologies`
+    technologies (cycling through GENERATOR_TECHNOLOGIES, with numbered variants beyond that) and
+    extendable storage units. Buses are connected in a ring by links.
+    '''
+    rng = np.random.default_rng(seed)
+    n = pypsa.Network()
+    n.set_snapshots(pd.date_range('2030-01-01', periods=n_snapshots, freq='h'))
+    hours = n.snapshots.hour.values
+    days = n.snapshots.dayofyear.values
+
+    technologies = [
+        (f'{t}-{i // len(GENERATOR_TECHNOLOGIES)}' if i >= len(GENERATOR_TECHNOLOGIES) else t, c, co2, re)
+        for i, (t, c, co2, re) in (
+            (i, GENERATOR_TECHNOLOGIES[i % len(GENERATOR_TECHNOLOGIES)]) for i in range(n_technologies)
+        )
+    ]
+    carriers = sorted({c for _, c, _, _ in technologies} | {c for _, c, _ in STORAGE_TECHNOLOGIES} | {'AC'})
+    co2 = {c: e for _, c, e, _ in technologies}
+    n.add(
+        'Carrier',
+        carriers,
+        co2_emissions=[co2.get(c, 0.0) for c in carriers],
+        nice_name=[NICE_NAMES.get(c, c) for c in carriers],
+    )
 
-res_100.optimize.create_model()
+    buses = pd.Index([f'BUS{i:03d}' for i in range(n_buses)])
+    n.add('Bus', buses, x=rng.uniform(0, 10, n_buses), y=rng.uniform(0, 10, n_buses), carrier='AC')
+
+    demand = 1000 * (1 + 0.2 * np.sin(2 * np.pi * days / 365))[:, None] * (
+        1 + 0.1 * np.sin(2 * np.pi * (hours - 8) / 24)
+    )[:, None] * rng.uniform(0.5, 1.5, n_buses)
+    n.add('Load', buses, bus=buses, p_set=pd.DataFrame(demand, index=n.snapshots, columns=buses))
+
+    rows, profiles = [], {}
+    for bus in buses:
+        for t, c, e, renewable in technologies:
+            for k in range(generators_per_technology):
+                for status, extendable in [('existing', False), ('ext', True)]:
+                    name = f'{bus} {t} {status} {k}'
+                    rows.append({
+                        'name': name, 'bus': bus, 'type': t, 'carrier': c,
+                        'p_nom': 0.0 if extendable else rng.uniform(100, 500),
+                        'p_nom_extendable': extendable,
+                        'capital_cost': rng.uniform(5e4, 2e5),
+                        'marginal_cost': 0.0 if renewable else rng.uniform(20, 80),
+                        'efficiency': 1.0 if renewable else 0.45,
+                        'build_year': 2030, 'lifetime': 25,
+                        'p_min_pu': 0.0, 'ramp_limit_up': np.nan, 'ramp_limit_down': np.nan,
+                        'start_up_cost': 0.0, 'shut_down_cost': 0.0, 'committable': False,
+                        'ramp_limit_start_up': 1.0, 'ramp_limit_shut_down': 1.0,
+                        'min_up_time': 0, 'min_down_time': 0,
+                        'is_blend_or_ccs': False, 'generation_blend_share': 0.0,
+                        'min_utilisation_rate': 0.0, 'max_utilisation_rate': 1.0,
+                    })
+                    if renewable:
+                        if c == 'solar':
+                            cf = np.clip(np.sin(2 * np.pi * (hours - 6) / 24), 0, None)
+                        else:
+                            cf = 0.4 + 0.3 * np.sin(2 * np.pi * days / 365 + rng.uniform(0, 6))
+                        profiles[name] = np.clip(cf * rng.uniform(0.7, 1.0, n_snapshots), 0, 1)
+
+    generators = pd.DataFrame(rows).set_index('name')
+    n.add('Generator', generators.index, **generators)
+    n.generators_t.p_max_pu = pd.DataFrame(profiles, index=n.snapshots)
+
+    rows = []
+    for bus in buses:
+        for t, c, max_hours in STORAGE_TECHNOLOGIES:
+            rows.append({
+                'name': f'{bus} {t}', 'bus': bus, 'type': t, 'carrier': c,
+                'p_nom': 0.0, 'p_nom_extendable': 'lithium' in t, 'max_hours': max_hours,
+                'capital_cost': rng.uniform(2e4, 8e4), 'build_year': 2030, 'lifetime': 15,
+                'efficiency_store': 0.95, 'efficiency_dispatch': 0.95, 'standing_loss': 0.0,
+            })
+    storage_units = pd.DataFrame(rows).set_index('name')
+    n.add('StorageUnit', storage_units.index, **storage_units)
+
+    if n_buses > 1:
+        neighbours = np.roll(buses, -1)
+        n.add(
+            'Link',
+            [f'{a}-{b}' for a, b in zip(buses, neighbours)],
+            bus0=buses,
+            bus1=neighbours,
+            p_nom=rng.uniform(200, 800, n_buses),
+            capital_cost=1e4,
+            carrier='AC',
+        )
 
-# add 100% RES constraint
-sum_ci_load = res_100.loads_t.p_set['C&I Load'].sum()
+    return n
 
-sum_ppa_procured = (
-    res_100
-    .model
-    .variables['Generator-p']
-    .sel(
-        Generator='C&I PPA'
-        )
-    .sum()
-)
 
-res_100.model.add_constraints(
-    sum_ppa_procured >= sum_ci_load,
-    name = '100_RES_constraint',
-)
+def palette(n: pypsa.Network, n_technologies: int) -> list:
+    '''Returns a technology palette of the first `n_technologies` technologies and one storage technology
+    '''
+    types = list(dict.fromkeys(n.generators.type))[:n_technologies]
+    return types + [STORAGE_TECHNOLOGIES[0][1]]
+
+
+def add_solution(n: pypsa.Network, seed: int = 0) -> pypsa.Network:
+    '''Fills a network with a random (but physically plausible) solution, for benchmarks of the
+    postprocessing without solving
+
+    Optimal capacities are the existing ones plus a random expansion, dispatch stays under the
+    available capacity, every load is served and every bus gets a marginal price.
+    '''
+    rng = np.random.default_rng(seed)
+    T = len(n.snapshots)
+
+    for c in ['Generator', 'StorageUnit', 'Link']:
+        static = n.static(c)
+        static['p_nom_opt'] = static.p_nom + rng.uniform(0, 100, len(static)) * static.p_nom_extendable
+
+    generators = n.generators
+    p_max_pu = pd.DataFrame(np.repeat(generators.p_max_pu.values[None, :], T, axis=0), index=n.snapshots, columns=generators.index)
+    p_max_pu.update(n.generators_t.p_max_pu)
+    n.generators_t.p = p_max_pu * generators.p_nom_opt * rng.uniform(0, 1, (T, len(generators)))
+
+    storage_units = n.storage_units
+    n.storage_units_t.p_dispatch = pd.DataFrame(
+        rng.uniform(0, 1, (T, len(storage_units))) * storage_units.p_nom_opt.values,
+        index=n.snapshots, columns=storage_units.index,
+    )
+
+    links = n.links
+    p0 = pd.DataFrame(
+        rng.uniform(0, 1, (T, len(links))) * links.p_nom_opt.values, index=n.snapshots, columns=links.index
+    )
+    n.links_t.p0 = p0
+    n.links_t.p1 = -p0 * links.efficiency.values
+
+    n.loads_t.p = n.get_switchable_as_dense('Load', 'p_set')
+
+    n.buses_t.marginal_price = pd.DataFrame(
+        rng.uniform(20, 120, (T, len(n.buses))), index=n.snapshots, columns=n.buses.index
+    )
+    return n
+
 
-res_100.optimize.solve_model(solver_name='gurobi', solver_options={'log_to_console': False})
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL + 1)
+    logging.getLogger("gurobipy").disabled = True
+    logging.getLogger("linopy").disabled = True
+    logging.getLogger("pypsa").disabled = True
 
-cfe = MakeNetwork()
+    brownfield = MakeNetwork()
+    # optimise
+    brownfield.optimize(solver_name='gurobi', solver_options={'log_to_console': False})
 
-cfe.optimize.create_model()
+    res_100 = MakeNetwork()
 
-CFE_TARGET = 0.9
-MAXIMUM_EXCESS = 0.2
+    res_100.optimize.create_model()
 
-# Constraint 1: Hourly matching
-#   CI_Demand[t] + PPA_StorageCharge[t] - PPA_StorageDischarge[t] = PPA[t] - Excess[t] + GridSupply[t]
+    # add 100% RES constraint
+    sum_ci_load = res_100.loads_t.p_set['C&I Load'].sum()
 
-CI_Demand = cfe.loads_t.p_set['C&I Load'].values
-CI_StorageCharge = cfe.model.variables['Link-p'].sel(Link='PPA_StorageCharge')
-CI_StorageDischarge = cfe.model.variables['Link-p'].sel(Link='PPA_StorageDischarge')
-CI_PPA = cfe.model.variables['Generator-p'].sel(Generator='C&I PPA')
-CI_Export = cfe.model.variables['Link-p'].sel(Link='C&I ExportToAnyTown')
-CI_GridImport = cfe.model.variables['Link-p'].sel(Link='C&I ImportFromAnyTown')
+    sum_ppa_procured = (
+        res_100
+        .model
+        .variables['Generator-p']
+        .sel(
+            Generator='C&I PPA'
+            )
+        .sum()
+    )
+
+    res_100.model.add_constraints(
+        sum_ppa_procured >= sum_ci_load,
+        name = '100_RES_constraint',
+    )
 
-cfe.model.add_constraints(
-    ((CI_StorageCharge - CI_StorageDischarge) + CI_Demand) == CI_PPA - CI_Export + CI_GridImport,
-    name = 'Hourly_matching_constraint',
-)
+    res_100.optimize.solve_model(solver_name='gurobi', solver_options={'log_to_console': False})
 
-# Constraint 2: CFE target
-#   SUM( PPA[t] - Excess[t] + GridSupply[t]*GridCFE[t] ) / SUM( CI_Demand[t] ) >= CFE_target
+    cfe = MakeNetwork()
 
-GRID_CFE = (brownfield.generators_t.p['AnyTown Clean Gen'] / brownfield.generators_t.p['AnyTown Dirty Gen']).values
+    cfe.optimize.create_model()
 
-cfe.model.add_constraints(
-    (CI_PPA - CI_Export + CI_GridImport * list(GRID_CFE)).sum() >= ((CI_StorageCharge - CI_StorageDischarge) + CI_Demand).sum() * CFE_TARGET,
-    name = 'CFE_target_constraint',
-)
+    CFE_TARGET = 0.9
+    MAXIMUM_EXCESS = 0.2
 
+    # Constraint 1: Hourly matching
+    #   CI_Demand[t] + PPA_StorageCharge[t] - PPA_StorageDischarge[t] = PPA[t] - Excess[t] + GridSupply[t]
 
-# Constraint 3: Total excess
-cfe.model.add_constraints(
-    CI_Export.sum() <= sum(CI_Demand) * MAXIMUM_EXCESS,
-    name = 'total_excess_constraint',
-)
+    CI_Demand = cfe.loads_t.p_set['C&I Load'].values
+    CI_StorageCharge = cfe.model.variables['Link-p'].sel(Link='PPA_StorageCharge')
+    CI_StorageDischarge = cfe.model.variables['Link-p'].sel(Link='PPA_StorageDischarge')
+    CI_PPA = cfe.model.variables['Generator-p'].sel(Generator='C&I PPA')
+    CI_Export = cfe.model.variables['Link-p'].sel(Link='C&I ExportToAnyTown')
+    CI_GridImport = cfe.model.variables['Link-p'].sel(Link='C&I ImportFromAnyTown')
+
+    cfe.model.add_constraints(
+        ((CI_StorageCharge - CI_StorageDischarge) + CI_Demand) == CI_PPA - CI_Export + CI_GridImport,
+        name = 'Hourly_matching_constraint',
+    )
+
+    # Constraint 2: CFE target
+    #   SUM( PPA[t] - Excess[t] + GridSupply[t]*GridCFE[t] ) / SUM( CI_Demand[t] ) >= CFE_target
+
+    GRID_CFE = (brownfield.generators_t.p['AnyTown Clean Gen'] / brownfield.generators_t.p['AnyTown Dirty Gen']).values
+
+    cfe.model.add_constraints(
+        (CI_PPA - CI_Export + CI_GridImport * list(GRID_CFE)).sum() >= ((CI_StorageCharge - CI_StorageDischarge) + CI_Demand).sum() * CFE_TARGET,
+        name = 'CFE_target_constraint',
+    )
+
+
+    # Constraint 3: Total excess
+    cfe.model.add_constraints(
+        CI_Export.sum() <= sum(CI_Demand) * MAXIMUM_EXCESS,
+        name = 'total_excess_constraint',
+    )
 
-cfe.optimize.solve_model(solver_name='gurobi', solver_options={'log_to_console': False})
\ No newline at end of file
+    cfe.optimize.solve_model(solver_name='gurobi', solver_options={'log_to_console': False})
@@ -1,11 +1,13 @@
+import copy
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import click
-import gurobipy
-import pypsa
 
-from run.run_scenarios import RunBrownfieldSimulation, RunCFE, RunRES100
-from src import brownfield, cfe, helpers, postprocess
+from src import helpers, trace
+
+# pypsa, gurobipy, the solve code (run.run_scenarios) and the plotting stack (src.postprocess) are
+# imported by the functions that use them, so that each subcommand only loads what it needs
 
 
 def build_brownfield_network(run, configs) -> None:
@@ -18,6 +20,8 @@ def build_brownfield_network(run, configs) -> None:
         None
     """
 
+    from src import brownfield
+
     brownfield_network = brownfield.SetupBrownfieldNetwork(run, configs)
     run_name = run["name"]
     output_dir = os.path.join(configs["paths"]["brownfield_models"])
@@ -25,7 +29,7 @@ def build_brownfield_network(run, configs) -> None:
     brownfield_network.export_to_netcdf(os.path.join(output_dir, f"{run_name}.nc"))
 
 
-def solve_brownfield_network(run, configs, with_cfe: bool, env=None) -> pypsa.Network:
+def solve_brownfield_network(run, configs, with_cfe: bool, env=None) -> "pypsa.Network":
     """
     Sets up and optimizes a brownfield network.
     Parameters:
@@ -35,6 +39,8 @@ def solve_brownfield_network(run, configs, with_cfe: bool, env=None) -> pypsa.Ne
     pypsa.Network: The optimized brownfield network.
     """
 
+    from src import aggregation, brownfield, cfe
+
     tza_brownfield_network = brownfield.SetupBrownfieldNetwork(run, configs)
     if with_cfe:
         final_brownfield = cfe.PrepareNetworkForCFE(
@@ -46,7 +52,8 @@ def solve_brownfield_network(run, configs, with_cfe: bool, env=None) -> pypsa.Ne
         )
     else:
         final_brownfield = tza_brownfield_network
-    
+
+    final_brownfield = aggregation.AggregateSnapshots(final_brownfield, configs)
     final_brownfield.optimize.create_model()
     brownfield.ApplyBrownfieldConstraints(final_brownfield, run, configs)
 
@@ -59,48 +66,326 @@ def solve_brownfield_network(run, configs, with_cfe: bool, env=None) -> pypsa.Ne
     return final_brownfield
 
 
-def run_scenarios(configs):
-    env = None
-    if configs["solver"]["name"] == "gurobi":
+def solve_scenario(
+    scenario,
+    run,
+    configs,
+    env=None,
+    solved_network_cache=None,
+    run_key=None,
+    N_BROWNFIELD=None,
+    exporter=None,
+    checkpoint=None,
+) -> tuple:
+    """
+    Solves a single annual (RES) or hourly (CFE) matching scenario from the solved brownfield network.
+    Args:
+        scenario (tuple): ("RES", res_target), ("CFE", cfe_score) or ("CFE-sweep", cfe_scores).
+        run (dict): The run configuration.
+        configs (dict): A dictionary containing configuration parameters.
+        env (gurobipy.Env, optional): Gurobi environment. One is created if needed and not supplied.
+        solved_network_cache (cache.SolvedNetworkCache, optional): Cache in which to store the solved outputs.
+        run_key (str, optional): Cache key of the run inputs.
+        N_BROWNFIELD (pypsa.Network, optional): Solved brownfield network held in memory. The scenario
+            is solved on a fork of it; if not supplied, the brownfield is read from disk.
+        exporter (export.BackgroundExporter, optional): Exporter that writes the solved networks. If
+            not supplied, one is created for this scenario (as set by `background_export`) and
+            flushed before returning.
+        checkpoint (cache.RunManifest, optional): Checkpoints of the run, from which an interrupted
+            CFE score is resumed and in which completed stages are recorded.
+    Returns:
+        tuple: The scenario that was solved.
+    """
+
+    from run.run_scenarios import RunCFE, RunCFESweep, RunRES100
+    from src import export
+
+    kind, target = scenario
+    if env is None and configs["solver"]["name"] == "gurobi":
+        import gurobipy
         env = gurobipy.Env()
 
-    for run in configs["model_runs"]:
-        helpers.setup_dir(
-            path_to_dir=configs["paths"]["output_model_runs"]
-            + run["name"]
-            + "/solved_networks/"
-        )
-        print(f"Running: {run['name']}")
-        ci_identifier = configs["global_vars"]["ci_label"]
-        N_BROWNFIELD = RunBrownfieldSimulation(run, configs, env=env)
-        RES_TARGET = 100
-        print(f"Computing annual matching scenario (RES Target: {int(RES_TARGET)}%)...")
+    own_exporter = exporter is None
+    if own_exporter:
+        exporter = export.BackgroundExporter(enable=configs["global_vars"].get("background_export", False))
+
+    ci_identifier = configs["global_vars"]["ci_label"]
+    if N_BROWNFIELD is None:
         N_BROWNFIELD_original = helpers.load_brownfield_network(run, configs)
+    else:
+        N_BROWNFIELD_original = helpers.fork_network(N_BROWNFIELD)
+    if kind == "RES":
+        print(f"Computing annual matching scenario (RES Target: {int(target)}%)...")
         RunRES100(
             N_BROWNFIELD_original,
             ci_identifier=ci_identifier,
             run=run,
-            res_target=RES_TARGET,
+            res_target=target,
             configs=configs,
             env=env,
+            exporter=exporter,
+            checkpoint=checkpoint,
         )
-        for CFE_Score in run["cfe_score"]:
-            print(f"Computing hourly matching scenario (CFE: {int(CFE_Score*100)}...")
-            N_BROWNFIELD_original = helpers.load_brownfield_network(run, configs)
-            RunCFE(
-                N_BROWNFIELD_original,
-                CFE_Score=CFE_Score,
-                ci_identifier=ci_identifier,
-                run=run,
-                configs=configs,
+    elif kind == "CFE":
+        print(f"Computing hourly matching scenario (CFE: {int(target*100)}...")
+        RunCFE(
+            N_BROWNFIELD_original,
+            CFE_Score=target,
+            ci_identifier=ci_identifier,
+            run=run,
+            configs=configs,
+            env=env,
+            exporter=exporter,
+            checkpoint=checkpoint,
+        )
+    else:
+        print(f"Computing hourly matching scenarios (CFE: {[int(i*100) for i in target]}) on a single model...")
+        RunCFESweep(
+            N_BROWNFIELD_original,
+            CFE_Scores=target,
+            ci_identifier=ci_identifier,
+            run=run,
+            configs=configs,
+            env=env,
+            exporter=exporter,
+            checkpoint=checkpoint,
+        )
+
+    # the solved networks must be written before they are cached (or the pool worker returns)
+    if own_exporter:
+        exporter.close()
+    elif solved_network_cache is not None:
+        exporter.flush()
+
+    if solved_network_cache is not None:
+        path_to_run_dir = os.path.join(configs["paths"]["output_model_runs"], run["name"])
+        stages = [("CFE", i) for i in target] if kind == "CFE-sweep" else [scenario]
+        for stage in stages:
+            solved_network_cache.store(run_key, stage, path_to_run_dir, configs)
+    return scenario
+
+
+def solve_scenarios(
+    scenarios, run, configs, env=None, solved_network_cache=None, run_key=None, N_BROWNFIELD=None, exporter=None, checkpoint=None
+) -> list:
+    """
+    Solves independent scenarios of a run one after the other. A scenario that fails is reported and
+    the next one is solved, as in solve_scenarios_in_pool.
+    Args:
+        scenarios (list): Scenarios as accepted by solve_scenario.
+        run (dict): The run configuration.
+        configs (dict): A dictionary containing configuration parameters.
+        The other arguments are passed to solve_scenario.
+    Returns:
+        list: (scenario, error) tuples for every scenario that failed.
+    """
+
+    failures = []
+    for scenario in scenarios:
+        kind, target = scenario
+        try:
+            solve_scenario(
+                scenario,
+                run,
+                configs,
                 env=env,
+                solved_network_cache=solved_network_cache,
+                run_key=run_key,
+                N_BROWNFIELD=N_BROWNFIELD,
+                exporter=exporter,
+                checkpoint=checkpoint,
             )
+            print(f"Finished {kind} {target} for {run['name']}")
+        except Exception as e:
+            print(f"Failed {kind} {target} for {run['name']}: {e!r}")
+            failures.append((scenario, e))
+    return failures
+
+
+def solve_scenarios_in_pool(
+    scenarios, run, configs, workers: int, solved_network_cache=None, run_key=None, checkpoint=None
+) -> list:
+    """
+    Solves independent scenarios of a run in a process pool. Solver threads are split across
+    the workers so that the pool does not oversubscribe the machine.
+    Args:
+        scenarios (list): Scenarios as accepted by solve_scenario.
+        run (dict): The run configuration.
+        configs (dict): A dictionary containing configuration parameters.
+        workers (int): Number of worker processes.
+        solved_network_cache (cache.SolvedNetworkCache, optional): Cache in which to store the solved outputs.
+        run_key (str, optional): Cache key of the run inputs.
+        checkpoint (cache.RunManifest, optional): Checkpoints of the run. Workers store GridCFE
+            checkpoints; the stages of a scenario are recorded here once its worker returns.
+    Returns:
+        list: (scenario, error) tuples for every scenario that failed.
+    """
+
+    workers = min(workers, len(scenarios))
+    options = configs["solver"]["options"]
+    worker_configs = copy.deepcopy(configs)
+    worker_configs["solver_options"][options] = helpers.split_solver_threads(
+        configs["solver_options"][options], workers
+    )
+
+    failures = []
+    # the workers record their stages to the trace of the run
+    with ProcessPoolExecutor(max_workers=workers, initializer=trace.activate, initargs=(trace.active(),)) as pool:
+        futures = {
+            pool.submit(
+                solve_scenario,
+                scenario,
+                run,
+                worker_configs,
+                solved_network_cache=solved_network_cache,
+                run_key=run_key,
+                checkpoint=checkpoint,
+            ): scenario
+            for scenario in scenarios
+        }
+        for future in as_completed(futures):
+            kind, target = futures[future]
+            try:
+                future.result()
+                print(f"Finished {kind} {target} for {run['name']}")
+                if checkpoint is not None:
+                    for stage in [("CFE", i) for i in target] if kind == "CFE-sweep" else [(kind, target)]:
+                        checkpoint.complete(stage)
+            except Exception as e:
+                print(f"Failed {kind} {target} for {run['name']}: {e!r}")
+                failures.append((futures[future], e))
+    return failures
+
+
+def run_scenarios(configs, workers: int = 1, force: bool = False):
+    from run.run_scenarios import RunBrownfieldSimulation
+    from src import cache, export, postprocess, solver
+
+    env = None
+    if configs["solver"]["name"] == "gurobi":
+        import gurobipy
+        env = gurobipy.Env()
+
+    solved_network_cache = None
+    cache_configs = configs.get("cache", {})
+    if cache_configs.get("enable", False):
+        solved_network_cache = cache.SolvedNetworkCache(
+            path=cache_configs.get("path", "cache/solved_networks/"),
+            max_age_days=cache_configs.get("max_age_days"),
+            max_size_gb=cache_configs.get("max_size_gb"),
+            force=force,
+        )
+
+    # solved networks are written in the background while the next scenario is solved
+    exporter = export.BackgroundExporter(enable=configs["global_vars"].get("background_export", False))
+
+    failed_runs = {}
+    for run in configs["model_runs"]:
+        helpers.setup_dir(
+            path_to_dir=configs["paths"]["output_model_runs"]
+            + run["name"]
+            + "/solved_networks/"
+        )
+        print(f"Running: {run['name']}")
         path_to_run_dir = os.path.join(
             configs["paths"]["output_model_runs"], run["name"]
         )
-        postprocess.plot_results(path_to_run_dir,run,run["nodes_with_ci_load"][0])
+        # record the time and memory of every stage of the run (see trace.Tracer)
+        with trace.Tracer(path_to_run_dir, run=run["name"]), trace.stage("run"):
+            run_key = cache.run_key(run, configs)
+
+            # resume from the last completed stage of an interrupted run with the same inputs
+            checkpoint = cache.RunManifest(path_to_run_dir, run_key, reset=force)
+
+            N_BROWNFIELD = None
+            if checkpoint.completed(("brownfield", None), configs):
+                print(f"Resuming {run['name']} from its checkpoint")
+            elif solved_network_cache is not None and solved_network_cache.restore(
+                run_key, ("brownfield", None), path_to_run_dir, configs
+            ):
+                checkpoint.complete(("brownfield", None))
+            else:
+                N_BROWNFIELD = RunBrownfieldSimulation(run, configs, env=env, exporter=exporter, checkpoint=checkpoint)
+                if solved_network_cache is not None:
+                    exporter.flush()
+                    solved_network_cache.store(run_key, ("brownfield", None), path_to_run_dir, configs)
+            RES_TARGET = 100
+
+            # skip anything that is already completed or in the cache
+            stages = [("RES", RES_TARGET)] + [("CFE", CFE_Score) for CFE_Score in run["cfe_score"]]
+            stages = [stage for stage in stages if not checkpoint.completed(stage, configs)]
+            if solved_network_cache is not None:
+                restored = [
+                    stage for stage in stages
+                    if solved_network_cache.restore(run_key, stage, path_to_run_dir, configs)
+                ]
+                for stage in restored:
+                    checkpoint.complete(stage)
+                stages = [stage for stage in stages if stage not in restored]
+
+            # once the brownfield is solved, RES100 and every CFE score are independent,
+            # unless the CFE scores are swept on a single model
+            scenarios = [stage for stage in stages if stage[0] == "RES"]
+            CFE_Scores = [target for kind, target in stages if kind == "CFE"]
+            if configs["global_vars"].get("parametric_cfe_sweep", False) and CFE_Scores:
+                scenarios += [("CFE-sweep", sorted(CFE_Scores))]
+            else:
+                scenarios += [("CFE", CFE_Score) for CFE_Score in CFE_Scores]
+
+            if workers > 1 and scenarios:
+                # the workers read the brownfield from disk
+                exporter.flush()
+                failures = solve_scenarios_in_pool(
+                    scenarios,
+                    run,
+                    configs,
+                    workers,
+                    solved_network_cache=solved_network_cache,
+                    run_key=run_key,
+                    checkpoint=checkpoint,
+                )
+            else:
+                # every scenario is solved on an in-memory fork of the brownfield instead of re-reading it
+                if N_BROWNFIELD is None and scenarios:
+                    N_BROWNFIELD = helpers.load_brownfield_network(run, configs)
+                failures = solve_scenarios(
+                    scenarios,
+                    run,
+                    configs,
+                    env=env,
+                    solved_network_cache=solved_network_cache,
+                    run_key=run_key,
+                    N_BROWNFIELD=N_BROWNFIELD,
+                    exporter=exporter,
+                    checkpoint=checkpoint,
+                )
+
+            # every solved network of the run is written before it is plotted
+            exporter.flush()
+
+            solve_stats = solver.collect_stats(path_to_run_dir)
+            if not solve_stats.empty:
+                print(f"Solves of {run['name']}:")
+                print(solver.summarise_stats(solve_stats).to_string())
+
+            if failures:
+                failed_runs[run["name"]] = failures
+                print(f"Skipping plots for {run['name']}: {len(failures)} scenario(s) failed")
+                continue
+
+            postprocess.plot_results(path_to_run_dir,run,run["nodes_with_ci_load"][0])
+    exporter.close()
     print("*" * 100)
 
+    if failed_runs:
+        raise RuntimeError(
+            "Scenarios failed: "
+            + "; ".join(
+                f"{name}: " + ", ".join(f"{kind} {target}" for (kind, target), _ in failures)
+                for name, failures in failed_runs.items()
+            )
+        )
+
 
 @click.group()
 def cli():
@@ -142,6 +427,7 @@ def solve_brownfield(config, with_cfe: bool):
     configs = helpers.load_configs(config)
     env = None
     if configs["solver"]["name"] == "gurobi":
+        import gurobipy
         env = gurobipy.Env()
 
     for run in configs["model_runs"]:
@@ -169,6 +455,7 @@ def solve_brownfield_cfe(config):
     configs = helpers.load_configs(config)
     env = None
     if configs["solver"]["name"] == "gurobi":
+        import gurobipy
         env = gurobipy.Env()
 
     for run in configs["model_runs"]:
@@ -184,23 +471,64 @@ def solve_brownfield_cfe(config):
 
 @cli.command()
 @click.option("--config", default="configs.yaml", help="Path to the configuration file")
-def run_full_cfe(config):
+@click.option("--workers", default=1, help="Number of scenarios (RES100 and each CFE score) to solve in parallel")
+@click.option("--force", is_flag=True, default=False, help="Re-solve every scenario, even if it was completed or is in the cache")
+def run_full_cfe(config, workers: int, force: bool):
     configs = helpers.load_configs(config)
-    run_scenarios(configs)
+    run_scenarios(configs, workers=workers, force=force)
 
 
 @cli.command()
 @click.option("--config", default="configs.yaml", help="Path to the configuration file")
+@click.option("--workers", default=1, help="Number of solved networks to load, and of plots to render, in parallel")
+@click.option("--max-memory-gb", default=None, type=float, help="Bound on the size of the networks being loaded at once")
+@click.option("--parallel-runs", default=1, help="Number of model runs to plot in parallel")
+@click.option("--force", is_flag=True, default=False, help="Redraw every plot, even if its inputs did not change")
 def run_plots(
     config,
+    workers: int,
+    max_memory_gb: float,
+    parallel_runs: int,
+    force: bool,
 ):
+    from src import postprocess
+
     config = helpers.load_configs(config)
-    for run in config["model_runs"]:
-        path_to_run_dir = os.path.join(
-            config["paths"]["output_model_runs"], run["name"]
-        )
-        postprocess.plot_results(path_to_run_dir,run,run["nodes_with_ci_load"][0])
+    runs = {
+        run["name"]: (os.path.join(config["paths"]["output_model_runs"], run["name"]), run)
+        for run in config["model_runs"]
+    }
+    if parallel_runs <= 1:
+        for path_to_run_dir, run in runs.values():
+            postprocess.plot_results(
+                path_to_run_dir,
+                run,
+                run["nodes_with_ci_load"][0],
+                workers=workers,
+                max_memory_gb=max_memory_gb,
+                force=force,
+            )
+        return
 
+    with ProcessPoolExecutor(max_workers=min(parallel_runs, len(runs))) as pool:
+        futures = {
+            pool.submit(
+                postprocess.plot_results,
+                path_to_run_dir,
+                run,
+                run["nodes_with_ci_load"][0],
+                workers=workers,
+                max_memory_gb=max_memory_gb,
+                force=force,
+            ): name
+            for name, (path_to_run_dir, run) in runs.items()
+        }
+        for future in as_completed(futures):
+            try:
+                failures = future.result()
+                print(f"Finished plots for {futures[future]}" + (f" ({len(failures)} failed)" if failures else ""))
+            except Exception as e:
+                print(f"Failed plots for {futures[future]}: {e!r}")
 
 if __name__ == "__main__":
     cli()
@@ -1,77 +1,11 @@
 import os
 import sys
+from functools import partial
 
 import pandas as pd
 import pypsa
 
-from src import brownfield, cfe, helpers, postprocess
-
-
-def GetGridCFE(
-    n: pypsa.Network,   
-    ci_identifier: str,
-    run: dict
-):
-    """
-
-    Calculate the CFE score of a grid, intra- and inter-regionally. Here, we follow the mathematical
-    expressions presented by Xu and Jenkins (2021): https://acee.princeton.edu/24-7/
-
-    Parameters:
-    -----------
-    network : pypsa.Network
-        The optimised network for which we are calculating the GridCFE.
-    bus : str
-        The country bus for which we are calculating the GridCFE.
-    ci_identifier : str
-        The unique identifer used to identify C&I assets.
-
-    Returns:
-    -----------
-    CFE Score: list
-        Hourly resolution CFE scores for each snapshot in the network.
-
-    Let:
-    -----------
-    R = Intra-regional grid
-    Z = Inter-regional grid
-
-    """
-
-    
-
-        # get global clean carriers
-    global_clean_carriers = [
-        i
-        for i in n.carriers.query(" co2_emissions <= 0").index.tolist()
-        if i in n.generators.carrier.tolist()
-    ]
-
-    for bus in run["nodes_with_ci_load"]:
-        # get clean generators in R
-        R_clean_generators = n.generators.loc[
-            # clean carriers
-            (n.generators.carrier.isin(global_clean_carriers))
-            &
-            #exclude assets not in R
-            (n.generators.index.str.contains(bus)) &
-            # exclude C&I assets
-            (~n.generators.index.str.contains(ci_identifier))
-        ].index
-
-        # get all generators
-        R_all_generators = n.generators.loc[
-            (~n.generators.index.str.contains(ci_identifier))
-            &
-            (n.generators.index.str.contains(bus)) 
-        ].index
-
-        # calculate CFE sceore
-        total_clean_generation = n.generators_t.p[R_clean_generators].sum(axis=1)
-        total_generation = n.generators_t.p[R_all_generators].sum(axis=1)
-
-    # return CFE score
-    return (total_clean_generation / total_generation).round(2).tolist()
+from src import aggregation, brownfield, cfe, convergence, export, helpers, solver, trace
 
 
 def PostProcessBrownfield(n: pypsa.Network, ci_identifier: str):
@@ -88,14 +22,19 @@ def PostProcessBrownfield(n: pypsa.Network, ci_identifier: str):
         getattr(n, c)["p_nom_extendable"] = False
         # ...besides the C&I assets
         getattr(n, c).loc[
-            getattr(n, c).index.str.contains(ci_identifier), "p_nom_extendable"
+            cfe.get_ci_components(n, n.components[c].name, ci_identifier=ci_identifier), "p_nom_extendable"
         ] = True
     return n
 
 
-def RunBrownfieldSimulation(run, configs, env=None):
+@trace.traced
+def RunBrownfieldSimulation(run, configs, env=None, exporter=None, checkpoint=None):
+
+    """Setup and run the brownfield simulation
 
-    """Setup and run the brownfield simulation"""
+    With an export.BackgroundExporter, the solved network is written in the background. With a
+    cache.RunManifest, the stage is recorded as completed once the network is written.
+    """
 
     N_BROWNFIELD = brownfield.SetupBrownfieldNetwork(run, configs)
 
@@ -108,18 +47,18 @@ def RunBrownfieldSimulation(run, configs, env=None):
     )
 
     print("prepared network for CFE")
+
+    # optionally reduce the number of snapshots for fast exploratory runs
+    N_BROWNFIELD = aggregation.AggregateSnapshots(N_BROWNFIELD, configs)
     print("Begin solving...")
 
     # lp_model = N_BROWNFIELD.optimize.create_model()
-    N_BROWNFIELD.optimize.create_model()
+    with trace.stage("create_model"):
+        N_BROWNFIELD.optimize.create_model()
     brownfield.ApplyBrownfieldConstraints(N_BROWNFIELD, run, configs)
 
-    N_BROWNFIELD.optimize.solve_model(
-        solver_name=configs["solver"]["name"],
-        solver_options=configs["solver_options"][configs["solver"]["options"]],
-        io_api="direct",
-        env=env,
-    )
+    with trace.stage("solve_model"):
+        stats = solver.solve_network(N_BROWNFIELD, configs, env=env)
 
     brownfield_path = os.path.join(
         configs["paths"]["output_model_runs"],
@@ -129,11 +68,18 @@ def RunBrownfieldSimulation(run, configs, env=None):
     )
 
     print(brownfield_path)
-    N_BROWNFIELD.export_to_netcdf(brownfield_path)
+    solver.save_stats([stats], brownfield_path)
+    export.export_network(
+        N_BROWNFIELD,
+        brownfield_path,
+        exporter,
+        callback=None if checkpoint is None else partial(checkpoint.complete, ("brownfield", None)),
+    )
 
     return N_BROWNFIELD
 
 
+@trace.traced
 def RunRES100(
     N_BROWNFIELD: pypsa.Network,
     ci_identifier: str,
@@ -142,24 +88,32 @@ def RunRES100(
     res_target: int = 100,
     # bus : str,
     env=None,
+    exporter=None,
+    checkpoint=None,
 ):
     """Sets up the 100% RES (annual matching) simulation"""
 
-    # make a copy of the brownfield
-    N_RES_100 = N_BROWNFIELD  # .copy()
+    # the brownfield is modified in place: pass a fork (helpers.fork_network) to keep the original
+    N_RES_100 = N_BROWNFIELD
 
     # post-process to set what is expandable and non-expandable
     N_RES_100 = PostProcessBrownfield(N_RES_100, ci_identifier=ci_identifier)
 
     # init linopy model
-    N_RES_100.optimize.create_model()
+    with trace.stage("create_model"):
+        N_RES_100.optimize.create_model()
+
+    # annual sums are weighted by the snapshot weightings (see aggregation.AggregateSnapshots)
+    weights = N_RES_100.snapshot_weightings.generators
 
     for bus in run["nodes_with_ci_load"]:
 
         # get total C&I load (float)
         CI_Demand = (
-            N_RES_100.loads_t.p_set.filter(regex=bus)
-            .filter(regex=ci_identifier)
+            N_RES_100.loads_t.p_set[
+                cfe.get_ci_components(N_RES_100, "Load", "load", bus, ci_identifier=ci_identifier)
+            ]
+            .multiply(weights, axis=0)
             .sum()
             .sum()
         )
@@ -168,24 +122,19 @@ def RunRES100(
         CI_GridExport = (
             N_RES_100.model.variables["Link-p"]
             .sel(
-                Link=[
-                    i
-                    for i in N_RES_100.links.index
-                    if ci_identifier in i and "Export" in i and bus in i
-                ]
+                Link=cfe.get_ci_components(N_RES_100, "Link", "export", bus, ci_identifier=ci_identifier)
             )
             .sum(dims="Link")
+            * weights.values
         )
 
         # get total PPA procurement (linopy.Var)
-        ci_ppa_generators = N_RES_100.generators.loc[
-            (N_RES_100.generators.bus.str.contains(bus))
-            & (N_RES_100.generators.bus.str.contains(ci_identifier))
-        ].index.tolist()  # get c&i ppa generators
+        ci_ppa_generators = cfe.get_ci_components(
+            N_RES_100, "Generator", "ppa", bus, ci_identifier=ci_identifier
+        )  # get c&i ppa generators
 
         CI_PPA = (
-            N_RES_100.model.variables["Generator-p"]
-            .sel(Generator=ci_ppa_generators)
+            (N_RES_100.model.variables["Generator-p"].sel(Generator=ci_ppa_generators) * weights.values)
             .sum()
         )
 
@@ -197,12 +146,13 @@ def RunRES100(
         ]
 
         # clean generators
+        ci_generators = cfe.get_ci_components(N_RES_100, "Generator", ci_identifier=ci_identifier)
         clean_region_generators = [
             i
             for i in N_RES_100.generators.loc[
                 N_RES_100.generators.carrier.isin(clean_carriers)
             ].index
-            if ci_identifier not in i and bus[0:3] in i
+            if i not in ci_generators and bus[0:3] in i
         ]
 
         # Constraint 1: Annual matching
@@ -223,39 +173,176 @@ def RunRES100(
         # ---------------------------------------------------------------
         brownfield.ApplyBrownfieldConstraints(N_RES_100, run, configs)
 
-    N_RES_100.optimize.solve_model(
-        solver_name=configs["solver"]["name"],
-        solver_options=configs["solver_options"][configs["solver"]["options"]],
-        io_api="direct",
-        env=env,
-    )
+    with trace.stage("solve_model"):
+        stats = solver.solve_network(N_RES_100, configs, env=env)
 
-    N_RES_100.export_to_netcdf(
-        os.path.join(
-            configs["paths"]["output_model_runs"],
-            run["name"],
-            "solved_networks",
-            "annual_matching_"
-            + "RES"
-            + str(res_target)
-            + "_"
-            + str(configs["global_vars"]["year"])
-            + ".nc",
-        )
+    res_path = os.path.join(
+        configs["paths"]["output_model_runs"],
+        run["name"],
+        "solved_networks",
+        "annual_matching_"
+        + "RES"
+        + str(res_target)
+        + "_"
+        + str(configs["global_vars"]["year"])
+        + ".nc",
+    )
+    solver.save_stats([stats], res_path)
+    export.export_network(
+        N_RES_100,
+        res_path,
+        exporter,
+        callback=None if checkpoint is None else partial(checkpoint.complete, ("RES", res_target)),
     )
 
     return N_RES_100
 
 
 def RunCFE(
-    N_BROWNFIELD: pypsa.Network, CFE_Score, ci_identifier: str, run: dict, configs: dict, env=None
+    N_BROWNFIELD: pypsa.Network,
+    CFE_Score,
+    ci_identifier: str,
+    run: dict,
+    configs: dict,
+    env=None,
+    exporter=None,
+    checkpoint=None,
 ):
     """Run 24/7 CFE scenario"""
 
+    return RunCFESweep(
+        N_BROWNFIELD,
+        CFE_Scores=[CFE_Score],
+        ci_identifier=ci_identifier,
+        run=run,
+        configs=configs,
+        env=env,
+        exporter=exporter,
+        checkpoint=checkpoint,
+    )
+
+
+@trace.traced
+def RunCFESweep(
+    N_BROWNFIELD: pypsa.Network,
+    CFE_Scores: list,
+    ci_identifier: str,
+    run: dict,
+    configs: dict,
+    env=None,
+    exporter=None,
+    checkpoint=None,
+):
+    """
+    Run 24/7 CFE scenarios for a list of CFE scores on a single model.
+
+    The linopy model is built once. Between scores, only the coefficients and right-hand sides tied
+    to the CFE score are updated (see cfe.update_cfe_score). Scores are visited in sorted order and
+    each one starts its GridCFE iteration from the GridCFE of the previous score, so every solve
+    starts close to its neighbour. With a persistent solver, the solver also re-optimises from its
+    previous state.
+
+    With an export.BackgroundExporter, each solved score is written in the background while the
+    next one is solved. With a cache.RunManifest, the GridCFE of every iteration is checkpointed and
+    each score is recorded as completed once its network is written.
+    """
+
     N_CFE = PostProcessBrownfield(N_BROWNFIELD, ci_identifier=ci_identifier)
 
     # init linopy model
-    N_CFE.optimize.create_model()
+    with trace.stage("create_model"):
+        N_CFE.optimize.create_model()
+
+    CFE_Scores = sorted(CFE_Scores)
+
+    # [Step 1] Start with grid supply CFE set to 0 (one row per C&I bus)
+    GridCFE = cfe.grid_cfe_matrix(0.0, run["nodes_with_ci_load"], N_CFE.snapshots)
+
+    # apply the CFE constraint
+    N_CFE = cfe.apply_cfe_constraint(
+        N_CFE,
+        GridCFE,
+        run["nodes_with_ci_load"],
+        ci_identifier,
+        CFE_Scores[0],
+        configs["global_vars"]["maximum_excess_export_cfe"],
+    )
+
+    # (Re)apply original brownfield constraints
+    brownfield.ApplyBrownfieldConstraints(N_CFE, run, configs)
+
+    # with a persistent solver, the model is handed to the solver once and only the
+    # CFE constraints that change are updated between solves
+    cfe_solver = None
+    if configs["global_vars"].get("persistent_solver", False):
+        with trace.stage("PersistentSolver"):
+            cfe_solver = solver.PersistentSolver(
+                N_CFE,
+                solver_name=configs["solver"]["name"],
+                solver_options=configs["solver_options"][configs["solver"]["options"]],
+                env=env,
+            )
+
+    for CFE_Score in CFE_Scores:
+        with trace.stage("CFE", cfe_score=CFE_Score):
+            print(f"Computing hourly matching scenario (CFE: {int(CFE_Score*100)})")
+            N_CFE = cfe.update_cfe_score(
+                N_CFE, CFE_Score, run["nodes_with_ci_load"], ci_identifier
+            )
+            solve_stats = []
+            GridCFE = IterateGridCFE(
+                N_CFE,
+                GridCFE,
+                CFE_Score=CFE_Score,
+                ci_identifier=ci_identifier,
+                run=run,
+                configs=configs,
+                env=env,
+                cfe_solver=cfe_solver,
+                checkpoint=checkpoint,
+                solve_stats=solve_stats,
+            )
+
+            cfe_path = os.path.join(
+                configs["paths"]["output_model_runs"],
+                run["name"],
+                "solved_networks",
+                "hourly_matching_"
+                + "CFE"
+                + str(int(CFE_Score * 100))
+                + "_"
+                + str(configs["global_vars"]["year"])
+                + ".nc",
+            )
+            solver.save_stats(solve_stats, cfe_path)
+            export.export_network(
+                N_CFE,
+                cfe_path,
+                exporter,
+                callback=None if checkpoint is None else partial(checkpoint.complete, ("CFE", CFE_Score)),
+            )
+
+    return N_CFE
+
+
+def IterateGridCFE(
+    N_CFE: pypsa.Network,
+    GridCFE: pd.DataFrame,
+    CFE_Score,
+    ci_identifier: str,
+    run: dict,
+    configs: dict,
+    env=None,
+    cfe_solver: solver.PersistentSolver = None,
+    checkpoint=None,
+    solve_stats: list = None,
+):
+    """Iteratively solve a CFE model for the grid supply CFE, starting from GridCFE
+
+    With a cache.RunManifest, the GridCFE of every iteration is checkpointed, and an interrupted
+    iteration resumes from the last stored GridCFE. With a `solve_stats` list, the statistics of
+    each solve (see solver.solve_stats) are appended to it.
+    """
 
     # ---------------------------------------------------------------
     #
@@ -269,76 +356,85 @@ def RunCFE(
     #   then feed it as a parameter into the model.
     #
     #   The process is as follows:
-    #       1. Set the grid CFE to 0 and run the model
+    #       1. Set the grid CFE (to 0, or to the previous CFE score's) and run the model
     #       2. Calculate the real grid CFE from (1)
     #       3. Now, fix the grid CFE to (2) and re-run the model
     #       4. Calculate the grid CFE from (3) and compare against (2)
-    #       5. If the difference is less than 0.01, stop. Otherwise, repeat from (3)
+    #       5. If the largest hourly difference is within tolerance, stop.
+    #          Otherwise, repeat from (3)
+    #
+    #   The grid CFE fed back in (3) is chosen by the convergence engine
+    #   configured in `grid_cfe_convergence` (plain Picard iteration,
+    #   under-relaxation, Aitken or Anderson extrapolation).
+    #
+    #   The grid CFE only enters the CFE target constraint, so it is
+    #   updated in place rather than rebuilding the constraints.
     #
     # ---------------------------------------------------------------
 
     # start a counter and initialise a dataframe to store the results
     count = 1
     GridSupplyCFE = pd.DataFrame({})
-
-    # [Step 1] Run the model with grid supply CFE set to 0
-    GridCFE = [0 for i in range(N_CFE.snapshots.size)]
-    GridSupplyCFE[f"iteration_{count}"] = GridCFE
-
-    # apply the CFE constraint
-    N_CFE = cfe.apply_cfe_constraint(
-        N_CFE,
-        GridCFE,
-        run["nodes_with_ci_load"],
-        ci_identifier,
-        CFE_Score,
-        configs["global_vars"]["maximum_excess_export_cfe"],
+    GridSupplyCFE[f"iteration_{count}"] = GridCFE.stack()
+    GridCFEConvergence = convergence.GridCFEConvergence(
+        **configs.get("grid_cfe_convergence", {})
     )
 
-    # (Re)apply original brownfield constraints
-    brownfield.ApplyBrownfieldConstraints(N_CFE, run, configs)
+    # resume an interrupted iteration from its last GridCFE
+    resumed = checkpoint.load_grid_cfe(CFE_Score) if checkpoint is not None else None
+    if resumed is not None:
+        GridSupplyCFE, NextGridCFE = resumed
+        count = GridSupplyCFE.shape[1]
+        GridCFE = cfe.grid_cfe_matrix(
+            NextGridCFE.unstack().reindex(columns=N_CFE.snapshots), run["nodes_with_ci_load"], N_CFE.snapshots
+        )
+        print(f"Resuming hourly matching scenario (CFE: {int(CFE_Score*100)}) from iteration {count}")
+
+    while True:
+        if count > 1:
+            print(f"Computing hourly matching scenario (CFE: {int(CFE_Score*100)}) iteration {count}")
+
+        with trace.stage("iteration", iteration=count):
+            N_CFE = cfe.update_grid_cfe(N_CFE, GridCFE, run["nodes_with_ci_load"], ci_identifier)
+
+            # optimise
+            if cfe_solver is not None:
+                cfe_solver.update_constraints(
+                    [f"cfe-constraint-target-{bus}" for bus in run["nodes_with_ci_load"]]
+                    + [f"cfe-constraint-fossil-excess-{bus}" for bus in run["nodes_with_ci_load"]]
+                )
+                with trace.stage("solve_model"):
+                    cfe_solver.solve()
+                stats = cfe_solver.stats
+            else:
+                # the CFE constraints are updated in place between solves: keep their zero coefficients
+                # (e.g. the grid imports while GridCFE is 0), which linopy would otherwise drop for good
+                with trace.stage("solve_model"):
+                    stats = solver.solve_network(N_CFE, configs, env=env, sanitize_zeros=False)
+            if solve_stats is not None:
+                solve_stats.append({"cfe_score": CFE_Score, "iteration": count, **stats})
+            if stats["status"] != "ok":
+                # the network still holds the solution of the previous iteration
+                raise RuntimeError(
+                    f"CFE: {int(CFE_Score*100)} iteration {count} did not solve to optimality: {stats['termination']}"
+                )
+
+            # get GridCFE and the grid CFE to apply in the next iteration
+            ComputedGridCFE = cfe.GetGridCFE(N_CFE, run["nodes_with_ci_load"], ci_identifier)
+            count += 1
+            GridSupplyCFE[f"iteration_{count}"] = ComputedGridCFE.stack()
+            GridCFE = cfe.grid_cfe_matrix(
+                GridCFEConvergence.update(GridCFE, ComputedGridCFE), run["nodes_with_ci_load"], N_CFE.snapshots
+            )
+            if checkpoint is not None:
+                checkpoint.save_grid_cfe(CFE_Score, GridSupplyCFE, GridCFE)
 
-    # optimise
-    N_CFE.optimize.solve_model(
-        solver_name=configs["solver"]["name"],
-        solver_options=configs["solver_options"][configs["solver"]["options"]],
-        io_api="direct",
-        env=env,
-    )
+        # iterate until the hourly residuals are within tolerance
+        if GridCFEConvergence.converged or count >= GridCFEConvergence.max_iterations:
+            break
 
-    # get GridCFE
-    GridCFE = GetGridCFE(N_CFE, ci_identifier, run=run)
-    count += 1
-    GridSupplyCFE[f"iteration_{count}"] = GridCFE
-
-    # calculate difference between iterations with a maximum of 100 loops
-    max_iterations = 100
-    while (
-        GridSupplyCFE[f"iteration_{count}"].sum()
-        - GridSupplyCFE[f"iteration_{count-1}"].sum()
-    ) > 0.01 and count < max_iterations:
-        # Remove constraints from the previous iteration before applying for the current iteration
-        N_CFE.model.remove_constraints(
-            [c for c in N_CFE.model.constraints if "cfe-constraint" in c]
-        )
-        N_CFE = cfe.apply_cfe_constraint(
-            N_CFE,
-            GridCFE,
-            run["nodes_with_ci_load"],
-            ci_identifier,
-            CFE_Score,
-            configs["global_vars"]["maximum_excess_export_cfe"],
-        )
-        print(f"Computing hourly matching scenario (CFE: {int(CFE_Score*100)}) iteration {count}")
-        N_CFE.optimize.solve_model(
-            solver_name=configs["solver"]["name"],
-            solver_options=configs["solver_options"][configs["solver"]["options"]],
-            io_api="direct",
-            env=env,
-        )
-        GridCFE = GetGridCFE(N_CFE, ci_identifier, run=run)
-        count += 1
-        GridSupplyCFE[f"iteration_{count}"] = GridCFE
+    if not GridCFEConvergence.converged:
+        print(f"GridCFE did not converge for CFE: {int(CFE_Score*100)} after {count} iterations")
 
     # save iteration results
     helpers.setup_dir(
@@ -358,23 +454,22 @@ def RunCFE(
         )
     )
 
-    N_CFE.export_to_netcdf(
+    GridCFEConvergence.residuals.to_csv(
         os.path.join(
             configs["paths"]["output_model_runs"],
             run["name"],
-            "solved_networks",
-            "hourly_matching_"
-            + "CFE"
-            + str(int(CFE_Score * 100))
-            + "_"
-            + str(configs["global_vars"]["year"])
-            + ".nc",
+            "grid_supply_cfe_iterations",
+            "cfe" + str(int(CFE_Score * 100)) + "_residuals.csv",
         )
     )
 
+    return GridCFE
+
 
 if __name__ == "__main__":
 
+    from src import postprocess
+
     print("*" * 100)
     print("BEGIN MODEL RUNS")
     print("")
@@ -0,0 +1,270 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+import pypsa
+
+from . import trace
+
+# number of snapshots in a representative period, for hourly snapshots
+PERIOD_LENGTHS = {
+    'representative_days': 24,
+    'representative_weeks': 168,
+}
+
+
+@trace.traced
+def AggregateSnapshots(network: pypsa.Network, configs: dict) -> pypsa.Network:
+    """
+
+    Reduces the number of snapshots of a network for fast exploratory runs, as set in the
+    `time_aggregation` section of the configs. The network is returned unchanged if the section is
+    missing or not enabled.
+
+    Parameters:
+    -----------
+    network : pypsa.Network
+        The network to aggregate (e.g., the brownfield network after PrepareNetworkForCFE).
+    configs : dict
+        A dictionary containing the `time_aggregation` settings:
+            - method: 'representative_days', 'representative_weeks' or 'segmentation'
+            - n_periods: number of representative days/weeks
+            - n_segments: number of snapshots kept with segmentation
+            - disaggregate: whether results are expanded back to hourly for the CFE heatmaps
+
+    Returns:
+    -----------
+    pypsa.Network
+        The network with the reduced snapshots and their snapshot weightings.
+
+    Raises:
+    -----------
+    ValueError
+        If the method is invalid or the snapshots are not evenly spaced.
+
+    Notes:
+    -----------
+    - Representative periods are actual days/weeks of the year (the medoids of a k-means
+      clustering of the time series), so the time series within a period are unchanged. Each
+      snapshot is weighted by the number of hours it represents in the objective and for
+      generation (the `stores` weighting stays the length of a snapshot).
+    - Segmentation merges adjacent snapshots with similar time series into segments of variable
+      length (the time series are averaged), weighted by the length of the segment.
+    - Storage is chained across consecutive representative periods.
+    - The mapping from the original to the aggregated snapshots is stored in `network.meta` so
+      that results can be disaggregated (see `disaggregate`).
+
+    """
+
+    settings = configs.get('time_aggregation', {})
+    if not settings.get('enable', False):
+        return network
+
+    method = settings.get('method', 'representative_days')
+    snapshots = network.snapshots
+    freq = pd.infer_freq(snapshots) if len(snapshots) > 2 else None
+    if freq is None:
+        raise ValueError("Time-series aggregation requires evenly spaced snapshots.")
+
+    features = get_features(network)
+
+    if method in PERIOD_LENGTHS:
+        period_length = PERIOD_LENGTHS[method]
+        period_map = cluster_periods(features, period_length, settings.get('n_periods', 12))
+        mapping = expand_period_map(period_map, period_length, len(snapshots))
+        meta = {'period_length': period_length, 'period_map': period_map.tolist()}
+    elif method == 'segmentation':
+        segment_lengths = segment(features, settings.get('n_segments', 876))
+        mapping = np.repeat(np.arange(len(segment_lengths)), segment_lengths)
+        meta = {'segment_lengths': segment_lengths.tolist()}
+    else:
+        raise ValueError(f"Invalid time aggregation method: {method}")
+
+    positions, labels = _kept_snapshots(mapping, method)
+    new_snapshots = snapshots[positions]
+
+    # segments take the mean of the time series they replace
+    averaged = {}
+    if method == 'segmentation':
+        for c in sorted(network.all_components):
+            for k, df in network.dynamic(c).items():
+                if not df.empty:
+                    averaged[(c, k)] = df.groupby(labels).mean().set_axis(new_snapshots)
+
+    # hours represented by each kept snapshot; for storage, the weighting is the time elapsed in a
+    # snapshot, which only changes with segmentation
+    weightings = network.snapshot_weightings.groupby(labels).sum()
+    if method in PERIOD_LENGTHS:
+        weightings['stores'] = network.snapshot_weightings.stores.iloc[positions].values
+
+    network.set_snapshots(new_snapshots)
+    network.snapshot_weightings = weightings.set_axis(new_snapshots)
+    for (c, k), df in averaged.items():
+        network.dynamic(c)[k] = df
+
+    network.meta['time_aggregation'] = {
+        'method': method,
+        'disaggregate': settings.get('disaggregate', True),
+        'start': str(snapshots[0]),
+        'periods': len(snapshots),
+        'freq': freq,
+        **meta,
+    }
+
+    print(f"Aggregated {len(snapshots)} snapshots to {len(new_snapshots)} ({method})")
+    return network
+
+
+def get_features(network: pypsa.Network) -> np.ndarray:
+    '''Returns the time-varying inputs of a network, scaled to [-1, 1], as a (snapshots x features) array
+    '''
+    frames = []
+    for c in sorted(network.all_components):
+        attrs = network.component_attrs[c]
+        inputs = attrs.index[~attrs.status.str.startswith('Output')]
+        for k, df in network.dynamic(c).items():
+            if k in inputs and not df.empty:
+                frames.append(df.select_dtypes('number'))
+    if not frames:
+        return np.zeros((len(network.snapshots), 1))
+
+    features = pd.concat(frames, axis=1).fillna(0).values.astype(float)
+    scale = np.abs(features).max(axis=0)
+    return features / np.where(scale > 0, scale, 1)
+
+
+def cluster_periods(features: np.ndarray, period_length: int, n_periods: int, iterations: int = 100) -> np.ndarray:
+    '''Clusters the full periods of the time series and returns, for each period, the index of the
+    period that represents it (the medoid of its cluster)
+
+    Hours after the last full period are represented by the last full period.
+    '''
+    n_full = len(features) // period_length
+    if n_full == 0:
+        raise ValueError(f"Need at least {period_length} snapshots for representative periods.")
+    n_periods = min(n_periods, n_full)
+    X = features[: n_full * period_length].reshape(n_full, -1)
+
+    def distances(centers):
+        return np.maximum((X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers ** 2).sum(axis=1), 0)
+
+    # k-means++ initialisation, with a fixed seed so that runs are reproducible
+    rng = np.random.default_rng(0)
+    centers = X[[rng.integers(n_full)]]
+    for _ in range(1, n_periods):
+        d = distances(centers).min(axis=1)
+        pick = rng.choice(n_full, p=d / d.sum()) if d.sum() > 0 else rng.integers(n_full)
+        centers = np.vstack([centers, X[pick]])
+
+    for _ in range(iterations):
+        labels = distances(centers).argmin(axis=1)
+        updated = np.array([
+            X[labels == k].mean(axis=0) if (labels == k).any() else centers[k] for k in range(n_periods)
+        ])
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+
+    # represent each cluster by its medoid, an actual period of the year
+    period_map = np.empty(n_full, dtype=int)
+    for k in np.unique(labels):
+        members = np.flatnonzero(labels == k)
+        medoid = members[((X[members] - centers[k]) ** 2).sum(axis=1).argmin()]
+        period_map[members] = medoid
+
+    if len(features) > n_full * period_length:
+        period_map = np.append(period_map, period_map[-1])
+    return period_map
+
+
+def segment(features: np.ndarray, n_segments: int) -> np.ndarray:
+    '''Merges adjacent snapshots into `n_segments` segments and returns the length of each segment
+
+    The pair of adjacent segments whose merge adds the least variance (Ward's criterion) is merged
+    first.
+    '''
+    n = len(features)
+    n_segments = max(1, min(n_segments, n))
+
+    sizes = np.ones(n)
+    means = features.astype(float).copy()
+    nxt = np.arange(1, n + 1)
+    prv = np.arange(-1, n - 1)
+    alive = np.ones(n, dtype=bool)
+    version = np.zeros(n, dtype=int)
+
+    def cost(i, j):
+        return sizes[i] * sizes[j] / (sizes[i] + sizes[j]) * ((means[i] - means[j]) ** 2).sum()
+
+    heap = [(cost(i, i + 1), i, 0, 0) for i in range(n - 1)]
+    heapq.heapify(heap)
+
+    remaining = n
+    while remaining > n_segments and heap:
+        _, i, vi, vj = heapq.heappop(heap)
+        j = nxt[i] if alive[i] else n
+        # skip pairs that changed since they were pushed
+        if not alive[i] or j >= n or version[i] != vi or version[j] != vj:
+            continue
+
+        # merge j into i
+        means[i] = (sizes[i] * means[i] + sizes[j] * means[j]) / (sizes[i] + sizes[j])
+        sizes[i] += sizes[j]
+        alive[j] = False
+        nxt[i] = nxt[j]
+        if nxt[j] < n:
+            prv[nxt[j]] = i
+        version[i] += 1
+        remaining -= 1
+
+        if prv[i] >= 0:
+            heapq.heappush(heap, (cost(prv[i], i), prv[i], version[prv[i]], version[i]))
+        if nxt[i] < n:
+            heapq.heappush(heap, (cost(i, nxt[i]), i, version[i], version[nxt[i]]))
+
+    return sizes[alive].astype(int)
+
+
+def expand_period_map(period_map: np.ndarray, period_length: int, periods: int) -> np.ndarray:
+    '''Returns, for each original snapshot, the position of the snapshot that represents it
+    '''
+    hours = np.arange(periods)
+    return period_map[hours // period_length] * period_length + hours % period_length
+
+
+def snapshot_map(n: pypsa.Network) -> pd.Series:
+    '''Returns the aggregated snapshot that represents each original snapshot, or None if the
+    network was not aggregated
+    '''
+    meta = n.meta.get('time_aggregation')
+    if not meta:
+        return None
+
+    snapshots = pd.date_range(meta['start'], periods=meta['periods'], freq=meta['freq'])
+    if 'period_map' in meta:
+        mapping = expand_period_map(np.array(meta['period_map']), meta['period_length'], meta['periods'])
+    else:
+        mapping = np.repeat(np.arange(len(meta['segment_lengths'])), meta['segment_lengths'])
+
+    positions, labels = _kept_snapshots(mapping, meta['method'])
+    return pd.Series(snapshots[positions][labels], index=snapshots)
+
+
+def disaggregate(df: pd.DataFrame, n: pypsa.Network) -> pd.DataFrame:
+    '''Expands results indexed by the aggregated snapshots of a network back to the original snapshots
+
+    Results are returned unchanged if the network was not aggregated or disaggregation is disabled.
+    '''
+    meta = n.meta.get('time_aggregation')
+    if not meta or not meta.get('disaggregate', True):
+        return df
+    mapping = snapshot_map(n)
+    return df.reindex(mapping.values).set_axis(mapping.index)
+
+
+def _kept_snapshots(mapping: np.ndarray, method: str) -> tuple:
+    '''Returns the positions of the original snapshots that are kept (the first of each segment with
+    segmentation) and, for each original snapshot, the index of the kept snapshot that represents it
+    '''
+    values, first, labels = np.unique(mapping, return_index=True, return_inverse=True)
+    return (first if method == 'segmentation' else values), labels
@@ -16,23 +16,26 @@ from tz_pypsa.constraints import (
     constr_cofiring_ccs_generation_join_plant
 )
 
-def SetupBrownfieldNetwork(run, configs) -> pypsa.Network:
+from . import cache, trace
+
+@trace.traced
+def LoadStockModel(run, configs) -> pypsa.Network:
     """
-    
-    Sets up the brownfield network based on the provided run configuration and global variables.
+
+    Loads the stock model of a run with tza-pypsa, either from the tza-pypsa model library (ASEAN_yaml) or from
+    the CSVs in `paths: path_to_model`.
 
     Parameters:
     -----------
-    run (dict): A dictionary containing run-specific configurations such as 'stock_model', 'select_nodes', 'backstop', and 'allow_grid_expansion'.
+    run (dict): A dictionary containing run-specific configurations such as 'stock_model', 'select_nodes' and 'backstop'.
     configs (dict): A dictionary containing global configuration variables including 'frequency', 'timesteps', 'year', and 'set_global_constraints'.
 
     Returns:
     -----------
-    pypsa.Network: A PyPSA Network object with the brownfield system set up according to the provided configurations.
+    pypsa.Network: The stock model, resampled to the configured frequency and year.
 
     """
-    
-    
+
     if configs["model_runs"][0]["stock_model"] == "ASEAN_yaml":
     # load the stock model from tza-pypsa 
         network = (
@@ -60,6 +63,36 @@ def SetupBrownfieldNetwork(run, configs) -> pypsa.Network:
             )
         )
 
+    return network
+
+@trace.traced
+def SetupBrownfieldNetwork(run, configs) -> pypsa.Network:
+    """
+    
+    Sets up the brownfield network based on the provided run configuration and global variables.
+
+    Parameters:
+    -----------
+    run (dict): A dictionary containing run-specific configurations such as 'stock_model', 'select_nodes', 'backstop', and 'allow_grid_expansion'.
+    configs (dict): A dictionary containing global configuration variables including 'frequency', 'timesteps', 'year', and 'set_global_constraints'.
+
+    Returns:
+    -----------
+    pypsa.Network: A PyPSA Network object with the brownfield system set up according to the provided configurations.
+
+    """
+    
+    
+    stock_model_configs = configs.get("cache", {}).get("stock_models", {})
+    if stock_model_configs.get("enable", False):
+        stock_model_cache = cache.StockModelCache(
+            path=stock_model_configs.get("path", "cache/stock_models/"),
+            max_age_days=configs["cache"].get("max_age_days"),
+        )
+        network = stock_model_cache.load(run, configs, lambda: LoadStockModel(run, configs))
+    else:
+        network = LoadStockModel(run, configs)
+
     # if expansion is set to True, set p_nom_extendable to True for generators and storage units
     # otherwise if False, leaves propreties as they are (in case some are already set to True and others to False)
     if run["allow_generation_expansion"]:
@@ -78,6 +111,7 @@ def SetupBrownfieldNetwork(run, configs) -> pypsa.Network:
 
     return network
 
+@trace.traced
 def ApplyBrownfieldConstraints(network, run, configs) -> pypsa.Network:
     """
     
@@ -0,0 +1,524 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+from importlib import metadata
+
+import pandas as pd
+import pypsa
+
+# modules whose changes can alter a solved network (plotting and postprocessing are excluded on purpose)
+SOLVE_CODE = [
+    'pyproject.toml',
+    'src/aggregation.py',
+    'src/brownfield.py',
+    'src/cfe.py',
+    'src/convergence.py',
+    'src/helpers.py',
+    'src/solver.py',
+    'run/run_scenarios.py',
+]
+
+# modules, besides the plot functions themselves, whose changes can alter the plots and results tables
+PLOT_CODE = [
+    'src/aggregation.py',
+    'src/cfe.py',
+    'src/get.py',
+    'src/plotting.py',
+    'src/results.py',
+]
+
+# global_vars that change how a run is executed, but not its results
+EXECUTION_ONLY = ['background_export', 'persistent_solver', 'parametric_cfe_sweep']
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def hash_files(paths: list) -> str:
+    '''Returns a sha256 digest of the names and contents of a list of files
+    '''
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_dir(path: str, extensions=('.csv',)) -> str:
+    '''Returns a sha256 digest of all files with the given extensions in a directory
+    '''
+    if not os.path.isdir(path):
+        return ''
+    return hash_files(
+        [os.path.join(path, f) for f in os.listdir(path) if f.endswith(extensions)]
+    )
+
+
+def stat_dir(path: str) -> list:
+    '''Returns the name, size and modification time of every file in a directory
+
+    Cheaper than hash_dir, for inputs that are read on every run.
+    '''
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(path) if entry.is_file()
+    )
+
+
+def stage_outputs(stage: tuple, configs: dict) -> list:
+    '''Returns the files (relative to the run directory) written by a stage of a run
+
+    Stages are ("brownfield", None), ("RES", res_target) or ("CFE", cfe_score).
+    '''
+    kind, target = stage
+    year = str(configs["global_vars"]["year"])
+    if kind == 'brownfield':
+        return [
+            os.path.join('solved_networks', f'brownfield_{year}.nc'),
+            os.path.join('solved_networks', f'brownfield_{year}.solves.csv'),
+        ]
+    elif kind == 'RES':
+        return [
+            os.path.join('solved_networks', f'annual_matching_RES{target}_{year}.nc'),
+            os.path.join('solved_networks', f'annual_matching_RES{target}_{year}.solves.csv'),
+        ]
+    elif kind == 'CFE':
+        score = str(int(target * 100))
+        return [
+            os.path.join('solved_networks', f'hourly_matching_CFE{score}_{year}.nc'),
+            os.path.join('solved_networks', f'hourly_matching_CFE{score}_{year}.solves.csv'),
+            os.path.join('grid_supply_cfe_iterations', f'cfe{score}.csv'),
+            os.path.join('grid_supply_cfe_iterations', f'cfe{score}_residuals.csv'),
+        ]
+    raise ValueError(f"Invalid stage: {kind}")
+
+
+def run_key(run: dict, configs: dict) -> str:
+    '''Returns the hash of all inputs of a run
+
+    Settings that do not change the solved networks are left out: the EXECUTION_ONLY global_vars,
+    and the list of CFE scores of the run (every stage is keyed on its own target, see
+    SolvedNetworkCache.stage_key), so that adding a score keeps the completed ones.
+    '''
+    inputs = {
+        'stock_model': hash_dir(configs['paths']['path_to_model']),
+        'custom_load': (
+            hash_files([run['ci_load_fraction']]) if isinstance(run['ci_load_fraction'], str) else None
+        ),
+        'run': {k: v for k, v in run.items() if k != 'cfe_score'},
+        'global_vars': {k: v for k, v in configs['global_vars'].items() if k not in EXECUTION_ONLY},
+        'grid_cfe_convergence': configs.get('grid_cfe_convergence'),
+        'time_aggregation': configs.get('time_aggregation'),
+        'constraints': configs['constraints'],
+        'palette': configs['technology_palette'][run['palette']],
+        'solver': configs['solver'],
+        'solver_options': configs['solver_options'][configs['solver']['options']],
+        'code': hash_files([os.path.join(ROOT_DIR, f) for f in SOLVE_CODE]),
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class SolvedNetworkCache:
+    """
+    Content-addressed cache of solved networks.
+
+    Every stage of a run (brownfield, RES100, each CFE score) is keyed on a hash of everything that
+    can change its result: the stock model CSVs, the custom C&I load profile, the run and the config
+    sections it uses, and the solve code. On a hit, the stored outputs are copied into the run
+    directory instead of solving.
+
+    Parameters:
+    -----------
+    path : str
+        Directory in which cache entries are stored.
+    max_age_days : float, optional
+        Entries not used for longer than this are evicted.
+    max_size_gb : float, optional
+        The least recently used entries are evicted until the cache is smaller than this.
+    force : bool
+        If True, never restore from the cache (entries are still written).
+
+    """
+
+    def __init__(
+            self,
+            path: str = 'cache/solved_networks/',
+            max_age_days: float = None,
+            max_size_gb: float = None,
+            force: bool = False,
+        ):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_size_gb = max_size_gb
+        self.force = force
+        os.makedirs(self.path, exist_ok=True)
+        self.evict()
+
+    def stage_key(self, run_key: str, stage: tuple) -> str:
+        kind, target = stage
+        return hashlib.sha256(f'{run_key}-{kind}-{target}'.encode()).hexdigest()
+
+    def restore(self, run_key: str, stage: tuple, path_to_run_dir: str, configs: dict) -> bool:
+        '''Copies a cached stage into the run directory. Returns True on a hit.
+        '''
+        if self.force:
+            return False
+
+        entry = os.path.join(self.path, self.stage_key(run_key, stage))
+        outputs = stage_outputs(stage, configs)
+        if not all(os.path.exists(os.path.join(entry, f)) for f in outputs):
+            return False
+
+        for f in outputs:
+            os.makedirs(os.path.dirname(os.path.join(path_to_run_dir, f)), exist_ok=True)
+            shutil.copy2(os.path.join(entry, f), os.path.join(path_to_run_dir, f))
+
+        # mark as recently used
+        os.utime(entry)
+        kind, target = stage
+        print(f"Restored {kind if target is None else f'{kind} {target}'} from cache")
+        return True
+
+    def store(self, run_key: str, stage: tuple, path_to_run_dir: str, configs: dict) -> None:
+        '''Copies the outputs of a solved stage into the cache
+        '''
+        entry = os.path.join(self.path, self.stage_key(run_key, stage))
+        outputs = [f for f in stage_outputs(stage, configs) if os.path.exists(os.path.join(path_to_run_dir, f))]
+        if not outputs:
+            return
+
+        # write to a temporary directory first so concurrent workers never see partial entries
+        tmp = f'{entry}.tmp-{os.getpid()}'
+        for f in outputs:
+            os.makedirs(os.path.dirname(os.path.join(tmp, f)), exist_ok=True)
+            shutil.copy2(os.path.join(path_to_run_dir, f), os.path.join(tmp, f))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        '''Removes entries that are too old, then the least recently used until under the size limit
+        '''
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if not os.path.isdir(entry) or '.tmp-' in name:
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(entry) for f in files
+            )
+            entries.append((os.path.getmtime(entry), size, entry))
+
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            for mtime, _, entry in entries:
+                if mtime < cutoff:
+                    shutil.rmtree(entry, ignore_errors=True)
+            entries = [e for e in entries if e[0] >= cutoff]
+
+        if self.max_size_gb is not None:
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.max_size_gb * 1e9:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+class StockModelCache:
+    """
+    On-disk cache of parsed stock models.
+
+    Loading a stock model with tza-pypsa parses every CSV of the model directory (some of them with
+    17,520 rows) and resamples the time series on every run. The loaded network is stored as netCDF,
+    keyed on the files of the model directory (names, sizes and modification times) and the loading
+    options, so repeated runs only read a single file.
+
+    Parameters:
+    -----------
+    path : str
+        Directory in which the parsed stock models are stored.
+    max_age_days : float, optional
+        Stock models not used for longer than this are evicted.
+
+    Notes:
+    -----------
+    - Only the network as returned by tza-pypsa is cached; run-specific changes (e.g. expansion
+      flags) are applied after loading.
+    - As with any netCDF export, custom boolean columns reload as floats and missing strings as "".
+
+    """
+
+    def __init__(self, path: str = 'cache/stock_models/', max_age_days: float = None):
+        self.path = path
+        self.max_age_days = max_age_days
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, run: dict, configs: dict) -> str:
+        '''Returns the hash of everything that determines the parsed stock model of a run
+        '''
+        yaml_model = configs["model_runs"][0]["stock_model"] == "ASEAN_yaml"
+        inputs = {
+            'source': run['stock_model'] if yaml_model else stat_dir(configs['paths']['path_to_model']),
+            'frequency': configs['global_vars']['frequency'],
+            'timesteps': configs['global_vars']['timesteps'],
+            'years': [configs['global_vars']['year']],
+            'select_nodes': run.get('select_nodes') if yaml_model else None,
+            'backstop': run.get('backstop') if yaml_model else None,
+            'set_global_constraints': configs['global_vars']['set_global_constraints'],
+            'tza_pypsa': _package_version('tza-pypsa'),
+            'pypsa': pypsa.__version__,
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def load(self, run: dict, configs: dict, loader) -> pypsa.Network:
+        '''Returns the cached stock model of a run, or calls `loader()` and caches its result
+        '''
+        entry = os.path.join(self.path, f'{self.key(run, configs)}.nc')
+        if os.path.exists(entry):
+            # mark as recently used
+            os.utime(entry)
+            print(f"Loaded stock model from cache: {entry}")
+            return pypsa.Network(entry)
+
+        network = loader()
+
+        # write to a temporary file first so concurrent workers never read partial entries
+        tmp = f'{entry}.tmp-{os.getpid()}'
+        network.export_to_netcdf(tmp)
+        os.replace(tmp, entry)
+        self.evict()
+        return network
+
+    def evict(self) -> None:
+        '''Removes stock models that have not been used for `max_age_days`
+        '''
+        if self.max_age_days is None:
+            return
+        cutoff = time.time() - self.max_age_days * 86400
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.endswith('.nc') and os.path.getmtime(entry) < cutoff:
+                os.remove(entry)
+
+
+class ResultsManifest:
+    """
+    Records which plots and results tables of a run were produced from what, so that plots whose
+    inputs did not change are not redrawn.
+
+    Each plot is keyed on a hash of the solved networks of the run, the source of its plot function
+    and of the modules it relies on (PLOT_CODE), and its arguments. The manifest is stored as
+    `manifest.json` in the results directory, with the inputs and outputs of each plot.
+
+    Parameters:
+    -----------
+    path : str
+        The results directory of a run.
+    inputs : list
+        The solved networks (.nc files) of the run.
+
+    Notes:
+    -----------
+    - The solved networks are only re-hashed when their size or modification time changed.
+    - A plot is redrawn if any of the outputs it produced no longer exists.
+
+    """
+
+    def __init__(self, path: str, inputs: list):
+        self.path = path
+        self.file = os.path.join(path, 'manifest.json')
+        manifest = {}
+        if os.path.exists(self.file):
+            with open(self.file) as f:
+                manifest = json.load(f)
+        self.plots = manifest.get('plots', {})
+        self.inputs = self._hash_inputs(inputs, manifest.get('inputs', {}))
+        self._code = hash_files([os.path.join(ROOT_DIR, f) for f in PLOT_CODE])
+
+    def _hash_inputs(self, files: list, previous: dict) -> dict:
+        inputs = {}
+        for path in sorted(files):
+            stat = os.stat(path)
+            entry = previous.get(os.path.basename(path), {})
+            if entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hash_files([path])}
+            inputs[os.path.basename(path)] = entry
+        return inputs
+
+    def key(self, func, kwargs: dict) -> str:
+        '''Returns the hash of everything that determines the outputs of a plot function
+        '''
+        inputs = {
+            'inputs': {name: entry['sha256'] for name, entry in self.inputs.items()},
+            'function': inspect.getsource(func),
+            'code': self._code,
+            # outputs are written relative to the run directory, wherever it is
+            'kwargs': {k: v for k, v in kwargs.items() if k != 'path_to_run_dir'},
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def is_current(self, func, kwargs: dict) -> bool:
+        '''Returns True if the outputs of a plot were produced from the current inputs and still exist
+        '''
+        entry = self.plots.get(func.__name__)
+        return (
+            entry is not None
+            and entry['key'] == self.key(func, kwargs)
+            and all(os.path.exists(os.path.join(self.path, f)) for f in entry['outputs'])
+        )
+
+    def record(self, func, kwargs: dict, patterns: list) -> None:
+        '''Records the outputs of a plot, as the files of the results directory (and its subdirectories)
+        that match glob patterns
+        '''
+        outputs = sorted({
+            os.path.relpath(f, self.path)
+            for pattern in patterns
+            for f in glob.glob(os.path.join(self.path, '**', pattern), recursive=True)
+        })
+        self.plots[func.__name__] = {
+            'key': self.key(func, kwargs),
+            'inputs': sorted(self.inputs),
+            'outputs': outputs,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    def discard(self, func) -> None:
+        self.plots.pop(func.__name__, None)
+
+    def save(self) -> None:
+        tmp = f'{self.file}.tmp-{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump({'inputs': self.inputs, 'plots': self.plots}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.file)
+
+
+class RunManifest:
+    """
+    Checkpoints of a run, so that an interrupted `run-full-cfe` resumes from the last completed stage.
+
+    The manifest (`manifest.json` in the run directory) records each completed stage of the run
+    (brownfield, RES100 and each CFE score). During the GridCFE iteration of a CFE score, the
+    GridCFE of every iteration is stored in `checkpoints/cfe<score>.parquet`, so that an interrupted
+    score restarts from its last GridCFE instead of from zero.
+
+    Parameters:
+    -----------
+    path_to_run_dir : str
+        The output directory of the run.
+    key : str
+        Hash of the inputs of the run (see run_key). Checkpoints written for other inputs are discarded.
+    reset : bool
+        If True, discard all checkpoints and start afresh.
+
+    Notes:
+    -----------
+    - A stage is only recorded once all its outputs are written (see export.BackgroundExporter),
+      and it only counts as completed while its outputs exist.
+    - The manifest is only written by the process that created it, from any thread: stages solved
+      in pool workers are recorded by the parent once the worker returns. GridCFE checkpoints have
+      one file per CFE score and can be written from any process.
+    - The state of the convergence engine (e.g. the Anderson history) is not checkpointed, so a
+      resumed score restarts its acceleration from the stored GridCFE.
+
+    """
+
+    def __init__(self, path_to_run_dir: str, key: str, reset: bool = False):
+        self.path = path_to_run_dir
+        self.file = os.path.join(path_to_run_dir, 'manifest.json')
+        self.checkpoints = os.path.join(path_to_run_dir, 'checkpoints')
+        self.key = key
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+        manifest = {}
+        if os.path.exists(self.file):
+            with open(self.file) as f:
+                manifest = json.load(f)
+        if reset or manifest.get('key') != key:
+            manifest = {}
+            shutil.rmtree(self.checkpoints, ignore_errors=True)
+        self.stages = manifest.get('stages', {})
+        self.save()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stage_name(stage: tuple) -> str:
+        kind, target = stage
+        return kind if target is None else f'{kind}-{target}'
+
+    def completed(self, stage: tuple, configs: dict) -> bool:
+        '''Returns True if a stage was completed and its outputs still exist
+        '''
+        return self.stage_name(stage) in self.stages and all(
+            os.path.exists(os.path.join(self.path, f)) for f in stage_outputs(stage, configs)
+        )
+
+    def complete(self, stage: tuple) -> None:
+        '''Records a stage as completed. Does nothing outside the process that created the manifest.
+        '''
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            self.stages[self.stage_name(stage)] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.save()
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f'{self.file}.tmp-{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump({'key': self.key, 'stages': self.stages}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.file)
+
+    def _grid_cfe_file(self, cfe_score) -> str:
+        return os.path.join(self.checkpoints, f'cfe{int(cfe_score * 100)}.parquet')
+
+    def save_grid_cfe(self, cfe_score, iterations: pd.DataFrame, grid_cfe: pd.DataFrame) -> None:
+        '''Stores the GridCFE iterations of a CFE score (stacked, one column per iteration) and the
+        GridCFE (bus x snapshot) to apply in the next iteration
+        '''
+        os.makedirs(self.checkpoints, exist_ok=True)
+        entry = self._grid_cfe_file(cfe_score)
+        tmp = f'{entry}.tmp-{os.getpid()}'
+        iterations.assign(next=grid_cfe.stack()).to_parquet(tmp)
+        os.replace(tmp, entry)
+
+    def load_grid_cfe(self, cfe_score):
+        '''Returns the stored GridCFE iterations of a CFE score and the stacked GridCFE to apply
+        next, or None if there is no checkpoint
+        '''
+        entry = self._grid_cfe_file(cfe_score)
+        if not os.path.exists(entry):
+            return None
+        stored = pd.read_parquet(entry)
+        return stored.drop(columns='next'), stored['next']
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
@@ -2,6 +2,21 @@ import pypsa
 import numpy as np
 import pandas as pd
 
+from . import trace
+
+# metadata columns set by PrepareNetworkForCFE on every C&I component it adds
+CI_COLUMNS = ['ci_bus', 'ci_role', 'ci_clean', 'ci_parent_bus']
+CI_COMPONENTS = ['Bus', 'Load', 'Link', 'Generator', 'StorageUnit']
+
+# roles of the C&I links by the end of their name, for networks prepared without the metadata columns
+CI_LINK_ROLES = {
+    'Grid Imports': 'import',
+    'Grid Exports': 'export',
+    'Storage Charge': 'charge',
+    'Storage Discharge': 'discharge',
+}
+
+@trace.traced
 def PrepareNetworkForCFE(
         network: pypsa.Network, 
         buses_with_ci_load: list,
@@ -45,9 +60,36 @@ def PrepareNetworkForCFE(
     - The function adds jitter to the coordinates of new buses to avoid overlap.
     - Small capital and marginal costs are added to links to prevent model infeasibilities.
     - The function ensures that the C&I load is subtracted from the overall load to prevent double-counting.
+    - Every added component is tagged with the metadata columns in CI_COLUMNS, which are used to look up
+      C&I components (see get_ci_index) instead of matching their names.
 
     """
     
+    # The C&I system of every bus is assembled as one table per component type, and each table is
+    # added to the network in a single bulk `network.add`.
+    buses, loads, links, generators, storage_units = [], [], [], [], []
+    ci_load_profiles = {}
+
+    # parameters of the technologies that can be procured, taken from the extendable assets of each
+    # bus (first non-null value of every attribute)
+    extendable_generators = network.generators.loc[network.generators["p_nom_extendable"] == True]
+    # stock models store the flag as bools, 0/1 or NaN
+    is_blend_or_ccs = extendable_generators['is_blend_or_ccs'].fillna(0).astype(bool)
+    generator_params = extendable_generators.groupby(by=['type', 'bus']).first()
+    extendable_storage_units = network.storage_units.loc[network.storage_units["p_nom_extendable"] == True]
+    # ...for storage, the values of the last type of a carrier on a bus are used
+    storage_params = (
+        extendable_storage_units
+        .groupby(by=['carrier', 'bus', 'type'])
+        .first()
+        .groupby(level=['carrier', 'bus'])
+        .tail(1)
+        .droplevel('type')
+    )
+    generator_types = network.generators.type.unique()
+    storage_carriers = network.storage_units.carrier.unique()
+    co2_emissions = network.generators.carrier.map(network.carriers.co2_emissions)
+
     # STEP 1:
     # Loop through each bus on which we want to model a C&I system/asset. 
     # The logic here is to abstract the C&I system as a separate entity.
@@ -61,101 +103,57 @@ def PrepareNetworkForCFE(
         ci_storage_bus_name = f'{bus} C&I Storage'
 
         # add a bus for the C&I system
-        network.add(
-            'Bus',
-            ci_bus_name,
-            x = network.buses.x.iloc[0] + 1, # add jitter
-            y = network.buses.y.iloc[0] + 1, # add jitter
-        )
+        buses.append({
+            'name': ci_bus_name,
+            'x': network.buses.x.iloc[0] + 1, # add jitter
+            'y': network.buses.y.iloc[0] + 1, # add jitter
+            **ci_metadata(ci_bus_name, 'grid', bus),
+        })
 
         # add another bus to connect C&I bus with energy storage
-        network.add(
-            'Bus',
-            ci_storage_bus_name,
-            x = network.buses.x.iloc[0] - 1, # add jitter
-            y = network.buses.y.iloc[0] - 1, # add jitter
-        )
+        buses.append({
+            'name': ci_storage_bus_name,
+            'x': network.buses.x.iloc[0] - 1, # add jitter
+            'y': network.buses.y.iloc[0] - 1, # add jitter
+            **ci_metadata(ci_bus_name, 'storage', bus),
+        })
 
         # add C&I load
         if isinstance(ci_load_fraction, float):
-            network.add(
-                "Load",
-                ci_load_name,
-                bus = ci_bus_name,
-                p_set = network.loads_t.p_set[bus] * ci_load_fraction,
-            )
-            # now subtract the C&I load from the overall load to prevent double-counting
-            network.loads_t.p_set[bus] = network.loads_t.p_set[bus] - network.loads_t.p_set[ci_load_name]
+            ci_load_profiles[ci_load_name] = network.loads_t.p_set[bus] * ci_load_fraction
         elif isinstance(ci_load_fraction, str):
             # retrieve custom load profile from string supplied, which should be the path
-            custom_load_profile = pd.read_csv(ci_load_fraction, index_col=0, parse_dates=True).iloc[:, 0]
-            network.add(
-                "Load",
-                ci_load_name,
-                bus = ci_bus_name,
-                p_set = custom_load_profile,
-            )
-            # now subtract the C&I load from the overall load to prevent double-counting
-            network.loads_t.p_set[bus] = network.loads_t.p_set[bus] - network.loads_t.p_set[ci_load_name]
+            ci_load_profiles[ci_load_name] = pd.read_csv(ci_load_fraction, index_col=0, parse_dates=True).iloc[:, 0]
         else:
             # return error
             raise ValueError("Invalid data supplied for ci_load_fraction. Must be float or path to csv.")
+        loads.append({'name': ci_load_name, 'bus': ci_bus_name, **ci_metadata(ci_bus_name, 'load', bus)})
 
         # STEP 2:
         # Add virtual links between buses to represent flows of electricity.
         # Specifically, we add the following:
         #   - LocalGrid <-> C&I system
         #   - C&I system <-> C&I storage
-
-        # LocalGrid <-> C&I system
-        network.add(
-            "Link",
-            f"{bus} C&I Grid Imports",
-            bus0=bus, 
-            bus1=ci_bus_name, 
-            p_nom=0,
-            p_nom_extendable=True, # keep this as True to prevent infeasibilities
-            # add small capital and marginal costs to prevent model infeasibilities
-            marginal_cost=0.01, 
-            capital_cost=0.01,
-        )
-
-        network.add(
-            "Link",
-            f"{bus} C&I Grid Exports",
-            bus0=ci_bus_name, 
-            bus1=bus,
-            p_nom=0,
-            p_nom_extendable=p_nom_extendable,
-            # add small capital and marginal costs to prevent model infeasibilities
-            marginal_cost=0.01, 
-            capital_cost=0.01,
-        )
-
-        # C&I system <-> C&I storage
-        network.add(
-            "Link",
-            f"{bus} C&I Storage Charge",
-            bus0=ci_bus_name, 
-            bus1=ci_storage_bus_name, 
-            p_nom=0,
-            p_nom_extendable=p_nom_extendable,
-            # add small capital and marginal costs to prevent model infeasibilities
-            marginal_cost=0.01, 
-            capital_cost=0.01,
-        )
-
-        network.add(
-            "Link",
-            f"{bus} C&I Storage Discharge",
-            bus0=ci_storage_bus_name, 
-            bus1=ci_bus_name, 
-            p_nom=0,
-            p_nom_extendable=p_nom_extendable,
-            # add small capital and marginal costs to prevent model infeasibilities
-            marginal_cost=0.01, 
-            capital_cost=0.01,
-        )
+        # Small capital and marginal costs are added to prevent model infeasibilities.
+
+        for name, bus0, bus1, role, extendable in [
+            # LocalGrid <-> C&I system; keep imports extendable to prevent infeasibilities
+            (f"{bus} C&I Grid Imports", bus, ci_bus_name, 'import', True),
+            (f"{bus} C&I Grid Exports", ci_bus_name, bus, 'export', p_nom_extendable),
+            # C&I system <-> C&I storage
+            (f"{bus} C&I Storage Charge", ci_bus_name, ci_storage_bus_name, 'charge', p_nom_extendable),
+            (f"{bus} C&I Storage Discharge", ci_storage_bus_name, ci_bus_name, 'discharge', p_nom_extendable),
+        ]:
+            links.append({
+                'name': name,
+                'bus0': bus0,
+                'bus1': bus1,
+                'p_nom': 0,
+                'p_nom_extendable': extendable,
+                'marginal_cost': 0.01,
+                'capital_cost': 0.01,
+                **ci_metadata(ci_bus_name, role, bus),
+            })
 
         # STEP 3:
         # Add generators and storages to C&I bus within the technology palette. 
@@ -164,216 +162,376 @@ def PrepareNetworkForCFE(
         for technology in technology_palette:
 
             # check if technology is generator or storage
-            if technology in network.generators.type.unique():
-                
-                # get params from existing technologies
-                params = (
-                    network
-                    .generators
-                    .loc[ 
-                        ((network.generators["type"] == technology) & (network.generators["bus"] == bus) & (network.generators["p_nom_extendable"] == True))
-                    ]
-                    .groupby(by='type')
-                    .first()
-                    .melt()
-                    .set_index('variable')
-                    ['value']
-                    .to_dict()
-                )
+            if technology in generator_types:
 
-                # get capacity factors if technology is renewable, ensuring correct technology and bus is used
-                generator_names = network.generators.index[
-                    ((network.generators["type"] == technology) & (network.generators["bus"] == bus) 
-                     & (network.generators["p_nom_extendable"] == True))
+                # existing extendable generators of this technology on the bus
+                generator_names = extendable_generators.index[
+                    (extendable_generators["type"] == technology) & (extendable_generators["bus"] == bus)
                 ]
+                if generator_names.empty:
+                    continue
+                params = generator_params.loc[(technology, bus)]
 
-                for generator in generator_names:
-                    if (network.generators.loc[generator].is_blend_or_ccs is True or
-                    generator not in network.generators_t.p_max_pu.columns):
-                        cf_int = np.ones((8760,1))
-                        cf = pd.DataFrame(cf_int)
-                    else:
-                        cf = network.generators_t.p_max_pu[generator_names]
-
-                if cf.empty:
-                    cf = params['p_max_pu']
+                # get capacity factors if technology is renewable, ensuring correct technology and bus is used
+                last_generator = generator_names[-1]
+                if is_blend_or_ccs[last_generator] or last_generator not in network.generators_t.p_max_pu.columns:
+                    cf = np.ones(len(network.snapshots))
                 else:
-                    cf = cf.iloc[:,0].values
+                    cf = network.generators_t.p_max_pu[generator_names[0]].values
 
                 for generator in generator_names:
-                    
-                    if network.carriers.loc[network.generators.carrier[generator]].co2_emissions <= 0:
-                    # add generator
-                        network.add(
-                            'Generator', # PyPSA component
-                            ci_bus_name + '-' + technology + '-ext-' + str(params['build_year']) + '-' + 'PPA' + '-' + 'Clean', # generator name
-                            type = technology, # technology type (e.g., solar, gas-ccgt etc.)
-                            bus = ci_bus_name, # region/bus/balancing zone
-                            # ---
-                            # unique technology parameters by bus
-                            p_nom = 0, # starting capacity (MW)
-                            p_nom_min = 0, # minimum capacity (MW)
-                            #p_nom_max = params['p_nom_max'], # set this to constrain capacity build out, e.g. to a technical potential
-                            p_max_pu = cf, # capacity factor
-                            p_min_pu = params['p_min_pu'], # minimum capacity factor
-                            efficiency = params['efficiency'], # efficiency
-                            ramp_limit_up = params['ramp_limit_up'], # per unit
-                            ramp_limit_down = params['ramp_limit_down'], # per unit
-                            # ---
-                            # universal technology parameters
-                            p_nom_extendable = p_nom_extendable, # can the model build more?
-                            capital_cost = params['capital_cost'], # currency/MW
-                            marginal_cost = network.generators.loc[generator].marginal_cost, # currency/MWh
-                            carrier = network.generators.loc[generator].carrier, # commodity/carrier
-                            build_year = params['build_year'], # year available from
-                            lifetime = params['lifetime'], # years
-                            start_up_cost = params['start_up_cost'], # currency/MW
-                            shut_down_cost = params['shut_down_cost'], # currency/MW
-                            committable = params['committable'], # UNIT COMMITMENT
-                            ramp_limit_start_up = params['ramp_limit_start_up'], # 
-                            ramp_limit_shut_down = params['ramp_limit_shut_down'], # 
-                            min_up_time = params['min_up_time'], # 
-                            min_down_time = params['min_down_time'],
-                            is_blend_or_ccs = params['is_blend_or_ccs'],
-                            generation_blend_share = network.generators.loc[generator].generation_blend_share, #
-                            min_utilisation_rate = params['min_utilisation_rate'], 
-                            max_utilisation_rate = params['max_utilisation_rate']  
-                        )
-                    
-                    else:
-
-                        network.add(
-                            'Generator', # PyPSA component
-                            ci_bus_name + '-' + technology + '-ext-' + str(params['build_year']) + '-' + 'PPA' + '-' + 'Fossil', # generator name
-                            type = technology, # technology type (e.g., solar, gas-ccgt etc.)
-                            bus = ci_bus_name, # region/bus/balancing zone
-                            # ---
-                            # unique technology parameters by bus
-                            p_nom = 0, # starting capacity (MW)
-                            p_nom_min = 0, # minimum capacity (MW)
-                            #p_nom_max = params['p_nom_max'], # set this to constrain capacity build out, e.g. to a technical potential
-                            p_max_pu = cf, # capacity factor
-                            p_min_pu = params['p_min_pu'], # minimum capacity factor
-                            efficiency = params['efficiency'], # efficiency
-                            ramp_limit_up = params['ramp_limit_up'], # per unit
-                            ramp_limit_down = params['ramp_limit_down'], # per unit
-                            # ---
-                            # universal technology parameters
-                            p_nom_extendable = p_nom_extendable, # can the model build more?
-                            capital_cost = params['capital_cost'], # currency/MW
-                            marginal_cost = network.generators.loc[generator].marginal_cost, # currency/MWh
-                            carrier = network.generators.loc[generator].carrier, # commodity/carrier
-                            build_year = params['build_year'], # year available from
-                            lifetime = params['lifetime'], # years
-                            start_up_cost = params['start_up_cost'], # currency/MW
-                            shut_down_cost = params['shut_down_cost'], # currency/MW
-                            committable = params['committable'], # UNIT COMMITMENT
-                            ramp_limit_start_up = params['ramp_limit_start_up'], # 
-                            ramp_limit_shut_down = params['ramp_limit_shut_down'], # 
-                            min_up_time = params['min_up_time'], # 
-                            min_down_time = params['min_down_time'], # 
-                            is_blend_or_ccs = params['is_blend_or_ccs'],
-                            generation_blend_share = network.generators.loc[generator].generation_blend_share,
-                            min_utilisation_rate = params['min_utilisation_rate'], 
-                            max_utilisation_rate = params['max_utilisation_rate']  #                             
-                        )
-                
-            elif technology in network.storage_units.carrier.unique():
-                
-                # get params
-                params = (
-                    network
-                    .storage_units
-                    .loc[ 
-                        ((network.storage_units["carrier"] == technology)
-                        & (network.storage_units["bus"] == bus)
-                        & (network.storage_units["p_nom_extendable"] == True))
-                    ]
-                    .groupby(by='type')
-                    .first()
-                    .melt()
-                    .set_index('variable')
-                    ['value']
-                    .to_dict()
-                )
-
-                network.add(
-                    "StorageUnit",
-                    ci_bus_name + '-' + params['carrier'],
-                    bus = ci_storage_bus_name,
-                    p_nom_extendable = p_nom_extendable,
-                    cyclic_state_of_charge=True,
-                    max_hours=params['max_hours'],
-                    build_year=params['build_year'],
-                    carrier=params['carrier'],
-                    capital_cost=params['capital_cost'],
-                    efficiency_store=params['efficiency_store'],
-                    efficiency_dispatch=params['efficiency_dispatch'],
-                    standing_loss=params['standing_loss'],
-                    lifetime=params['lifetime']
-                )
-                
-                '''
 
-                TODO!
-                
-                Hydrogen storages need to be modelled with fundamental stores (i.e., PyPSA Store components)
-                
-                This is described in the links below:
-                    - https://fneum.github.io/data-science-for-esm/09-workshop-pypsa.html
-                    - https://groups.google.com/g/pypsa/c/Owf6_6aHhRM
-                    - https://pypsa.readthedocs.io/en/stable/examples/replace-generator-storage-units-with-store.html
-                
-                '''
+                    clean = co2_emissions[generator] <= 0
+                    generators.append({
+                        'name': ci_bus_name + '-' + technology + '-ext-' + str(params['build_year']) + '-' + 'PPA' + '-' + ('Clean' if clean else 'Fossil'), # generator name
+                        'type': technology, # technology type (e.g., solar, gas-ccgt etc.)
+                        'bus': ci_bus_name, # region/bus/balancing zone
+                        # ---
+                        # unique technology parameters by bus
+                        'p_nom': 0, # starting capacity (MW)
+                        'p_nom_min': 0, # minimum capacity (MW)
+                        'p_max_pu': cf, # capacity factor
+                        'p_min_pu': params['p_min_pu'], # minimum capacity factor
+                        'efficiency': params['efficiency'], # efficiency
+                        'ramp_limit_up': params['ramp_limit_up'], # per unit
+                        'ramp_limit_down': params['ramp_limit_down'], # per unit
+                        # ---
+                        # universal technology parameters
+                        'p_nom_extendable': p_nom_extendable, # can the model build more?
+                        'capital_cost': params['capital_cost'], # currency/MW
+                        'marginal_cost': extendable_generators.at[generator, 'marginal_cost'], # currency/MWh
+                        'carrier': extendable_generators.at[generator, 'carrier'], # commodity/carrier
+                        'build_year': params['build_year'], # year available from
+                        'lifetime': params['lifetime'], # years
+                        'start_up_cost': params['start_up_cost'], # currency/MW
+                        'shut_down_cost': params['shut_down_cost'], # currency/MW
+                        'committable': params['committable'], # UNIT COMMITMENT
+                        'ramp_limit_start_up': params['ramp_limit_start_up'],
+                        'ramp_limit_shut_down': params['ramp_limit_shut_down'],
+                        'min_up_time': params['min_up_time'],
+                        'min_down_time': params['min_down_time'],
+                        'is_blend_or_ccs': params['is_blend_or_ccs'],
+                        'generation_blend_share': extendable_generators.at[generator, 'generation_blend_share'],
+                        'min_utilisation_rate': params['min_utilisation_rate'],
+                        'max_utilisation_rate': params['max_utilisation_rate'],
+                        **ci_metadata(ci_bus_name, 'ppa', bus, clean=clean),
+                    })
+
+            elif technology in storage_carriers:
+
+                # get params
+                params = storage_params.loc[(technology, bus)]
+
+                storage_units.append({
+                    'name': ci_bus_name + '-' + technology,
+                    'bus': ci_storage_bus_name,
+                    'p_nom_extendable': p_nom_extendable,
+                    'cyclic_state_of_charge': True,
+                    'max_hours': params['max_hours'],
+                    'build_year': params['build_year'],
+                    'carrier': technology,
+                    'capital_cost': params['capital_cost'],
+                    'efficiency_store': params['efficiency_store'],
+                    'efficiency_dispatch': params['efficiency_dispatch'],
+                    'standing_loss': params['standing_loss'],
+                    'lifetime': params['lifetime'],
+                    **ci_metadata(ci_bus_name, 'storage', bus, clean=True),
+                })
 
             else:
                 raise ValueError(f"Invalid technology: {technology}")
 
+    if not buses:
+        return network
+
+    # STEP 4:
+    # Bulk insert the C&I systems of all buses, one component type at a time.
+
+    buses = _to_frame(buses)
+    network.add('Bus', buses.index, **buses)
+
+    loads = _to_frame(loads)
+    network.add('Load', loads.index, **loads, p_set=pd.concat(ci_load_profiles, axis=1))
+    # now subtract the C&I load from the overall load to prevent double-counting
+    for ci_load_name, bus in loads.ci_parent_bus.items():
+        network.loads_t.p_set[bus] = network.loads_t.p_set[bus] - network.loads_t.p_set[ci_load_name]
+
+    links = _to_frame(links)
+    network.add('Link', links.index, **links)
+
+    if generators:
+        cf = pd.DataFrame(
+            np.column_stack([g.pop('p_max_pu') for g in generators]), index=network.snapshots
+        )
+        generators = _to_frame(generators)
+        # several existing generators of a technology can map to the same PPA generator; the first is kept
+        is_first = ~generators.index.duplicated()
+        generators = generators.loc[is_first]
+        network.add('Generator', generators.index, **generators, p_max_pu=cf.loc[:, is_first].set_axis(generators.index, axis=1))
+
+    if storage_units:
+        storage_units = _to_frame(storage_units)
+        network.add('StorageUnit', storage_units.index, **storage_units)
+
+    clear_ci_cache(network)
     return network
 
 
+def _to_frame(rows : list) -> pd.DataFrame:
+    '''Returns a table of components indexed by name, from one dict of attributes per component
+    '''
+    return pd.DataFrame(rows).set_index('name')
+
+
+def ci_metadata(ci_bus : str, role : str, parent_bus : str, clean : bool = False) -> dict:
+    '''Returns the metadata columns of a C&I component, to be passed to network.add
+    '''
+    return {'ci_bus': ci_bus, 'ci_role': role, 'ci_clean': clean, 'ci_parent_bus': parent_bus}
+
+
+def get_ci_index(n : pypsa.Network, ci_identifier : str = 'C&I') -> pd.DataFrame:
+    '''Returns all C&I components of a network and their metadata
+
+    The index is built once from the metadata columns set by PrepareNetworkForCFE and cached on the
+    network until the index of a component table changes (components are added or removed) or the
+    cache is cleared (see clear_ci_cache). Networks prepared without these columns (e.g. older
+    solved networks) fall back to parsing the component names once.
+
+    Returns:
+    -----------
+    pd.DataFrame
+        One row per C&I component, with columns component, name, ci_bus, role, clean and parent_bus.
+    '''
+    # the cache holds the index objects themselves, so they cannot be freed and their ids reused
+    key = (ci_identifier, *(n.static(c).index for c in CI_COMPONENTS))
+    cached = getattr(n, '_ci_index', None)
+    if cached is not None and _same_key(cached[0], key):
+        return cached[1]
+
+    frames = []
+    for c in CI_COMPONENTS:
+        static = n.static(c)
+        if 'ci_role' in static:
+            ci = static.loc[static.ci_role.fillna('').astype(str) != '']
+            frames.append(pd.DataFrame({
+                'component': c,
+                'name': ci.index,
+                'ci_bus': ci.ci_bus.values,
+                'role': ci.ci_role.values,
+                'clean': ci.ci_clean.eq(True).values,
+                'parent_bus': ci.ci_parent_bus.values,
+            }))
+        else:
+            frames.append(_parse_ci_names(static.index, c, ci_identifier))
+
+    index = pd.concat(frames, ignore_index=True)
+    n._ci_index = (key, index)
+    return index
+
+
+def clear_ci_cache(n : pypsa.Network) -> None:
+    '''Drops the C&I index and grid generator map cached on a network (see get_ci_index and
+    _grid_generator_map), e.g. after its C&I metadata or the buses or carriers of its generators are
+    edited in place
+    '''
+    for attr in ['_ci_index', '_grid_generator_map']:
+        n.__dict__.pop(attr, None)
+
+
+def _same_key(cached : tuple, key : tuple) -> bool:
+    '''Whether two cache keys match: index objects by identity, other values by equality
+    '''
+    return len(cached) == len(key) and all(
+        a is b if isinstance(b, pd.Index) else a == b for a, b in zip(cached, key)
+    )
+
+
+def get_ci_components(
+        n : pypsa.Network,
+        component : str,
+        role : str | list = None,
+        parent_bus : str | list = None,
+        clean : bool = None,
+        ci_identifier : str = 'C&I',
+    ) -> pd.Index:
+    '''Returns the names of the C&I components of one type, optionally filtered by role, parent bus and clean/fossil
+
+    For example, the fossil PPA generators of a bus: get_ci_components(n, 'Generator', 'ppa', bus, clean=False)
+    '''
+    index = get_ci_index(n, ci_identifier)
+    mask = index.component == component
+    if role is not None:
+        mask &= index.role.isin([role] if isinstance(role, str) else role)
+    if parent_bus is not None:
+        mask &= index.parent_bus.isin([parent_bus] if isinstance(parent_bus, str) else parent_bus)
+    if clean is not None:
+        mask &= index.clean == clean
+    return pd.Index(index.loc[mask, 'name'], name=component)
+
+
+def _parse_ci_names(names : pd.Index, component : str, ci_identifier : str) -> pd.DataFrame:
+    '''Derives the C&I metadata from the names given by PrepareNetworkForCFE
+    '''
+    names = names.astype(str)
+    names = names[names.str.contains(ci_identifier, regex=False)]
+    parent_bus = names.str.split(ci_identifier, regex=False).str[0].str.strip()
+
+    if component == 'Bus':
+        role = np.where(names.str.endswith('Storage'), 'storage', 'grid')
+    elif component == 'Link':
+        role = np.full(len(names), '', dtype=object)
+        for suffix, link_role in CI_LINK_ROLES.items():
+            role[names.str.endswith(suffix)] = link_role
+    else:
+        role = {'Load': 'load', 'Generator': 'ppa', 'StorageUnit': 'storage'}[component]
+
+    return pd.DataFrame({
+        'component': component,
+        'name': names,
+        'ci_bus': parent_bus + f' {ci_identifier} Grid',
+        'role': role,
+        'clean': names.str.endswith('Clean') if component == 'Generator' else component == 'StorageUnit',
+        'parent_bus': parent_bus,
+    })
+
+
+@trace.traced
+def GetGridCFE(
+        n : pypsa.Network,
+        ci_buses : list,
+        ci_identifier : str = 'C&I',
+    ) -> pd.DataFrame:
+    """
+
+    Calculate the CFE score of the grid supplying each C&I bus. Here, we follow the mathematical
+    expressions presented by Xu and Jenkins (2021): https://acee.princeton.edu/24-7/
+
+    Parameters:
+    -----------
+    n : pypsa.Network
+        The optimised network for which we are calculating the GridCFE.
+    ci_buses : list
+        The country buses with C&I load for which we are calculating the GridCFE.
+    ci_identifier : str
+        The unique identifer used to identify C&I assets.
+
+    Returns:
+    -----------
+    pd.DataFrame
+        Hourly resolution grid CFE scores, one row per C&I bus and one column per snapshot.
+
+    Notes:
+    -----------
+    - The grid of a bus (R, the intra-regional grid) is made of the generators connected to the bus
+      that are not C&I assets (see get_ci_index). Clean generators are those whose carrier does not
+      emit CO2.
+    - The clean and total generation of all buses are computed in a single pass over
+      `generators_t.p`; the generator-to-bus map is cached on the network (see _grid_generator_map).
+
+    """
+
+    membership, clean = _grid_generator_map(n, ci_buses, ci_identifier)
+    p = n.generators_t.p.reindex(columns=membership.columns, fill_value=0.0).values.T
+
+    total_generation = membership.values @ p
+    total_clean_generation = (membership.values * clean) @ p
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grid_cfe = total_clean_generation / total_generation
+
+    return pd.DataFrame(grid_cfe, index=pd.Index(ci_buses, name='bus'), columns=n.snapshots).round(2)
+
+
+def _grid_generator_map(n : pypsa.Network, ci_buses : list, ci_identifier : str) -> tuple:
+    '''Returns the (C&I bus x generator) membership of the grid of each bus and the clean generator mask
+
+    Cached on the network until generators or carriers are added or removed, or the cache is
+    cleared (see clear_ci_cache).
+    '''
+    key = (tuple(ci_buses), ci_identifier, n.generators.index, n.carriers.index)
+    cached = getattr(n, '_grid_generator_map', None)
+    if cached is not None and _same_key(cached[0], key):
+        return cached[1]
+
+    located = n.generators.bus.values
+    is_grid = ~n.generators.index.isin(get_ci_components(n, 'Generator', ci_identifier=ci_identifier))
+    membership = pd.DataFrame(
+        [(located == bus) & is_grid for bus in ci_buses],
+        index=ci_buses,
+        columns=n.generators.index,
+    )
+    clean = (n.generators.carrier.map(n.carriers.co2_emissions) <= 0).values
+
+    n._grid_generator_map = (key, (membership, clean))
+    return membership, clean
+
+
+def grid_cfe_matrix(GridCFE, ci_buses : list, snapshots : pd.Index) -> pd.DataFrame:
+    '''Returns GridCFE as a (C&I bus x snapshot) table
+
+    Accepts such a table, a (bus x snapshot) array in the order of `ci_buses`, or a single hourly
+    series or value that is applied to every bus (e.g. the initial GridCFE of zero).
+    '''
+    if isinstance(GridCFE, pd.DataFrame):
+        return GridCFE.reindex(index=ci_buses)
+
+    return pd.DataFrame(
+        np.broadcast_to(np.asarray(GridCFE, dtype=float), (len(ci_buses), len(snapshots))).copy(),
+        index=pd.Index(ci_buses, name='bus'),
+        columns=snapshots,
+    )
+
+
+@trace.traced
 def apply_cfe_constraint(
         n : pypsa.Network, 
-        GridCFE : list, 
+        GridCFE : pd.DataFrame, 
         ci_buses : list, 
         ci_identifier : str, 
         CFE_Score : float,
         max_excess_export : float,
     ) -> pypsa.Network:
     '''Set CFE constraint
+
+    Annual sums are weighted by the snapshot weightings, so the constraints also hold when the
+    snapshots are aggregated (see aggregation.AggregateSnapshots). GridCFE is a (C&I bus x snapshot)
+    table, as returned by GetGridCFE; each bus uses its own row.
     '''
+    weights = n.snapshot_weightings.generators.values
+    GridCFE = grid_cfe_matrix(GridCFE, ci_buses, n.snapshots)
+
     for bus in ci_buses:
         # ---
         # fetch necessary variables to implement CFE
 
         CI_Demand = (
-            n.loads_t.p_set.filter(regex=bus).filter(regex=ci_identifier).values.flatten()
+            n.loads_t.p_set[get_ci_components(n, 'Load', 'load', bus, ci_identifier=ci_identifier)].values.flatten()
         )
 
         CI_StorageCharge = (
             n.model.variables['Link-p'].sel(
-                Link=[i for i in n.links.index if ci_identifier in i and 'Charge' in i and bus in i]
+                Link=get_ci_components(n, 'Link', 'charge', bus, ci_identifier=ci_identifier)
             )
             .sum(dims='Link')
         )
 
         CI_StorageDischarge = (
             n.model.variables['Link-p'].sel(
-                Link=[i for i in n.links.index if ci_identifier in i and 'Discharge' in i and bus in i]
+                Link=get_ci_components(n, 'Link', 'discharge', bus, ci_identifier=ci_identifier)
             )
             .sum(dims='Link')
         )
 
         CI_GridExport = (
             n.model.variables['Link-p'].sel(
-                Link=[i for i in n.links.index if ci_identifier in i and 'Export' in i and bus in i]
+                Link=get_ci_components(n, 'Link', 'export', bus, ci_identifier=ci_identifier)
             )
             .sum(dims='Link')
         )
 
         CI_GridImport = (
             n.model.variables['Link-p'].sel(
-                Link=[i for i in n.links.index if ci_identifier in i and 'Import' in i and bus in i]
+                Link=get_ci_components(n, 'Link', 'import', bus, ci_identifier=ci_identifier)
             )
             .sum(dims='Link')
         )
@@ -382,7 +540,7 @@ def apply_cfe_constraint(
         CI_PPA_Fossil = (
 
         ((n.model.variables['Generator-p'].sel(
-            Generator=[i for i in n.generators.index if ci_identifier in i and 'PPA' in i and bus in i and 'Fossil' in i]
+            Generator=get_ci_components(n, 'Generator', 'ppa', bus, clean=False, ci_identifier=ci_identifier)
         )))
         .sum(dims='Generator')
         )
@@ -390,7 +548,7 @@ def apply_cfe_constraint(
         CI_PPA_Clean = (
     
         ((n.model.variables['Generator-p'].sel(
-            Generator=[i for i in n.generators.index if ci_identifier in i and 'PPA' in i and bus in i and 'Clean' in i]
+            Generator=get_ci_components(n, 'Generator', 'ppa', bus, clean=True, ci_identifier=ci_identifier)
         )))
         .sum(dims='Generator')
         )
@@ -406,7 +564,7 @@ def apply_cfe_constraint(
         # Constraint 2: CFE target - note the CI_PPA_Fossil is offset by the share of fossil production which must be exported (set by CFE score)
         # ---------------------------------------------------------------
         n.model.add_constraints(
-            ( CI_PPA_Clean - (CI_GridExport - (CI_PPA_Fossil * CFE_Score) ) + (CI_GridImport * list(GridCFE) ) ).sum() >= ( (CI_StorageCharge - CI_StorageDischarge) + CI_Demand ).sum() * CFE_Score,
+            ( ( CI_PPA_Clean - (CI_GridExport - (CI_PPA_Fossil * CFE_Score) ) + (CI_GridImport * GridCFE.loc[bus].values ) ) * weights ).sum() >= ( ( (CI_StorageCharge - CI_StorageDischarge) + CI_Demand ) * weights ).sum() * CFE_Score,
             name=f"cfe-constraint-target-{bus}",
  
         )
@@ -414,7 +572,7 @@ def apply_cfe_constraint(
         # Constraint 3: Excess
         # ---------------------------------------------------------------
         n.model.add_constraints(
-            CI_GridExport.sum() <= sum(CI_Demand) * max_excess_export,
+            (CI_GridExport * weights).sum() <= sum(CI_Demand * weights) * max_excess_export,
             name=f"cfe-constraint-excess-{bus}",
         )
 
@@ -432,4 +590,107 @@ def apply_cfe_constraint(
             name=f"cfe-constraint-fossil-excess-{bus}",
         )
     
-    return n
\ No newline at end of file
+    return n
+
+@trace.traced
+def update_grid_cfe(
+        n : pypsa.Network,
+        GridCFE : pd.DataFrame,
+        ci_buses : list,
+        ci_identifier : str,
+    ) -> pypsa.Network:
+    '''Update the grid import coefficients of the CFE target constraints in place
+
+    Equivalent to removing and re-applying the CFE constraints with a new GridCFE, but
+    only the `CI_GridImport * GridCFE` coefficients of `cfe-constraint-target-{bus}` change.
+    '''
+    weights = n.snapshot_weightings.generators.values
+    GridCFE = grid_cfe_matrix(GridCFE, ci_buses, n.snapshots)
+
+    for bus in ci_buses:
+        target = n.model.constraints[f"cfe-constraint-target-{bus}"]
+
+        import_labels = (
+            n.model.variables['Link-p'].labels.sel(
+                Link=get_ci_components(n, 'Link', 'import', bus, ci_identifier=ci_identifier)
+            )
+            .transpose('snapshot', 'Link')
+        )
+        grid_cfe = pd.Series(
+            np.broadcast_to((GridCFE.loc[bus].values * weights)[:, None], import_labels.shape).ravel(),
+            index=import_labels.values.ravel(),
+        )
+
+        term_vars = target.vars.values
+        is_import = np.isin(term_vars, grid_cfe.index)
+        coeffs = target.coeffs.values.copy()
+        coeffs[is_import] = grid_cfe.reindex(term_vars[is_import]).values
+        target.coeffs = target.coeffs.copy(data=coeffs)
+
+    return n
+
+
+@trace.traced
+def update_cfe_score(
+        n : pypsa.Network,
+        CFE_Score : float,
+        ci_buses : list,
+        ci_identifier : str,
+    ) -> pypsa.Network:
+    '''Update the coefficients and right-hand sides tied to the CFE score in place
+
+    The CFE score enters `cfe-constraint-target-{bus}` through the fossil PPA, storage and demand
+    terms, and `cfe-constraint-fossil-excess-{bus}` through the fossil PPA term. Everything else in
+    the model is independent of the score, so a model built for one score can be re-used for another.
+    '''
+    weights = n.snapshot_weightings.generators
+
+    for bus in ci_buses:
+        CI_Demand = (
+            n.loads_t.p_set[get_ci_components(n, 'Load', 'load', bus, ci_identifier=ci_identifier)].values.flatten()
+        )
+
+        fossil = n.model.variables['Generator-p'].labels.sel(
+            Generator=get_ci_components(n, 'Generator', 'ppa', bus, clean=False, ci_identifier=ci_identifier)
+        )
+        charge = n.model.variables['Link-p'].labels.sel(
+            Link=get_ci_components(n, 'Link', 'charge', bus, ci_identifier=ci_identifier)
+        )
+        discharge = n.model.variables['Link-p'].labels.sel(
+            Link=get_ci_components(n, 'Link', 'discharge', bus, ci_identifier=ci_identifier)
+        )
+
+        # snapshot weighting of every variable in the CFE target
+        term_weights = pd.concat([
+            _label_weights(fossil, weights), _label_weights(charge, weights), _label_weights(discharge, weights)
+        ])
+        fossil, charge, discharge = fossil.values, charge.values, discharge.values
+
+        # Constraint 2: CFE target, i.e.
+        #   ... + CFE_Score * sum(w * (CI_PPA_Fossil + CI_StorageDischarge - CI_StorageCharge)) >= CFE_Score * sum(w * CI_Demand)
+        target = n.model.constraints[f"cfe-constraint-target-{bus}"]
+        term_vars = target.vars.values
+        coeffs = target.coeffs.values.copy()
+        is_positive = np.isin(term_vars, fossil) | np.isin(term_vars, discharge)
+        is_charge = np.isin(term_vars, charge)
+        coeffs[is_positive] = CFE_Score * term_weights.reindex(term_vars[is_positive]).values
+        coeffs[is_charge] = -CFE_Score * term_weights.reindex(term_vars[is_charge]).values
+        target.coeffs = target.coeffs.copy(data=coeffs)
+        target.rhs = (CI_Demand * weights.values).sum() * CFE_Score
+
+        # Constraint 5: CI_GridExport - CFE_Score * CI_PPA_Fossil >= 0
+        fossil_excess = n.model.constraints[f"cfe-constraint-fossil-excess-{bus}"]
+        term_vars = fossil_excess.vars.values
+        coeffs = fossil_excess.coeffs.values.copy()
+        coeffs[np.isin(term_vars, fossil)] = -CFE_Score
+        fossil_excess.coeffs = fossil_excess.coeffs.copy(data=coeffs)
+
+    return n
+
+
+def _label_weights(labels, weights : pd.Series) -> pd.Series:
+    '''Returns the snapshot weighting of each variable label in `labels`, indexed by label
+    '''
+    labels = labels.transpose('snapshot', ...)
+    w = weights.reindex(labels.snapshot.values).values.reshape(-1, *[1] * (labels.ndim - 1))
+    return pd.Series(np.broadcast_to(w, labels.shape).ravel(), index=labels.values.ravel())
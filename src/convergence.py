@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+
+class GridCFEConvergence:
+    """
+    Convergence engine for the GridCFE fixed-point iteration in RunCFE.
+
+    Each full solve maps the GridCFE vector applied in the CFE target constraint (G) to the GridCFE
+    computed from the solved network, F(G). The iteration has converged once the residual
+    r = F(G) - G is small in every hour. Rather than always feeding F(G) straight back in (a plain
+    Picard iteration), the next GridCFE can be under-relaxed or extrapolated to reduce the number of
+    full solves.
+
+    Parameters:
+    -----------
+    method : str
+        How the next GridCFE is computed from the history of iterates:
+            - 'picard': G_next = F(G)
+            - 'relaxation': G_next = G + relaxation * r
+            - 'aitken': as 'relaxation', with the relaxation factor updated each iteration (Irons-Tuck)
+            - 'anderson': Anderson mixing over the last `anderson_depth` iterates
+    atol : float
+        Converged if the largest hourly residual is at most `atol`.
+    rtol : float
+        Converged if the largest hourly residual is at most `rtol` times the largest hourly GridCFE.
+    relaxation : float
+        Initial relaxation factor in (0, 1].
+    anderson_depth : int
+        Number of previous iterates used by Anderson mixing.
+    max_iterations : int
+        Maximum number of full solves per CFE score.
+    min_relaxation : float
+        Lower bound on the relaxation factor when damping oscillations.
+
+    Notes:
+    -----------
+    - Residuals are measured with the max-norm, so a decrease in some hours can no longer hide an
+      increase in others (as with the signed difference of sums).
+    - An oscillation is flagged when the residual norm grows while the residual changes sign in
+      most hours. Except for 'picard', the relaxation factor is then halved and the Anderson
+      history is restarted.
+    - The next GridCFE is clipped to [0, 1]. Hours without grid generation (a NaN GridCFE) count as 0.
+
+    """
+
+    def __init__(
+            self,
+            method: str = 'picard',
+            atol: float = 0.01,
+            rtol: float = 0.0,
+            relaxation: float = 1.0,
+            anderson_depth: int = 3,
+            max_iterations: int = 100,
+            min_relaxation: float = 0.1,
+        ):
+
+        self.methods = {
+            'picard': self._picard,
+            'relaxation': self._relaxation,
+            'aitken': self._aitken,
+            'anderson': self._anderson,
+        }
+        if method not in self.methods:
+            raise ValueError(f"Invalid convergence method: {method}. Must be one of {list(self.methods)}.")
+        if not 0 < relaxation <= 1:
+            raise ValueError("The relaxation factor must be in (0, 1].")
+
+        self.method = method
+        self.atol = atol
+        self.rtol = rtol
+        self.relaxation = relaxation
+        self.anderson_depth = anderson_depth
+        self.max_iterations = max_iterations
+        self.min_relaxation = min_relaxation
+
+        self.converged = False
+        self.history = []
+        self.records = []
+
+    def update(self, grid_cfe_in, grid_cfe_out) -> np.ndarray:
+        '''Record one fixed-point evaluation and return the GridCFE to apply in the next solve
+
+        Parameters:
+        -----------
+        grid_cfe_in : array-like
+            GridCFE that was applied in the CFE target constraint.
+        grid_cfe_out : array-like
+            GridCFE computed from the network solved with `grid_cfe_in`.
+        '''
+        # an hour without grid generation has no GridCFE (NaN), which the CFE target constraint treats as 0
+        g = np.nan_to_num(np.asarray(grid_cfe_in, dtype=float), nan=0.0)
+        f = np.nan_to_num(np.asarray(grid_cfe_out, dtype=float), nan=0.0)
+        r = f - g
+
+        max_residual = np.abs(r).max()
+        rel_residual = max_residual / max(np.abs(f).max(), 1e-12)
+        self.converged = bool(max_residual <= self.atol or rel_residual <= self.rtol)
+
+        oscillating = False
+        if self.history:
+            r_prev = self.history[-1][2]
+            sign_flips = np.mean(np.sign(r) * np.sign(r_prev) < 0)
+            oscillating = bool(max_residual > np.abs(r_prev).max() and sign_flips > 0.5)
+            if oscillating and self.method != 'picard':
+                self.relaxation = max(self.relaxation / 2, self.min_relaxation)
+                self.history = self.history[-1:]
+
+        self.history.append((g, f, r))
+        self.history = self.history[-(self.anderson_depth + 1):]
+
+        self.records.append({
+            'iteration': len(self.records) + 1,
+            'max_abs_residual': max_residual,
+            'rel_residual': rel_residual,
+            'sum_residual': r.sum(),
+            'relaxation': self.relaxation,
+            'oscillating': oscillating,
+            'converged': self.converged,
+        })
+
+        if self.converged:
+            return g
+
+        return np.clip(self.methods[self.method](), 0, 1)
+
+    @property
+    def residuals(self) -> pd.DataFrame:
+        '''Per-iteration residuals, one row per full solve
+        '''
+        return pd.DataFrame(self.records).assign(method=self.method).set_index('iteration')
+
+    def _picard(self) -> np.ndarray:
+        return self.history[-1][1]
+
+    def _relaxation(self) -> np.ndarray:
+        g, f, r = self.history[-1]
+        return g + self.relaxation * r
+
+    def _aitken(self) -> np.ndarray:
+        g, f, r = self.history[-1]
+        if len(self.history) > 1:
+            r_prev = self.history[-2][2]
+            dr = (r - r_prev).ravel()
+            if dr @ dr > 0:
+                self.relaxation = float(np.clip(
+                    -self.relaxation * (r_prev.ravel() @ dr) / (dr @ dr),
+                    self.min_relaxation,
+                    1.0,
+                ))
+                self.records[-1]['relaxation'] = self.relaxation
+        return g + self.relaxation * r
+
+    def _anderson(self) -> np.ndarray:
+        g, f, r = self.history[-1]
+        if len(self.history) < 2:
+            return g + self.relaxation * r
+
+        G = np.column_stack([h[0].ravel() for h in self.history])
+        F = np.column_stack([h[1].ravel() for h in self.history])
+        R = np.column_stack([h[2].ravel() for h in self.history])
+        dG, dF, dR = np.diff(G, axis=1), np.diff(F, axis=1), np.diff(R, axis=1)
+
+        gamma = np.linalg.lstsq(dR, r.ravel(), rcond=None)[0]
+        g_mixed = g.ravel() - dG @ gamma
+        f_mixed = f.ravel() - dF @ gamma
+        return ((1 - self.relaxation) * g_mixed + self.relaxation * f_mixed).reshape(g.shape)
@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pypsa
+
+from . import trace
+
+
+class BackgroundExporter:
+    """
+    Writes solved networks to netCDF on a background thread, so that the next scenario is built and
+    solved while the previous one is written.
+
+    The network is converted to an xarray dataset and copied on the calling thread, so it can be
+    modified (e.g. re-solved for the next CFE score) as soon as `export` returns. Only the encoding
+    and writing of the file happen in the background, one file at a time.
+
+    Parameters:
+    -----------
+    enable : bool
+        If False, `export` writes the file before returning, like `n.export_to_netcdf`.
+
+    Notes:
+    -----------
+    - netCDF/HDF5 is not thread-safe: call `flush` before any netCDF file is read (e.g. before
+      plot_results, or before the outputs of a scenario are copied into the solved network cache).
+    - Files are written to a temporary path and renamed once complete.
+
+    """
+
+    def __init__(self, enable: bool = True):
+        self.enable = enable
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='netcdf-export') if enable else None
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def export(self, n: pypsa.Network, path: str, callback=None) -> None:
+        '''Exports a network to a netCDF file, in the background if enabled
+
+        `callback()` is called once the file is written (on the background thread if enabled).
+        '''
+        if not self.enable:
+            with trace.stage('export_to_netcdf', file=os.path.basename(path)):
+                n.export_to_netcdf(path)
+            if callback is not None:
+                callback()
+            return
+
+        # snapshot the network: the dataset may share memory with the network's frames
+        with trace.stage('export_to_netcdf', file=os.path.basename(path)):
+            ds = n.export_to_netcdf(None).copy(deep=True)
+        self._pending.append((path, self._pool.submit(_write, ds, path, callback)))
+
+    def flush(self) -> None:
+        '''Waits until every pending export is written. Raises the error of the first failed export.
+        '''
+        pending, self._pending = self._pending, []
+        errors = []
+        for path, future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to export {path}: {e!r}")
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+
+def export_network(n: pypsa.Network, path: str, exporter: BackgroundExporter = None, callback=None) -> None:
+    '''Exports a network with an exporter, or synchronously without one, and calls `callback()` once
+    the file is written
+    '''
+    if exporter is None:
+        exporter = BackgroundExporter(enable=False)
+    exporter.export(n, path, callback=callback)
+
+
+def _write(ds, path: str, callback=None) -> None:
+    tmp = f'{path}.tmp-{os.getpid()}'
+    try:
+        with trace.stage('write_netcdf', file=os.path.basename(path)):
+            ds.to_netcdf(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if callback is not None:
+        callback()
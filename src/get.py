@@ -1,53 +1,55 @@
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import pypsa
 import pandas as pd
+import xarray as xr
+
+from . import cfe
+from .lazy import LazyNetwork
+from .metrics import cached_metric
 
+@cached_metric
 def get_cfe_score_ts(n, run, ci_identifier='C&I'):
     '''Calculate the CFE score and return it as a time series
     '''
-    GridCFE = GetGridCFE(n, ci_identifier=ci_identifier, run=run)
-    CI_Demand = n.loads_t.p.filter(regex=ci_identifier).sum(axis=1)
-    CI_PPA_Clean = n.generators_t.p.filter(regex=ci_identifier).sum(axis=1)
-    CI_PPA_Fossil = n.generators_t.p.filter(regex=ci_identifier).sum(axis=1)
-    CI_GridExport = n.links_t.p0.filter(regex='Exports').sum(axis=1)
-    CI_GridImport = n.links_t.p0.filter(regex='Imports').sum(axis=1)
-    CI_StorageDischarge = n.links_t.p0.filter(regex='Discharge').sum(axis=1)
-    CI_StorageCharge = n.links_t.p0.filter(regex='Charge').sum(axis=1)
-    return (( CI_PPA_Clean + CI_PPA_Fossil - CI_GridExport + (CI_GridImport * list(GridCFE) ) - CI_StorageCharge + CI_StorageDischarge ) / CI_Demand).to_frame(name='CFE Score')
+    GridCFE = cfe.GetGridCFE(n, run['nodes_with_ci_load'], ci_identifier)
+    CI_Demand = n.loads_t.p[cfe.get_ci_components(n, 'Load', 'load', ci_identifier=ci_identifier)].sum(axis=1)
+    CI_PPA_Clean = n.generators_t.p[cfe.get_ci_components(n, 'Generator', 'ppa', clean=True, ci_identifier=ci_identifier)].sum(axis=1)
+    CI_PPA_Fossil = n.generators_t.p[cfe.get_ci_components(n, 'Generator', 'ppa', clean=False, ci_identifier=ci_identifier)].sum(axis=1)
+    CI_GridExport = n.links_t.p0[cfe.get_ci_components(n, 'Link', 'export', ci_identifier=ci_identifier)].sum(axis=1)
+    # grid imports of each bus count with the CFE score of that bus's grid
+    CI_GridImportCFE = sum(
+        n.links_t.p0[cfe.get_ci_components(n, 'Link', 'import', bus, ci_identifier=ci_identifier)].sum(axis=1) * GridCFE.loc[bus].values
+        for bus in GridCFE.index
+    )
+    CI_StorageDischarge = n.links_t.p0[cfe.get_ci_components(n, 'Link', 'discharge', ci_identifier=ci_identifier)].sum(axis=1)
+    CI_StorageCharge = n.links_t.p0[cfe.get_ci_components(n, 'Link', 'charge', ci_identifier=ci_identifier)].sum(axis=1)
+    return (( CI_PPA_Clean + CI_PPA_Fossil - CI_GridExport + CI_GridImportCFE - CI_StorageCharge + CI_StorageDischarge ) / CI_Demand).to_frame(name='CFE Score')
 
 
+@cached_metric
 def get_ci_cost_summary(n : pypsa.Network) -> pd.DataFrame:
     '''Returns a summary of the costs for C&I generators, storage units and links
     '''
     ci_generator_costs = (
         n.generators.loc[
-            n.generators.index.str.contains('C&I')
+            cfe.get_ci_components(n, 'Generator')
         ]
         [['carrier','p_nom','p_nom_opt','capital_cost','marginal_cost', 'p_max_pu']]
         #.reset_index()
     )
 
-    ci_generator_p_max_pu = (
-        n.generators_t.p_max_pu.transpose().loc[
-            n.generators_t.p_max_pu.transpose().index.str.contains('C&I')
-        ]
-        .transpose()
-        # [['p_max_pu']]
-        #.reset_index()
+    ci_generator_costs['dispatch'] = n.generators_t.p[ ci_generator_costs.index ].sum()
+
+    # potential dispatch, from the time-varying p_max_pu where there is one and the static one otherwise
+    p_max_pu_t = n.generators_t.p_max_pu
+    time_varying = ci_generator_costs.index[ci_generator_costs.index.isin(p_max_pu_t.columns)]
+    potential_dispatch = ci_generator_costs['p_nom_opt'] * ci_generator_costs['p_max_pu'] * len(p_max_pu_t)
+    potential_dispatch.loc[time_varying] = (
+        p_max_pu_t[time_varying].mul(ci_generator_costs.loc[time_varying, 'p_nom_opt']).sum()
     )
 
-    ci_generator_costs['dispatch'] = n.generators_t.p[ ci_generator_costs.index ].sum()
-    # Calculate potential dispatch accounting for both time-varying and static p_max_pu
-    potential_dispatch = []
-    for gen_id in ci_generator_costs.index:
-        if gen_id in ci_generator_p_max_pu.columns:
-            # Time-varying p_max_pu
-            potential = (ci_generator_costs.loc[gen_id, 'p_nom_opt'] * ci_generator_p_max_pu[gen_id]).sum()
-        else:
-            # Static p_max_pu
-            potential = (ci_generator_costs.loc[gen_id, 'p_nom_opt'] * ci_generator_costs.loc[gen_id, 'p_max_pu'] * len(ci_generator_p_max_pu))
-        potential_dispatch.append(potential)
-    
     ci_generator_costs['potential_dispatch'] = potential_dispatch
     ci_generator_costs['curtailment'] = ci_generator_costs['potential_dispatch'] - ci_generator_costs['dispatch']
     ci_generator_costs['curtailment_perc'] = ci_generator_costs['curtailment']/ci_generator_costs['potential_dispatch']
@@ -55,7 +57,7 @@ def get_ci_cost_summary(n : pypsa.Network) -> pd.DataFrame:
     # storage
     ci_storage_costs = (
         n.storage_units.loc[
-            n.storage_units.index.str.contains('C&I')
+            cfe.get_ci_components(n, 'StorageUnit')
         ]
         [['carrier','p_nom','p_nom_opt','capital_cost','marginal_cost']]
         #.reset_index()
@@ -66,7 +68,7 @@ def get_ci_cost_summary(n : pypsa.Network) -> pd.DataFrame:
     # links
     ci_links_costs = (
         n.links.loc[
-            n.links.index.str.contains('C&I')
+            cfe.get_ci_components(n, 'Link')
         ]
         [['carrier','p_nom','p_nom_opt','capital_cost','marginal_cost']]
         #.reset_index()
@@ -84,23 +86,26 @@ def get_ci_cost_summary(n : pypsa.Network) -> pd.DataFrame:
     df.loc[:, 'opex'] = df['dispatch'] * df['marginal_cost']
 
     # marginal price of the brownfield bus
-    ci_brown_bus = n.buses[n.buses.index.str.contains('C&I')].index.str.split('C&I').str[0].str.strip()[0]
+    ci_brown_bus = cfe.get_ci_index(n).parent_bus.iloc[0]
 
     # calculate import costs
-    import_links_t = n.links_t.p0.filter(regex='C&I').filter(regex='Import').sum(axis=1)
+    import_links = cfe.get_ci_components(n, 'Link', 'import')
+    import_links_t = n.links_t.p0[import_links].sum(axis=1)
     import_link_p = n.buses_t.marginal_price[ci_brown_bus]
     import_cost = ( import_links_t * import_link_p ).sum() 
 
     # append to df
-    df.loc[ df.index.str.contains('Import'), 'import_cost' ] = import_cost
+    df.loc[ import_links, 'import_cost' ] = import_cost
 
-    # calculate export revenues
-    export_links_t = n.links_t.p0.filter(regex='C&I').filter(regex='Export').sum(axis=1)
-    export_link_p = n.buses_t.marginal_price.filter(regex='^(?!.*C&I)').mean(axis=1)
+    # calculate export revenues, at the mean marginal price of all buses that are not C&I buses
+    export_links = cfe.get_ci_components(n, 'Link', 'export')
+    export_links_t = n.links_t.p0[export_links].sum(axis=1)
+    marginal_price = n.buses_t.marginal_price
+    export_link_p = marginal_price.loc[:, ~marginal_price.columns.isin(cfe.get_ci_components(n, 'Bus'))].mean(axis=1)
     export_revenue = -( export_links_t * export_link_p ).sum().sum()
 
     # append to df
-    df.loc[ df.index.str.contains('Export'), 'export_revenue' ] = export_revenue
+    df.loc[ export_links, 'export_revenue' ] = export_revenue
 
     # fillna
     df.fillna(0, inplace=True)
@@ -110,92 +115,72 @@ def get_ci_cost_summary(n : pypsa.Network) -> pd.DataFrame:
     return df
 
 
-def GetGridCFE(
-    n: pypsa.Network,   
-    ci_identifier: str,
-    run: dict
-):
-    """
-
-    Calculate the CFE score of a grid, intra- and inter-regionally. Here, we follow the mathematical
-    expressions presented by Xu and Jenkins (2021): https://acee.princeton.edu/24-7/
-
-    Parameters:
-    -----------
-    network : pypsa.Network
-        The optimised network for which we are calculating the GridCFE.
-    bus : str
-        The country bus for which we are calculating the GridCFE.
-    ci_identifier : str
-        The unique identifer used to identify C&I assets.
-
-    Returns:
-    -----------
-    CFE Score: list
-        Hourly resolution CFE scores for each snapshot in the network.
-
-    Let:
-    -----------
-    R = Intra-regional grid
-    Z = Inter-regional grid
-
-    """
-
-    
-
-        # get global clean carriers
-    global_clean_carriers = [
-        i
-        for i in n.carriers.query(" co2_emissions <= 0").index.tolist()
-        if i in n.generators.carrier.tolist()
-    ]
-
-    for bus in run["nodes_with_ci_load"]:
-        # get clean generators in R
-        R_clean_generators = n.generators.loc[
-            # clean carriers
-            (n.generators.carrier.isin(global_clean_carriers))
-            &
-            #exclude assets not in R
-            (n.generators.index.str.contains(bus)) &
-            # exclude C&I assets
-            (~n.generators.index.str.contains(ci_identifier))
-        ].index
-
-        # get all generators
-        R_all_generators = n.generators.loc[
-            (~n.generators.index.str.contains(ci_identifier))
-            &
-            (n.generators.index.str.contains(bus)) 
-        ].index
-
-        # calculate CFE sceore
-        total_clean_generation = n.generators_t.p[R_clean_generators].sum(axis=1)
-        total_generation = n.generators_t.p[R_all_generators].sum(axis=1)
-
-    # return CFE score
-    return (total_clean_generation / total_generation).round(2).tolist()
-
-
-def load_from_dir(path) -> dict:
+def load_from_dir(path, lazy : bool = True, workers : int = 1, max_memory_gb : float = None) -> dict:
     '''Loads all networks in a directory into a dictionary
+
+    With lazy=True, networks are opened as lazy.LazyNetwork handles that only decode the tables a
+    metric accesses (and load in full for e.g. n.statistics). Otherwise, networks are loaded in full,
+    `workers` at a time in a process pool (netCDF/HDF5 reads are not thread-safe). With
+    max_memory_gb, networks are only started while the decoded size of the networks in flight stays
+    under the bound (a larger network is loaded alone).
     '''
+    files = list_networks(path)
+
+    if lazy:
+        return {k: LazyNetwork(f) for k, f in files.items()}
+    if workers <= 1:
+        return {k: pypsa.Network(f) for k, f in files.items()}
+
+    budget = max_memory_gb * 1e9 if max_memory_gb is not None else float('inf')
+    # start the largest networks first so that the smaller ones fill the remaining budget
+    queue = sorted(((decoded_size(f), k, f) for k, f in files.items()), reverse=True)
+    in_flight = {}
     networks = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers:
+                size, k, f = queue[0]
+                if in_flight and sum(loading for loading, _ in in_flight.values()) + size > budget:
+                    break
+                in_flight[pool.submit(pypsa.Network, f)] = (size, k)
+                queue.pop(0)
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, k = in_flight.pop(future)
+                networks[k] = future.result()
+
+    # same order as the sequential loader
+    return {k: networks[k] for k in files}
+
+
+def list_networks(path) -> dict:
+    '''Returns the solved networks in a directory, as a dictionary of scenario keys (e.g. n_bf or
+    n_hm_CFE100_2030) to file paths
+    '''
+    files = {}
     for f in os.listdir(path):
         if f.endswith('.nc'):
             if 'brownfield' in f:
-                networks['n_bf'] = pypsa.Network(f'{path}/{f}')
+                files['n_bf'] = f'{path}/{f}'
             elif 'annual_matching' in f:
                 name = f.split('_')[3].replace('.nc','')
                 cfe = f.split('_')[2]
-                networks[f'n_am_{cfe}_{name}'] = pypsa.Network(f'{path}/{f}')
+                files[f'n_am_{cfe}_{name}'] = f'{path}/{f}'
             elif 'hourly_matching' in f:
                 name = f.split('_')[3].replace('.nc','')
                 cfe = f.split('_')[2]
-                networks[f'n_hm_{cfe}_{name}'] = pypsa.Network(f'{path}/{f}')
-    return networks
+                files[f'n_hm_{cfe}_{name}'] = f'{path}/{f}'
+    return files
+
+
+def decoded_size(path) -> int:
+    '''Returns the size in bytes of the variables of a netCDF file once decoded, without reading them
+    '''
+    with xr.open_dataset(path) as ds:
+        return int(sum(v.nbytes for v in ds.variables.values()))
 
 
+@cached_metric
 def get_emissions(n: pypsa.Network) -> float:
     '''Returns emissions in tonnes CO2-eq
     '''
@@ -209,6 +194,7 @@ def get_emissions(n: pypsa.Network) -> float:
         .sum()
     )
 
+@cached_metric
 def get_ci_parent_emissions(n: pypsa.Network, nodes_with_ci_loads) -> float:
     '''Returns hourly emissions in tonnes CO2-eq for the C&I bus
     '''
@@ -227,39 +213,44 @@ def get_ci_parent_emissions(n: pypsa.Network, nodes_with_ci_loads) -> float:
     return emissions_intensity
 
 
+@cached_metric
 def get_unit_cost(n : pypsa.Network) -> pd.DataFrame:
     '''Returns the unit cost in $/MWh for each component and carrier
     '''
+    statistics = n.statistics()
     return (
         (
-            n.statistics()['Capital Expenditure'] 
-            + n.statistics()['Operational Expenditure']
+            statistics['Capital Expenditure'] 
+            + statistics['Operational Expenditure']
         )
-        .div(n.statistics()['Supply'])
+        .div(statistics['Supply'])
         .round(2)
         .reset_index()
         .rename(columns={'level_0' : 'component','level_1' : 'carrier', 0: 'System Cost [$/MWh]'})
     )
 
+@cached_metric
 def get_ci_generation(n : pypsa.Network) -> pd.DataFrame:
     '''Returns the generation in MWh for each CI bus
     '''
 
     # ci_buses = n.buses[n.buses.index.str.contains('C&I')].index.tolist()
-    ci_generation = n.generators_t.p.filter(regex='C&I').sum().sum()
+    ci_generation = n.generators_t.p[cfe.get_ci_components(n, 'Generator')].sum().sum()
     ci_generation_df = pd.DataFrame({
         'name': [n.name],
         'ci_generation': [ci_generation]
     })
     return ci_generation_df
 
+@cached_metric
 def get_total_ci_procurement_cost(n : pypsa.Network) -> pd.DataFrame:
     '''Returns the total annual system cost in M$ for each C&I procured component and carrier
     '''
+    statistics = n.statistics(groupby=["bus","carrier"])
     return (
         (
-            n.statistics(groupby=["bus","carrier"])['Capital Expenditure'].fillna(0) 
-            + n.statistics(groupby=["bus","carrier"])['Operational Expenditure'].fillna(0)
+            statistics['Capital Expenditure'].fillna(0) 
+            + statistics['Operational Expenditure'].fillna(0)
         )
         .div(1e6)
         .round(2)
@@ -270,13 +261,15 @@ def get_total_ci_procurement_cost(n : pypsa.Network) -> pd.DataFrame:
     )
 
 
+@cached_metric
 def get_total_annual_system_cost(n : pypsa.Network) -> pd.DataFrame:
     '''Returns the total annual system cost in M$ for each component and carrier
     '''
+    statistics = n.statistics()
     return (
         (
-            n.statistics()['Capital Expenditure'] 
-            + n.statistics()['Operational Expenditure']
+            statistics['Capital Expenditure'] 
+            + statistics['Operational Expenditure']
         )
         .div(1e6)
         .round(2)
@@ -285,30 +278,29 @@ def get_total_annual_system_cost(n : pypsa.Network) -> pd.DataFrame:
     )
 
 
+@cached_metric
 def get_ci_procurement(n, ci_identifier):
     '''Returns the fractional procurement of C&I assets
     '''
-    ci_load = n.loads_t.p.filter(regex=ci_identifier).sum().sum()
+    ci_load = n.loads_t.p[cfe.get_ci_components(n, 'Load', ci_identifier=ci_identifier)].sum().sum()
     return pd.DataFrame({
         # imports
         'Grid supply' : (
-            n.links_t.p0.filter(regex=ci_identifier).filter(regex='Import').sum().sum(),# / ci_load,
+            n.links_t.p0[cfe.get_ci_components(n, 'Link', 'import', ci_identifier=ci_identifier)].sum().sum(),# / ci_load,
         ),
         # exports
         'Excess' : (
-            n.links_t.p1.filter(regex=ci_identifier).filter(regex='Export').sum().sum(),# / ci_load,
+            n.links_t.p1[cfe.get_ci_components(n, 'Link', 'export', ci_identifier=ci_identifier)].sum().sum(),# / ci_load,
         ),
         # ppa
         'C&I PPA' : (
             n.generators_t.p[
-                n.generators.loc[
-                    n.generators.index.str.contains(ci_identifier),
-                    ].index
+                cfe.get_ci_components(n, 'Generator', ci_identifier=ci_identifier)
                 ]
             .sum(axis=1)
             .sum()
-            - n.links_t.p0.filter(regex=ci_identifier).filter(regex='Storage Charge').sum().sum()
-            + n.links_t.p0.filter(regex=ci_identifier).filter(regex='Storage Discharge').sum().sum()
+            - n.links_t.p0[cfe.get_ci_components(n, 'Link', 'charge', ci_identifier=ci_identifier)].sum().sum()
+            + n.links_t.p0[cfe.get_ci_components(n, 'Link', 'discharge', ci_identifier=ci_identifier)].sum().sum()
             #/ ci_load
         ),
     })
@@ -324,10 +316,11 @@ def split_scenario_col(df : pd.DataFrame, col_name: str):
     return df
 
 
+@cached_metric
 def get_ci_carriers(n: pypsa.Network) -> pd.DataFrame:
     '''Returns the C&I carriers
     '''
-    ci_carriers = list(n.generators[n.generators.index.str.contains('C&I')].carrier.unique()) + \
-              list(n.storage_units[n.storage_units.index.str.contains('C&I')].carrier.unique())
+    ci_carriers = list(n.generators.loc[cfe.get_ci_components(n, 'Generator')].carrier.unique()) + \
+              list(n.storage_units.loc[cfe.get_ci_components(n, 'StorageUnit')].carrier.unique())
 
     return (n.carriers.loc[ci_carriers, 'nice_name'])
\ No newline at end of file
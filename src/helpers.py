@@ -1,6 +1,11 @@
+import copy
 import os
 import yaml
-import pypsa
+
+from . import trace
+
+# static columns that are changed in place when a solved brownfield is re-used for RES100/CFE
+FORK_COPY_COLUMNS = ["p_nom", "p_nom_extendable", "e_nom", "e_nom_extendable", "s_nom", "s_nom_extendable"]
 
 
 def setup_dir(path_to_dir):
@@ -13,8 +18,7 @@ def setup_dir(path_to_dir):
     Returns:
     None
     """
-    if not os.path.exists(path_to_dir):
-        os.makedirs(path_to_dir)
+    os.makedirs(path_to_dir, exist_ok=True)
 
 
 def load_configs(path):
@@ -42,6 +46,21 @@ def load_configs(path):
     
     return configs
 
+def split_solver_threads(solver_options, workers):
+    """
+    Returns a copy of the solver options with the solver threads divided between parallel workers.
+
+    Parameters:
+    solver_options (dict): Solver options, e.g. configs["solver_options"]["gurobi-default"].
+    workers (int): Number of solves that will run at the same time.
+
+    Returns:
+    dict: The solver options with 'threads' set to at least 1.
+    """
+    threads = solver_options.get("threads", os.cpu_count() or 1)
+    return {**solver_options, "threads": max(1, int(threads) // workers)}
+
+@trace.traced
 def load_brownfield_network(run, configs):
     """
     Load a brownfield network from a specified path for use in the CFE run iterations
@@ -50,6 +69,8 @@ def load_brownfield_network(run, configs):
         b) avoiding re-solving the brownfield network in each iteration
     """
 
+    import pypsa
+
     brownfield_path = os.path.join(
         configs["paths"]["output_model_runs"],
         run["name"],
@@ -60,4 +81,48 @@ def load_brownfield_network(run, configs):
     brownfield_original = pypsa.Network()
     brownfield_original.import_from_netcdf(brownfield_path)
 
-    return brownfield_original
\ No newline at end of file
+    return brownfield_original
+
+def fork_network(n, copy_columns=FORK_COPY_COLUMNS):
+    """
+    Returns a cheap copy-on-write fork of a (solved) network, e.g. the brownfield network for the
+    RES100 and CFE runs.
+
+    Static tables and input time series are shallow copies that share their data with `n`. Only the
+    static columns in `copy_columns` and the optimisation outputs (p_nom_opt, p, marginal_price, ...),
+    which are written in place by PostProcessBrownfield and by the solve, are copied. The linopy
+    model of `n`, if any, is not carried over.
+
+    Shared time series are replaced rather than edited in place by this pipeline
+    (e.g. `n.loads_t.p_set[bus] = ...`); writing into them with `.loc` would also change `n`.
+
+    Parameters:
+    n (pypsa.Network): The network to fork.
+    copy_columns (list): Static columns to copy in addition to the optimisation outputs.
+
+    Returns:
+    pypsa.Network: The forked network.
+    """
+
+    from . import cfe
+
+    # deepcopy returns the objects in the memo instead of copying them
+    memo = {id(getattr(n, "model", None)): None}
+    for c in n.components.values():
+        outputs = c.attrs.index[c.attrs.status.str.startswith("Output")]
+
+        static = c.static.copy(deep=False)
+        for col in c.static.columns.intersection(outputs.union(copy_columns)):
+            static[col] = c.static[col].copy()
+        memo[id(c.static)] = static
+
+        memo[id(c.dynamic)] = type(c.dynamic)(
+            {k: v.copy(deep=k in outputs) for k, v in c.dynamic.items()}
+        )
+
+    forked = copy.deepcopy(n, memo)
+    if hasattr(forked, "model"):
+        del forked.model
+    # the caches are keyed on the tables of `n`, and rebuilt on the tables of the fork
+    cfe.clear_ci_cache(forked)
+    return forked
@@ -0,0 +1,180 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pypsa
+import xarray as xr
+
+# default attributes of every component, as in an empty network
+_TEMPLATE = pypsa.Network()
+_LIST_NAMES = {c.list_name: c.name for c in _TEMPLATE.components.values()}
+
+# components whose tables include the standard types or geometries, which are always loaded in full
+_EAGER = ['LineType', 'TransformerType', 'Shape']
+
+
+class LazyNetwork:
+    """
+    Read-only handle on a solved network stored as netCDF, which decodes variables on first access.
+
+    Opening the file only reads its metadata (xarray opens netCDF files lazily). Static tables
+    (`n.generators`, `n.static('Generator')`) and time series (`n.generators_t.p`, `n.loads_t.p_set`)
+    are then decoded one at a time when accessed, so a metric that needs a few tables of a large
+    model does not load the rest. Any other attribute (e.g. `n.statistics`, `n.copy()`) loads the
+    full pypsa.Network once and is served from it, as are all tables from then on.
+
+    Parameters:
+    -----------
+    path : str
+        Path to a network exported with `export_to_netcdf`.
+
+    Notes:
+    -----------
+    - Tables are decoded as pypsa does on import: missing standard attributes take their default
+      value and are cast to their type; custom columns are kept as stored.
+    - Networks with multiple investment periods are always loaded in full.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ds = xr.open_dataset(path)
+        self._network = None
+        self._tables = {}
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._network is not None else 'lazy'
+        return f"LazyNetwork({os.path.basename(self.path)!r}, {state})"
+
+    def __getattr__(self, name: str):
+        # only called for attributes that are not found on the handle itself; private attributes
+        # (e.g. the cached C&I index) are never looked up on the full network
+        if name.startswith('_') or name in ('ds', 'path'):
+            raise AttributeError(name)
+
+        if name in _LIST_NAMES:
+            return self.static(_LIST_NAMES[name])
+        if name.endswith('_t') and name[:-2] in _LIST_NAMES:
+            return self.dynamic(_LIST_NAMES[name[:-2]])
+
+        return getattr(self.network, name)
+
+    @property
+    def network(self) -> pypsa.Network:
+        '''The full network, loaded on first access
+        '''
+        if self._network is None:
+            self._network = pypsa.Network(self.path)
+            self._tables = {}
+            self.ds.close()
+        return self._network
+
+    @property
+    def loaded(self) -> bool:
+        return self._network is not None
+
+    @property
+    def _multi_invest(self) -> bool:
+        return bool(self.ds.attrs.get('network__multi_invest', 0))
+
+    @property
+    def name(self) -> str:
+        return self._network.name if self.loaded else self.ds.attrs.get('network_name', '')
+
+    @property
+    def meta(self) -> dict:
+        return self._network.meta if self.loaded else json.loads(self.ds.attrs.get('meta', '{}'))
+
+    @property
+    def snapshots(self) -> pd.Index:
+        if self.loaded or self._multi_invest:
+            return self.network.snapshots
+        # the snapshot labels are stored in a variable, the coordinate only numbers them
+        var = 'snapshots_snapshot' if 'snapshots_snapshot' in self.ds else 'snapshots'
+        return self._cached('snapshots', lambda: pd.Index(self.ds[var].values, name='snapshot'))
+
+    @property
+    def snapshot_weightings(self) -> pd.DataFrame:
+        if self.loaded or self._multi_invest:
+            return self.network.snapshot_weightings
+        return self._cached('snapshot_weightings', lambda: pd.DataFrame(
+            {k: self.ds[f'snapshots_{k}'].values for k in ['objective', 'generators', 'stores']},
+            index=self.snapshots,
+        ))
+
+    def static(self, c: str) -> pd.DataFrame:
+        '''Returns the static table of a component, decoding it on first access
+        '''
+        if self.loaded or c in _EAGER or self._multi_invest:
+            return self.network.static(c)
+        return self._cached(('static', c), lambda: self._decode_static(c))
+
+    def dynamic(self, c: str) -> dict:
+        '''Returns the time series of a component, decoding each one on first access
+        '''
+        if self.loaded or self._multi_invest:
+            return self.network.dynamic(c)
+        return _LazyDynamic(self, c)
+
+    def _cached(self, key, decode):
+        if key not in self._tables:
+            self._tables[key] = decode()
+        return self._tables[key]
+
+    def _decode_static(self, c: str) -> pd.DataFrame:
+        component = _TEMPLATE.components[c]
+        prefix = f'{component.list_name}_'
+        dim = f'{component.list_name}_i'
+        index = pd.Index(self.ds[dim].values if dim in self.ds.coords else [], name=c)
+
+        stored = {
+            v[len(prefix):]: self.ds[v].values
+            for v in self.ds.data_vars
+            if v.startswith(prefix) and self.ds[v].dims == (dim,)
+        }
+
+        attrs = component.attrs[component.attrs.static & (component.attrs.index != 'name')]
+        df = pd.DataFrame(index=index)
+        for attr, row in attrs.iterrows():
+            values = stored.pop(attr) if attr in stored else np.full(len(index), row.default, dtype=object)
+            df[attr] = pd.Series(values, index=index).astype(row.typ)
+        for attr, values in stored.items():
+            df[attr] = values
+        return df
+
+    def _decode_dynamic(self, c: str, attr: str) -> pd.DataFrame:
+        component = _TEMPLATE.components[c]
+        var = f'{component.list_name}_t_{attr}'
+        if var not in self.ds and attr not in component.attrs.index:
+            raise KeyError(f"{c} has no time series {attr}")
+        columns = pd.Index(
+            self.ds[f'{var}_i'].values if var in self.ds else [], name=c
+        )
+        values = self.ds[var].values if var in self.ds else np.empty((len(self.snapshots), 0))
+        df = pd.DataFrame(values, index=self.snapshots, columns=columns)
+
+        # as on import, series without a static counterpart (e.g. outputs) are defined for all components
+        attrs = component.attrs
+        if var in self.ds and attr in attrs.index and 'series' in attrs.at[attr, 'type'] and not attrs.at[attr, 'static']:
+            df = df.reindex(columns=df.columns.union(self.static(c).index), fill_value=attrs.at[attr, 'default'])
+        return df
+
+
+class _LazyDynamic:
+    '''The `n.{list_name}_t` namespace of a LazyNetwork, e.g. `n.generators_t.p` or `n.generators_t["p"]`
+    '''
+
+    def __init__(self, lazy: LazyNetwork, c: str):
+        self._lazy = lazy
+        self._c = c
+
+    def __getattr__(self, attr: str) -> pd.DataFrame:
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return self[attr]
+
+    def __getitem__(self, attr: str) -> pd.DataFrame:
+        if self._lazy.loaded:
+            return self._lazy.network.dynamic(self._c)[attr]
+        return self._lazy._cached(('dynamic', self._c, attr), lambda: self._lazy._decode_dynamic(self._c, attr))
@@ -0,0 +1,103 @@
+import functools
+from collections import Counter
+
+import pandas as pd
+
+
+class MetricsCache:
+    """
+    Wraps a solved network so that each statistic and metric is computed once.
+
+    `n.statistics(...)`, `n.statistics.<method>(...)` and the get.py metrics decorated with
+    `cached_metric` (e.g. get_ci_cost_summary) are memoized per network and per arguments. Every
+    other attribute is read from the wrapped network, so the wrapper can be passed to any function
+    that expects a network. Cached results are returned as copies, so callers may modify them.
+
+    Parameters:
+    -----------
+    n : pypsa.Network or lazy.LazyNetwork
+        The solved network. It must not be modified while wrapped.
+
+    Attributes:
+    -----------
+    hits, misses : collections.Counter
+        Number of cache hits and misses, by metric name.
+
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.hits = Counter()
+        self.misses = Counter()
+        self._results = {}
+
+    def __getattr__(self, name: str):
+        # private attributes (e.g. the cached C&I index) are kept on the wrapper
+        if name.startswith('_') or name == 'n':
+            raise AttributeError(name)
+        return getattr(self.n, name)
+
+    def __repr__(self) -> str:
+        return f"MetricsCache({self.n!r})"
+
+    @property
+    def statistics(self):
+        return _CachedStatistics(self)
+
+    def memoize(self, name: str, func, *args, **kwargs):
+        '''Returns func(*args, **kwargs), computed on the first call with the same name and arguments
+        '''
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+        if key in self._results:
+            self.hits[name] += 1
+        else:
+            self.misses[name] += 1
+            self._results[key] = func(*args, **kwargs)
+        result = self._results[key]
+        return result.copy() if isinstance(result, (pd.DataFrame, pd.Series)) else result
+
+
+class _CachedStatistics:
+    '''The `n.statistics` accessor of a MetricsCache, e.g. `n.statistics()` or `n.statistics.energy_balance()`
+    '''
+
+    def __init__(self, cache: MetricsCache):
+        self._cache = cache
+
+    def __call__(self, *args, **kwargs):
+        return self._cache.memoize('statistics', self._cache.n.statistics, *args, **kwargs)
+
+    def __getattr__(self, method: str):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        func = getattr(self._cache.n.statistics, method)
+        if not callable(func):
+            return func
+        return functools.partial(self._cache.memoize, f'statistics.{method}', func)
+
+
+def cached_metric(func):
+    '''Memoizes a metric of a network (its first argument) when the network is wrapped in a MetricsCache
+    '''
+    @functools.wraps(func)
+    def wrapper(n, *args, **kwargs):
+        if isinstance(n, MetricsCache):
+            return n.memoize(func.__name__, functools.partial(func, n), *args, **kwargs)
+        return func(n, *args, **kwargs)
+    return wrapper
+
+
+def summary(caches: dict) -> pd.DataFrame:
+    '''Returns the number of cache hits and misses of each metric, summed over a dictionary of MetricsCache
+    '''
+    hits, misses = Counter(), Counter()
+    for cache in caches.values():
+        hits.update(cache.hits)
+        misses.update(cache.misses)
+    return (
+        pd.DataFrame({'hits': pd.Series(hits, dtype=int), 'misses': pd.Series(misses, dtype=int)})
+        .fillna(0)
+        .astype(int)
+        .rename_axis('metric')
+        .sort_index()
+    )
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import matplotlib.font_manager as fm
 
+from . import aggregation
 from . import get as cget
 from . import plotting as cplt
 
@@ -19,6 +20,8 @@ def plot_cfe_hmap(n, n_reference, ymax, fields_to_plot, run, ci_identifier='C&I'
     work_sans_font_medium = fm.FontProperties(fname=work_sans_path_medium)
 
     cfe_t = cget.get_cfe_score_ts(n, run, ci_identifier,)
+    # expand aggregated snapshots back to hourly
+    cfe_t = aggregation.disaggregate(cfe_t, n)
     cfe_t.index = cfe_t.index #.tz_localize('UTC').tz_convert('Asia/Singapore')
     cfe_t['Hour'] = cfe_t.index.hour + 1
     cfe_t['Day'] = cfe_t.index.day
@@ -110,6 +113,8 @@ def plot_monthly_cfe_hmap(n, run, ci_identifier='C&I'):
     work_sans_font_medium = fm.FontProperties(fname=work_sans_path_medium)
 
     cfe_t = cget.get_cfe_score_ts(n, run, ci_identifier)
+    # expand aggregated snapshots back to hourly
+    cfe_t = aggregation.disaggregate(cfe_t, n)
     cfe_t.index = cfe_t.index 
     cfe_t['Hour'] = cfe_t.index.hour + 1
     cfe_t['Day'] = cfe_t.index.day
@@ -1,4 +1,7 @@
+import multiprocessing
 import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
@@ -8,11 +11,53 @@ import matplotlib.font_manager as fm
 
 from matplotlib.ticker import MaxNLocator
 
+from . import cache
 from . import plotting as cplt
 from . import get as cget
-
-def plot_results(path_to_run_dir: str, run: dict, nodes_with_ci_loads):
+from . import metrics
+from . import results
+from . import trace
+
+# outputs of each plot function, as glob patterns within the results directory (and its subdirectories)
+OUTPUTS = {
+    'plot_ci_portfolio_capacity': ['01_ci_capacity.*'],
+    'plot_ci_portfolio_procurement_cost': ['02_ci_total_cost.*'],
+    'plot_ci_and_parent_generation': ['03_ci_parent_generation.*'],
+    'plot_ci_and_parent_capacity': ['04_ci_parent_capacity.*'],
+    'plot_ci_energy_balance': ['05_ci_energy_balance.*'],
+    'plot_ci_unit_cost_of_electricity': ['06a_unit_cost.*', '06b_unit_cost.*'],
+    'plot_ci_unit_cost_of_electricity_alt': ['06c_unit_cost.*'],
+    'plot_relative_emissions_by_scenario': ['07_system_emissions_reduction.*'],
+    'plot_system_emission_rate_by_scenario': ['08_system_emissions.*'],
+    'plot_ci_emission_rate_by_scenario': ['09_ci_emissions_rate.*'],
+    'plot_total_system_costs_by_scenario': ['10_system_costs.*'],
+    'plot_system_generation_mix': ['11_system_generation.*'],
+    'plot_system_capacity_mix': ['12_system_capacity.*'],
+    'plot_system_unit_cost_by_scenario': ['unit_cost_by_scenario.*'],
+    'plot_system_costs_vs_benefits': ['13_system_costs_benefits.*', '13a_system_costs_benefits.*', '13b_system_costs_benefits_raw.*'],
+    'plot_ci_curtailment': ['14_ci_curtailment.*'],
+    'plot_cfe_score_heatmaps': ['hmap_score_*'],
+    'plot_monthly_cfe_score_heatmaps': ['monthly_hmap_score_*'],
+}
+
+
+def plot_results(
+        path_to_run_dir: str,
+        run: dict,
+        nodes_with_ci_loads,
+        workers: int = 1,
+        max_memory_gb: float = None,
+        force: bool = False,
+    ):
     '''Plot results for a given run
+
+    With workers > 1, the solved networks are loaded in full up front, `workers` at a time (see
+    get.load_from_dir), and the plots are rendered `workers` at a time (see render_figures);
+    otherwise the networks are loaded lazily as the plots need them.
+
+    Plots are only redrawn if the solved networks, their code or their arguments changed since they
+    were last drawn (see cache.ResultsManifest), or with force=True. Returns the names of the plots
+    that failed.
     '''
 
     # set tz plotting theme
@@ -23,104 +68,272 @@ def plot_results(path_to_run_dir: str, run: dict, nodes_with_ci_loads):
     if not os.path.exists(os.path.join(path_to_run_dir, 'results')):
         os.makedirs(os.path.join(path_to_run_dir, 'results'))
 
-    # load solved networks
-    solved_networks = (
-        cget.load_from_dir(
-            os.path.join(
-                path_to_run_dir, 'solved_networks'
-            )
-        )
-    )
-
-    # load list of C&I carriers to be plot
-    ci_carriers = cget.get_ci_carriers(solved_networks['n_bf'])
-
     # Add Work Sans font to matplotlib
     work_sans_path_light = './assets/WorkSans-Light.ttf'
     work_sans_path_medium = './assets/WorkSans-Medium.ttf'
     work_sans_font = fm.FontProperties(fname=work_sans_path_light)
     work_sans_font_medium = fm.FontProperties(fname=work_sans_path_medium)
     # plt.rcParams['font.family'] = work_sans_font.get_name()
-    
-    plot_ci_portfolio_capacity(solved_networks=solved_networks,
-                               path_to_run_dir=path_to_run_dir,
-                               work_sans_font=work_sans_font)
-    
-    plot_ci_portfolio_procurement_cost(solved_networks=solved_networks,
-                                       path_to_run_dir=path_to_run_dir,
-                                       work_sans_font=work_sans_font)
-    
-    plot_ci_and_parent_generation(solved_networks=solved_networks,
-                                  path_to_run_dir=path_to_run_dir,
-                                  nodes_with_ci_loads=nodes_with_ci_loads,
-                                  work_sans_font=work_sans_font)
-
-    plot_ci_and_parent_capacity(solved_networks=solved_networks,
-                                  path_to_run_dir=path_to_run_dir,
-                                  nodes_with_ci_loads=nodes_with_ci_loads,
-                                  work_sans_font=work_sans_font)
-    
-    plot_ci_energy_balance(solved_networks=solved_networks,
-                                       path_to_run_dir=path_to_run_dir,
-                                       work_sans_font=work_sans_font)
 
-    plot_ci_unit_cost_of_electricity(solved_networks=solved_networks,
-                                     path_to_run_dir=path_to_run_dir,
-                                     work_sans_font=work_sans_font)
-    
-    plot_ci_unit_cost_of_electricity_alt(solved_networks=solved_networks,
-                                        path_to_run_dir=path_to_run_dir,
-                                        import_tariff=83.56, # in USD/MWh
-                                        export_tariff=36.33, # in USD/MWh
-                                        work_sans_font=work_sans_font)
-
-    plot_relative_emissions_by_scenario(solved_networks=solved_networks,
-                                        path_to_run_dir=path_to_run_dir,
-                                        work_sans_font=work_sans_font)
-
-    plot_system_emission_rate_by_scenario(solved_networks=solved_networks,
-                                          path_to_run_dir=path_to_run_dir,
-                                          work_sans_font=work_sans_font)
-    
-    plot_ci_emission_rate_by_scenario(solved_networks=solved_networks,
-                                      path_to_run_dir=path_to_run_dir,
-                                      nodes_with_ci_loads=nodes_with_ci_loads,
-                                      run=run,
-                                      work_sans_font=work_sans_font)
-
-    plot_total_system_costs_by_scenario(solved_networks=solved_networks,
-                                        path_to_run_dir=path_to_run_dir,
-                                        work_sans_font=work_sans_font)
-
-    plot_system_generation_mix(solved_networks=solved_networks,
-                               path_to_run_dir=path_to_run_dir,
-                               work_sans_font=work_sans_font)
-    
-    plot_system_capacity_mix(solved_networks=solved_networks,
-                             path_to_run_dir=path_to_run_dir,
-                             work_sans_font=work_sans_font)
+    figures = [
+        (plot_ci_portfolio_capacity, dict(path_to_run_dir=path_to_run_dir,
+                                          work_sans_font=work_sans_font)),
 
-    # plot_system_unit_cost_by_scenario(solved_networks=solved_networks,
-    #                                   path_to_run_dir=path_to_run_dir,
-    #                                   work_sans_font=work_sans_font)
+        (plot_ci_portfolio_procurement_cost, dict(path_to_run_dir=path_to_run_dir,
+                                                  work_sans_font=work_sans_font)),
 
-    plot_system_costs_vs_benefits(solved_networks=solved_networks,
-                                                path_to_run_dir=path_to_run_dir,
-                                                work_sans_font=work_sans_font)
-    
-    plot_ci_curtailment(solved_networks=solved_networks,
-                        path_to_run_dir=path_to_run_dir,
-                        work_sans_font=work_sans_font)
+        (plot_ci_and_parent_generation, dict(path_to_run_dir=path_to_run_dir,
+                                             nodes_with_ci_loads=nodes_with_ci_loads,
+                                             work_sans_font=work_sans_font)),
+
+        (plot_ci_and_parent_capacity, dict(path_to_run_dir=path_to_run_dir,
+                                           nodes_with_ci_loads=nodes_with_ci_loads,
+                                           work_sans_font=work_sans_font)),
 
-    plot_cfe_score_heatmaps(solved_networks=solved_networks,
-                            path_to_run_dir=path_to_run_dir,
+        (plot_ci_energy_balance, dict(path_to_run_dir=path_to_run_dir,
+                                      work_sans_font=work_sans_font)),
+
+        (plot_ci_unit_cost_of_electricity, dict(path_to_run_dir=path_to_run_dir,
+                                                work_sans_font=work_sans_font)),
+
+        (plot_ci_unit_cost_of_electricity_alt, dict(path_to_run_dir=path_to_run_dir,
+                                                    import_tariff=83.56, # in USD/MWh
+                                                    export_tariff=36.33, # in USD/MWh
+                                                    work_sans_font=work_sans_font)),
+
+        (plot_relative_emissions_by_scenario, dict(path_to_run_dir=path_to_run_dir,
+                                                   work_sans_font=work_sans_font)),
+
+        (plot_system_emission_rate_by_scenario, dict(path_to_run_dir=path_to_run_dir,
+                                                     work_sans_font=work_sans_font)),
+
+        (plot_ci_emission_rate_by_scenario, dict(path_to_run_dir=path_to_run_dir,
+                                                 nodes_with_ci_loads=nodes_with_ci_loads,
+                                                 run=run,
+                                                 work_sans_font=work_sans_font)),
+
+        (plot_total_system_costs_by_scenario, dict(path_to_run_dir=path_to_run_dir,
+                                                   work_sans_font=work_sans_font)),
+
+        (plot_system_generation_mix, dict(path_to_run_dir=path_to_run_dir,
+                                          work_sans_font=work_sans_font)),
+
+        (plot_system_capacity_mix, dict(path_to_run_dir=path_to_run_dir,
+                                        work_sans_font=work_sans_font)),
+
+        # (plot_system_unit_cost_by_scenario, dict(path_to_run_dir=path_to_run_dir,
+        #                                          work_sans_font=work_sans_font)),
+
+        (plot_system_costs_vs_benefits, dict(path_to_run_dir=path_to_run_dir,
+                                             work_sans_font=work_sans_font)),
+
+        (plot_ci_curtailment, dict(path_to_run_dir=path_to_run_dir,
+                                   work_sans_font=work_sans_font)),
+
+        (plot_cfe_score_heatmaps, dict(path_to_run_dir=path_to_run_dir,
+                                       run=run,
+                                       work_sans_font_medium=work_sans_font_medium)),
+
+        (plot_monthly_cfe_score_heatmaps, dict(path_to_run_dir=path_to_run_dir,
+                                               run=run,
+                                               work_sans_font_medium=work_sans_font_medium)),
+    ]
+
+    # only redraw the plots whose inputs changed since they were last drawn
+    path_to_networks = os.path.join(path_to_run_dir, 'solved_networks')
+    manifest = cache.ResultsManifest(
+        os.path.join(path_to_run_dir, 'results'),
+        list(cget.list_networks(path_to_networks).values()),
+    )
+    if not force:
+        figures = [(func, kwargs) for func, kwargs in figures if not manifest.is_current(func, kwargs)]
+        if not figures:
+            print(f"All plots of {run['name']} are up to date")
+            return []
+
+    # record the time and memory of loading, metrics and each plot
+    with trace.for_run(path_to_run_dir, run=run['name']):
+        # load solved networks
+        with trace.stage('load_networks'):
+            solved_networks = (
+                cget.load_from_dir(
+                    path_to_networks,
+                    lazy=workers <= 1,
+                    workers=workers,
+                    max_memory_gb=max_memory_gb,
+                )
+            )
+
+        # compute each statistic and metric once per network, across all plots
+        solved_networks = {k: metrics.MetricsCache(n) for k, n in solved_networks.items()}
+
+        # compute the metrics of the plots once, before they are rendered in forked workers that
+        # would otherwise each compute them; plotted sequentially, the plots fill the cache
+        # themselves, and lazy networks are only loaded in full by the plots that need it
+        if workers > 1:
+            compute_metrics(solved_networks=solved_networks,
                             run=run,
-                            work_sans_font_medium=work_sans_font_medium)
-    
-    plot_monthly_cfe_score_heatmaps(solved_networks=solved_networks,
-                                    path_to_run_dir=path_to_run_dir,
-                                    run=run,
-                                    work_sans_font_medium=work_sans_font_medium)
+                            nodes_with_ci_loads=nodes_with_ci_loads,
+                            figures=figures)
+
+        failures = render_figures(figures, solved_networks, workers=workers)
+
+    for func, kwargs in figures:
+        if func.__name__ in failures:
+            manifest.discard(func)
+        else:
+            manifest.record(func, kwargs, OUTPUTS[func.__name__])
+    manifest.save()
+
+    print('Metrics cache hits and misses:')
+    print(metrics.summary(solved_networks).to_string())
+
+    if failures:
+        print(f"Failed to create {len(failures)} of {len(figures)} plots: {', '.join(failures)}")
+    return failures
+
+
+# statistics and metrics computed by compute_metrics, as calls matching those of the plot functions
+METRICS = {
+    'statistics': lambda n, run, nodes_with_ci_loads: n.statistics(),
+    'statistics_by_bus': lambda n, run, nodes_with_ci_loads: n.statistics(groupby=['bus', 'carrier']),
+    'expanded_capacity': lambda n, run, nodes_with_ci_loads: n.statistics.expanded_capacity(),
+    'energy_balance': lambda n, run, nodes_with_ci_loads: n.statistics.energy_balance(),
+    'emissions': lambda n, run, nodes_with_ci_loads: cget.get_emissions(n),
+    'ci_parent_emissions': lambda n, run, nodes_with_ci_loads: cget.get_ci_parent_emissions(n, nodes_with_ci_loads),
+    'ci_cost_summary': lambda n, run, nodes_with_ci_loads: cget.get_ci_cost_summary(n),
+    'ci_procurement': lambda n, run, nodes_with_ci_loads: cget.get_ci_procurement(n, 'C&I'),
+    'total_ci_procurement_cost': lambda n, run, nodes_with_ci_loads: cget.get_total_ci_procurement_cost(n),
+    'total_annual_system_cost': lambda n, run, nodes_with_ci_loads: cget.get_total_annual_system_cost(n),
+    'cfe_score_ts': lambda n, run, nodes_with_ci_loads: cget.get_cfe_score_ts(n, run, 'C&I'),
+}
+
+# metrics read by each plot function (see METRICS)
+FIGURE_METRICS = {
+    'plot_ci_portfolio_capacity': ['expanded_capacity'],
+    'plot_ci_portfolio_procurement_cost': ['statistics_by_bus', 'total_ci_procurement_cost'],
+    'plot_ci_and_parent_generation': ['statistics_by_bus'],
+    'plot_ci_and_parent_capacity': ['statistics_by_bus'],
+    'plot_ci_energy_balance': ['ci_procurement'],
+    'plot_ci_unit_cost_of_electricity': ['ci_cost_summary'],
+    'plot_ci_unit_cost_of_electricity_alt': ['ci_cost_summary'],
+    'plot_relative_emissions_by_scenario': ['emissions'],
+    'plot_system_emission_rate_by_scenario': ['emissions', 'energy_balance'],
+    'plot_ci_emission_rate_by_scenario': ['ci_parent_emissions'],
+    'plot_total_system_costs_by_scenario': ['statistics', 'total_annual_system_cost'],
+    'plot_system_generation_mix': ['statistics'],
+    'plot_system_capacity_mix': ['statistics'],
+    'plot_system_unit_cost_by_scenario': ['statistics'],
+    'plot_system_costs_vs_benefits': ['statistics'],
+    'plot_ci_curtailment': ['ci_cost_summary'],
+    'plot_cfe_score_heatmaps': ['statistics_by_bus', 'total_ci_procurement_cost', 'cfe_score_ts'],
+    'plot_monthly_cfe_score_heatmaps': ['cfe_score_ts'],
+}
+
+
+@trace.traced
+def compute_metrics(solved_networks, run, nodes_with_ci_loads, figures: list = None) -> None:
+    '''Computes the statistics and metrics used by the given plots (all of them by default), so that
+    the figures only read them from the metrics cache (see metrics.MetricsCache)
+
+    Only the metrics of the given figures are computed (see FIGURE_METRICS): the statistics need the
+    full network, so computing them for figures that do not need them would load lazy networks in
+    full. A metric that fails is reported and skipped here; the plots that need it fail, and are
+    reported, on their own.
+    '''
+    names = FIGURE_METRICS.keys() if figures is None else [func.__name__ for func, _ in figures]
+    needed = {metric for name in names for metric in FIGURE_METRICS[name]}
+    for name, n in solved_networks.items():
+        for metric, compute in METRICS.items():
+            if metric not in needed:
+                continue
+            try:
+                compute(n, run, nodes_with_ci_loads)
+            except Exception:
+                print(f'Failed to compute {metric} of {name}:\n{traceback.format_exc()}')
+
+
+# figures (and their networks) being rendered by render_figures, inherited by forked workers
+_RENDERING = {}
+
+
+def render_figures(figures: list, solved_networks: dict, workers: int = 1) -> list:
+    '''Renders plots given as (plot function, keyword arguments) tuples, and returns the names of
+    those that failed
+
+    A plot that raises is reported and skipped; the others are still rendered. With workers > 1,
+    plots are rendered with the Agg backend in forked worker processes, which inherit the networks
+    and their metrics cache instead of pickling them.
+    '''
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print("Parallel plotting needs the fork start method, plotting sequentially")
+        workers = 1
+
+    _RENDERING.update(figures=figures, solved_networks=solved_networks)
+    try:
+        if workers <= 1:
+            errors = [_render_figure(i)[0] for i in range(len(figures))]
+        else:
+            errors = [None] * len(figures)
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(figures)),
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=plt.switch_backend,
+                initargs=('Agg',),
+            ) as pool:
+                futures = {pool.submit(_render_figure, i): i for i in range(len(figures))}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        errors[i], counts = future.result()
+                    except Exception as e:
+                        # e.g. the worker process was killed
+                        errors[i] = repr(e)
+                        print(f'Failed to create {figures[i][0].__name__}: {e!r}')
+                        continue
+                    # add the cache hits and misses of the worker to those of this process
+                    for k, (hits, misses) in counts.items():
+                        solved_networks[k].hits.update(hits)
+                        solved_networks[k].misses.update(misses)
+    finally:
+        _RENDERING.clear()
+
+    return [func.__name__ for (func, _), error in zip(figures, errors) if error is not None]
+
+
+def _render_figure(i: int) -> tuple:
+    '''Renders the i-th figure of render_figures, and returns its error (or None) and the metrics
+    cache hits and misses it caused
+    '''
+    func, kwargs = _RENDERING['figures'][i]
+    solved_networks = _RENDERING['solved_networks']
+    before = {k: (n.hits.copy(), n.misses.copy()) for k, n in solved_networks.items()}
+
+    error = None
+    try:
+        with trace.stage(func.__name__):
+            func(solved_networks=solved_networks, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        print(f'Failed to create {func.__name__}:\n{error}')
+    finally:
+        plt.close('all')
+
+    counts = {
+        k: (n.hits - before[k][0], n.misses - before[k][1]) for k, n in solved_networks.items()
+    }
+    return error, counts
+
+def read_scenarios(path_to_run_dir: str, table: str, scenarios: list, **kwargs) -> list:
+    '''Reads a results table back from the results store (see results.read), as one frame per
+    scenario of `scenarios` (e.g. ['Reference', '100% RES']) followed by one frame of the CFE scores
+
+    Columns without any value in a frame are dropped, as they are when the plots build their frames.
+    '''
+    table = results.read(path_to_run_dir, table, **kwargs)
+    frames = [table.loc[table.index == scenario] for scenario in scenarios]
+    frames.append(table.loc[~table.index.isin(scenarios)])
+    return [frame.dropna(axis=1, how='all') for frame in frames]
 
 
 def aggregate_capacity(
@@ -206,12 +419,12 @@ def plot_ci_portfolio_capacity(solved_networks, path_to_run_dir, work_sans_font)
     )
     
     # save df
-    (pd.concat([res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/01_ci_capacity.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([res, cfe], axis=0),
+        path_to_run_dir,
+        '01_ci_capacity',
     )
+    res, cfe = read_scenarios(path_to_run_dir, '01_ci_capacity', ['100% RES'])
 
     colors = cplt.tech_color_palette()
 
@@ -318,12 +531,12 @@ def plot_ci_and_parent_generation(solved_networks, path_to_run_dir, nodes_with_c
     )
 
     # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/03_ci_parent_generation.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '03_ci_parent_generation',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '03_ci_parent_generation', ['Reference', '100% RES'])
 
     fig, ax0, ax1, ax2 = cplt.bar_plot_3row(width_ratios=[1, 1, 10], figsize=(6, 4))
     colors = cplt.tech_color_palette()
@@ -434,12 +647,12 @@ def plot_ci_and_parent_capacity(solved_networks, path_to_run_dir, nodes_with_ci_
     )
 
     # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/04_ci_parent_capacity.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '04_ci_parent_capacity',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '04_ci_parent_capacity', ['Reference', '100% RES'])
 
     fig, ax0, ax1, ax2 = cplt.bar_plot_3row(width_ratios=[1, 1, 10], figsize=(6, 4))
     colors = cplt.tech_color_palette()
@@ -540,12 +753,12 @@ def plot_ci_portfolio_procurement_cost(solved_networks, path_to_run_dir, work_sa
     )
 
     # save df
-    (pd.concat([res_ci_costs, cfe_ci_costs], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/02_ci_total_cost.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([res_ci_costs, cfe_ci_costs], axis=0),
+        path_to_run_dir,
+        '02_ci_total_cost',
     )
+    res_ci_costs, cfe_ci_costs = read_scenarios(path_to_run_dir, '02_ci_total_cost', ['100% RES'])
 
     colors = cplt.tech_color_palette()
 
@@ -634,12 +847,13 @@ def plot_relative_emissions_by_scenario(solved_networks, path_to_run_dir, work_s
     )
 
     # save df
-    (pd.concat([res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/07_system_emissions_reduction.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([res, cfe], axis=0),
+        path_to_run_dir,
+        '07_system_emissions_reduction',
     )
+    res, cfe = read_scenarios(path_to_run_dir, '07_system_emissions_reduction', ['100% RES'], columns='metric')
+    res, cfe = res.rename_axis('Scenario').reset_index(), cfe.rename_axis('CFE Score').reset_index()
 
     res.plot(kind='scatter', x='Scenario', y='relative_emission', ax=ax0, s=50)
     cfe.plot(kind='scatter', x='CFE Score', y='relative_emission', ax=ax1, s=50)
@@ -719,12 +933,14 @@ def plot_system_emission_rate_by_scenario(solved_networks, path_to_run_dir, work
     )
 
     # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/08_system_emissions.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '08_system_emissions',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '08_system_emissions', ['Reference', '100% RES'], columns='metric')
+    ref, res = ref.rename_axis('Scenario').reset_index(), res.rename_axis('Scenario').reset_index()
+    cfe = cfe.rename_axis('CFE Score').reset_index()
 
     ref.plot(kind='bar', x='Scenario', y='emission_rate', ax=ax0, legend=False)
     res.plot(kind='bar', x='Scenario', y='emission_rate', ax=ax1, legend=False)
@@ -811,12 +1027,13 @@ def plot_ci_emission_rate_by_scenario(solved_networks, path_to_run_dir, nodes_wi
     )
 
     # save df
-    (pd.concat([res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/09_ci_emissions_rate.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([res, cfe], axis=0),
+        path_to_run_dir,
+        '09_ci_emissions_rate',
     )
+    res, cfe = read_scenarios(path_to_run_dir, '09_ci_emissions_rate', ['100% RES'], columns='metric')
+    res, cfe = res.rename_axis('Scenario').reset_index(), cfe.rename_axis('CFE Score').reset_index()
 
     res.plot(kind='bar', x='Scenario', y='emission_rate', ax=ax0, legend=False)
     cfe.plot(kind='bar', x='CFE Score', y='emission_rate', ax=ax1, legend=False)
@@ -902,12 +1119,12 @@ def plot_total_system_costs_by_scenario(solved_networks, path_to_run_dir, work_s
     )
 
         # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/10_system_costs.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '10_system_costs',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '10_system_costs', ['Reference', '100% RES'])
 
     # ---
     # plot
@@ -1014,12 +1231,12 @@ def plot_system_generation_mix(solved_networks, path_to_run_dir, work_sans_font)
     )
 
     # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/11_system_generation.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '11_system_generation',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '11_system_generation', ['Reference', '100% RES'])
 
     # ---
     # plot
@@ -1126,12 +1343,12 @@ def plot_system_capacity_mix(solved_networks, path_to_run_dir, work_sans_font):
     )
 
     # save df
-    (pd.concat([ref, res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/12_system_capacity.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([ref, res, cfe], axis=0),
+        path_to_run_dir,
+        '12_system_capacity',
     )
+    ref, res, cfe = read_scenarios(path_to_run_dir, '12_system_capacity', ['Reference', '100% RES'])
 
     # ---
     # plot
@@ -1228,12 +1445,12 @@ def plot_ci_energy_balance(solved_networks, path_to_run_dir, work_sans_font):
     )
 
     # save df
-    (pd.concat([res, cfe], axis=0)).to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/05_ci_energy_balance.csv'
-        ),
-        index=True
+    results.save(
+        pd.concat([res, cfe], axis=0),
+        path_to_run_dir,
+        '05_ci_energy_balance',
     )
+    res, cfe = read_scenarios(path_to_run_dir, '05_ci_energy_balance', ['100% RES'])
 
     # also save for later use
     energy_balance_df = pd.DataFrame(pd.concat([res, cfe], axis=0))
@@ -1394,7 +1611,8 @@ def plot_ci_unit_cost_of_electricity(solved_networks, path_to_run_dir, work_sans
     )
 
     # save df
-    (pd.concat([res_unit_cost, cfe_unit_cost], axis=0)).to_csv(os.path.join(path_to_run_dir, 'results/06a_unit_cost.csv'), index=True)
+    results.save(pd.concat([res_unit_cost, cfe_unit_cost], axis=0), path_to_run_dir, '06a_unit_cost')
+    res_unit_cost, cfe_unit_cost = read_scenarios(path_to_run_dir, '06a_unit_cost', ['100% RES'])
 
     colors = cplt.tech_color_palette()
     res_unit_cost.drop(columns=['Net Cost'], errors='ignore').plot(
@@ -1493,7 +1711,8 @@ def plot_ci_unit_cost_of_electricity(solved_networks, path_to_run_dir, work_sans
     )
 
     # save df
-    (pd.concat([res_unit_cost, cfe_unit_cost], axis=0)).to_csv(os.path.join(path_to_run_dir, 'results/06b_unit_cost.csv'), index=True)
+    results.save(pd.concat([res_unit_cost, cfe_unit_cost], axis=0), path_to_run_dir, '06b_unit_cost')
+    res_unit_cost, cfe_unit_cost = read_scenarios(path_to_run_dir, '06b_unit_cost', ['100% RES'])
 
     colors = cplt.tech_color_palette()
     res_unit_cost.drop(columns=['Net Cost'], errors='ignore').plot(
@@ -1681,7 +1900,8 @@ def plot_ci_unit_cost_of_electricity_alt(solved_networks,
     )
 
     # save df
-    (pd.concat([res_unit_cost, cfe_unit_cost], axis=0)).round(2).to_csv(os.path.join(path_to_run_dir, 'results/06c_unit_cost.csv'), index=True)
+    results.save(pd.concat([res_unit_cost, cfe_unit_cost], axis=0).round(2), path_to_run_dir, '06c_unit_cost')
+    res_unit_cost, cfe_unit_cost = read_scenarios(path_to_run_dir, '06c_unit_cost', ['100% RES'])
 
     fig, ax0, ax1 = cplt.bar_plot_2row(figsize=(6,4), width_ratios=[1,10])
     colors = cplt.tech_color_palette()
@@ -1814,7 +2034,8 @@ def plot_system_costs_vs_benefits(solved_networks, path_to_run_dir, work_sans_fo
         )
     )
     # save df
-    cost_delta.round(1).to_csv(os.path.join(path_to_run_dir, 'results/13b_system_costs_benefits_raw.csv'), index=True)
+    results.save(cost_delta.round(1), path_to_run_dir, '13b_system_costs_benefits_raw')
+    cost_delta = results.read(path_to_run_dir, '13b_system_costs_benefits_raw', columns=['carrier', 'metric'])
 
     # Sum together columns with the same name under the 'variable' column index
     cost_delta = cost_delta.groupby(level=1, axis=1).sum()
@@ -1834,7 +2055,7 @@ def plot_system_costs_vs_benefits(solved_networks, path_to_run_dir, work_sans_fo
 
     # plot cfe
     cfe = cost_delta.loc[cost_delta.index != '100% RES'].drop(columns=['Net Cost'], errors='ignore').div(1e9).copy()
-    cfe.index = [int(i.replace('CFE-', '')) for i in cfe.index]
+    cfe.index = [int(i) for i in cfe.index]
     cfe.sort_index(inplace=True)
     cfe.plot(kind='bar', stacked=True, ax=ax1, legend=True)
     # add net cost marker
@@ -1849,7 +2070,7 @@ def plot_system_costs_vs_benefits(solved_networks, path_to_run_dir, work_sans_fo
 
     # save df
     combined_df = pd.concat([res, cfe], axis=0).assign(**{'Net Cost': lambda df: df.sum(axis=1)}).round(2)
-    combined_df.to_csv(os.path.join(path_to_run_dir, 'results/13a_system_costs_benefits.csv'), index=True)
+    results.save(combined_df, path_to_run_dir, '13a_system_costs_benefits')
 
     # formatting
     for ax in [ax0, ax1]:
@@ -2016,28 +2237,15 @@ def plot_ci_curtailment(solved_networks, path_to_run_dir, work_sans_font):
         .loc[:, ['Scenario', 'CFE Score', 'carrier', 'dispatch', 'potential_dispatch', 'curtailment_perc']]
     )
 
-    curtailment_summary.to_csv(
-        os.path.join(
-            path_to_run_dir, 'results/14_ci_curtailment.csv'
-        ),
-        index=False
+    results.save(
+        curtailment_summary,
+        path_to_run_dir,
+        '14_ci_curtailment',
+        index=False,
     )
 
-    curtailment_summary = curtailment_summary.loc[:, ['Scenario', 'CFE Score', 'carrier', 'curtailment_perc']]
-
-    res = (
-        curtailment_summary
-        .loc[curtailment_summary['Scenario'] == '100% RES']
-        .pivot_table(columns='carrier', index='Scenario', values='curtailment_perc')
-        .multiply(100)
-    )
-
-    cfe = (
-        curtailment_summary
-        .loc[curtailment_summary['Scenario'].str.contains('CFE')]
-        .pivot_table(columns='carrier', index='CFE Score', values='curtailment_perc')
-        .multiply(100)
-    )
+    res, _, cfe = read_scenarios(path_to_run_dir, '14_ci_curtailment', ['100% RES', 'Reference'], metric='curtailment_perc')
+    res, cfe = res.sort_index(axis=1).multiply(100), cfe.sort_index(axis=1).multiply(100)
 
     res.plot(kind='bar', ax=ax0, legend=True, color=[colors.get(x, '#333333') for x in res.columns])
     cfe.plot(kind='bar', ax=ax1, legend=True, color=[colors.get(x, '#333333') for x in cfe.columns])
@@ -2098,8 +2306,9 @@ def plot_cfe_score_heatmaps(solved_networks, path_to_run_dir, run, work_sans_fon
     ymax = cget.get_total_ci_procurement_cost(solved_networks['n_hm_CFE100_2030']).query("carrier.isin(@ci_carriers)")['annual_system_cost [M$]'].sum() / 1e3
     for k in solved_networks.keys():
         # get networks
-        n_reference = solved_networks['n_bf'].copy()
-        n = solved_networks[k].copy()
+        # the plots only read the networks, so the cached metrics can be shared
+        n_reference = solved_networks['n_bf']
+        n = solved_networks[k]
         # init fig
         fig, ax0, ax1 = cplt.plot_cfe_hmap(n, n_reference, ymax=ymax, fields_to_plot=ci_carriers, run=run, ci_identifier='C&I')
 
@@ -2133,7 +2342,7 @@ def plot_monthly_cfe_score_heatmaps(solved_networks, path_to_run_dir, run, work_
     # MONTHLY HEATMAP OF CFE SCORE
     print('Creating monthly heatmap of CFE score')
     for k in solved_networks.keys():
-        n = solved_networks[k].copy()
+        n = solved_networks[k]
 
         fig, ax = cplt.plot_monthly_cfe_hmap(n, run=run, ci_identifier='C&I')
 
@@ -0,0 +1,175 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# directory of the results store, within the results directory of a run
+STORE = 'store'
+
+SCHEMA = pa.schema([
+    ('run', pa.string()),
+    ('table', pa.string()),
+    ('scenario', pa.string()),
+    ('cfe_score', pa.float64()),
+    ('metric', pa.string()),
+    ('carrier', pa.string()),
+    ('value', pa.float64()),
+])
+
+
+def save(df: pd.DataFrame, path_to_run_dir: str, table: str, index: bool = True) -> None:
+    '''Saves a results table of a run, as `results/<table>.csv` and in tidy form in the results store
+
+    The results store holds one Parquet file per table (`results/store/<table>.parquet`), with the
+    columns of SCHEMA, so that plots rendered in parallel never write to the same file. The plots are
+    drawn from the store (see read); the CSVs are kept as the per-plot tables users open directly
+    (e.g. in a spreadsheet), with the layout of the plot.
+    '''
+    df.to_csv(os.path.join(path_to_run_dir, 'results', f'{table}.csv'), index=index)
+
+    run = os.path.basename(os.path.normpath(path_to_run_dir))
+    store = os.path.join(path_to_run_dir, 'results', STORE)
+    os.makedirs(store, exist_ok=True)
+
+    # write to a temporary file first so that queries never read partial tables
+    entry = os.path.join(store, f'{table}.parquet')
+    tmp = f'{entry}.tmp-{os.getpid()}'
+    pq.write_table(
+        pa.Table.from_pandas(to_tidy(df, table).assign(run=run)[SCHEMA.names], schema=SCHEMA, preserve_index=False),
+        tmp,
+    )
+    os.replace(tmp, entry)
+
+
+def to_tidy(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    '''Converts a results table to tidy form, with one row per scenario, metric and carrier
+
+    Two layouts are supported:
+        - long tables, with `Scenario` and/or `CFE Score` (and optionally `carrier`) columns: each
+          other column is a metric (e.g. `emission_rate` or `dispatch`).
+        - wide tables, indexed by scenario or CFE score, with carriers (or cost and energy components,
+          e.g. `Net Cost` or `Grid supply`) as columns. The metric is the table name without its number
+          (e.g. `ci_capacity` for `01_ci_capacity`). With two column levels, the second is the metric.
+
+    Missing values are dropped.
+    '''
+    if 'Scenario' in df.columns or 'CFE Score' in df.columns:
+        ids = [c for c in ['Scenario', 'CFE Score', 'carrier'] if c in df.columns]
+        tidy = df.melt(id_vars=ids, var_name='metric', value_name='value')
+        labels = tidy['Scenario'] if 'Scenario' in tidy else pd.Series(np.nan, index=tidy.index)
+        scores = tidy['CFE Score'] if 'CFE Score' in tidy else pd.Series(np.nan, index=tidy.index)
+        carriers = tidy['carrier'] if 'carrier' in tidy else pd.Series(None, index=tidy.index, dtype=object)
+    else:
+        tidy = df.rename_axis(index='label', columns=None if df.columns.nlevels == 1 else ['carrier', 'metric'])
+        if df.columns.nlevels == 1:
+            tidy = tidy.melt(ignore_index=False, var_name='carrier', value_name='value').assign(
+                metric=table.split('_', 1)[-1]
+            )
+        else:
+            tidy = tidy.melt(ignore_index=False, value_name='value')
+        tidy = tidy.reset_index()
+        labels = tidy['label']
+        scores = pd.Series(np.nan, index=tidy.index)
+        carriers = tidy['carrier']
+
+    scenario, cfe_score = zip(*[_scenario(label, score) for label, score in zip(labels, scores)]) if len(tidy) else ((), ())
+    return (
+        pd.DataFrame({
+            'table': table,
+            'scenario': pd.Series(scenario, index=tidy.index, dtype=object),
+            'cfe_score': pd.Series(cfe_score, index=tidy.index, dtype=float),
+            'metric': tidy['metric'].astype(str),
+            'carrier': carriers.where(carriers.notna(), None).map(lambda c: c if c is None else str(c)),
+            'value': pd.to_numeric(tidy['value'], errors='coerce'),
+        })
+        .dropna(subset=['value'])
+        .reset_index(drop=True)
+    )
+
+
+def _scenario(label, score) -> tuple:
+    '''Returns the scenario ('Reference', '100% RES' or 'CFE') and CFE score of a row of a results table
+    '''
+    if pd.notna(score):
+        return 'CFE', float(score)
+    if isinstance(label, str) and label.startswith('CFE-'):
+        return 'CFE', float(label.replace('CFE-', ''))
+    try:
+        return 'CFE', float(label)
+    except (TypeError, ValueError):
+        return (None if pd.isna(label) else str(label)), np.nan
+
+
+def read(path_to_run_dir: str, table: str, columns='carrier', **equals) -> pd.DataFrame:
+    '''Reads a results table of a run back from the results store, in wide form
+
+    There is one row per scenario, labelled by its name (e.g. '100% RES') or, for CFE scenarios, by
+    its CFE score, and one column per value of `columns`: carriers by default, or e.g. 'metric', or
+    ['carrier', 'metric'] for two column levels. Rows and columns are in the order they were saved
+    in, with the CFE scores last and in ascending order. Values of the same row and column (e.g. of
+    several C&I buses) are averaged, as by pandas.pivot_table. Keyword arguments select rows as in
+    query, e.g. `metric='curtailment_perc'`.
+    '''
+    rows = query(glob.escape(path_to_run_dir), table=table, **equals)
+    scores = rows['cfe_score'].dropna()
+    labels = pd.Series(rows['scenario'].where(rows['cfe_score'].isna()), dtype=object)
+    labels.loc[scores.index] = scores
+    wide = (
+        rows
+        .assign(label=labels)
+        .pivot_table(index='label', columns=columns, values='value', aggfunc='mean', sort=False)
+    )
+    wide.index.name = None
+    wide.columns.names = [None] * wide.columns.nlevels
+    names = [label for label in wide.index if label not in set(scores)]
+    return wide.loc[names + sorted(set(scores))]
+
+
+def dataset(run_dirs, tables: list = None) -> ds.Dataset:
+    '''Returns the results stores of one or more run directories as a single pyarrow dataset
+
+    `run_dirs` is a run directory, a glob pattern (e.g. 'output_model_runs/*') or a list of either.
+    With `tables`, only the files of these tables are read.
+    '''
+    if isinstance(run_dirs, str):
+        run_dirs = [run_dirs]
+    files = []
+    for pattern in run_dirs:
+        for run_dir in sorted(glob.glob(pattern)):
+            names = [f'{t}.parquet' for t in tables] if tables is not None else ['*.parquet']
+            for name in names:
+                files.extend(sorted(glob.glob(os.path.join(run_dir, 'results', STORE, name))))
+    return ds.dataset(files, schema=SCHEMA, format='parquet')
+
+
+def query(run_dirs, columns: list = None, filter: pc.Expression = None, **equals) -> pd.DataFrame:
+    '''Reads the rows of the results stores of one or more run directories that match a filter
+
+    Keyword arguments select rows by column value, or by any of a list of values, e.g.
+    `query('output_model_runs/*', table='06c_unit_cost', scenario='CFE', cfe_score=[90, 100])`. A
+    pyarrow expression can be given for other predicates, e.g. `filter=pc.field('value') > 0`. The
+    predicates are pushed down to the Parquet reader, and a `table` selection skips the files of
+    other tables altogether.
+    '''
+    tables = equals.get('table')
+    if isinstance(tables, str):
+        tables = [tables]
+
+    expression = filter
+    for column, value in equals.items():
+        if isinstance(value, (list, tuple, set)):
+            condition = pc.field(column).isin(list(value))
+        else:
+            condition = pc.field(column) == value
+        expression = condition if expression is None else expression & condition
+
+    return (
+        dataset(run_dirs, tables=list(tables) if tables is not None else None)
+        .to_table(columns=columns, filter=expression)
+        .to_pandas()
+    )
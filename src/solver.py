@@ -0,0 +1,476 @@
+import glob
+import os
+import re
+import tempfile
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+import pypsa
+import xarray as xr
+
+# statistics recorded for every solve (see solve_stats)
+SOLVE_STATS = [
+    'solver',
+    'status',
+    'termination',
+    'objective',
+    'rows',
+    'columns',
+    'nonzeros',
+    'presolved_rows',
+    'presolved_columns',
+    'presolved_nonzeros',
+    'simplex_iterations',
+    'barrier_iterations',
+    'crossover_iterations',
+    'solver_time_s',
+    'wall_time_s',
+]
+
+# presolved model size, as logged by each solver
+PRESOLVE_PATTERNS = {
+    'highs': r'Presolve : Reductions: rows (\d+)\(-?\d+\); columns (\d+)\(-?\d+\); elements (\d+)',
+    'gurobi': r'Presolved: (\d+) rows, (\d+) columns, (\d+) nonzeros',
+}
+
+
+class PersistentSolver:
+    """
+    Keeps a single solver-side copy of a network's linopy model alive across re-solves.
+
+    Between GridCFE iterations and CFE scores, RunCFESweep only changes a handful of coefficients
+    and right-hand sides in the CFE constraints. Rather than rebuilding those constraints and
+    sending the whole LP to the solver on every solve, the model is passed to the solver once and
+    only the changed constraints are updated in place. The solver then re-optimises from its
+    previous state (basis for simplex, or whatever warm start the solver supports).
+
+    Parameters:
+    -----------
+    n : pypsa.Network
+        Network whose linopy model (`n.model`) is fully built, including the CFE constraints.
+    solver_name : str
+        Either 'highs' or 'gurobi'.
+    solver_options : dict
+        Solver options, as passed to `n.optimize.solve_model`.
+    env : gurobipy.Env, optional
+        Gurobi environment to reuse.
+
+    Raises:
+    -----------
+    ValueError
+        If the solver is not supported for persistent solves.
+
+    """
+
+    def __init__(
+            self,
+            n: pypsa.Network,
+            solver_name: str,
+            solver_options: dict,
+            env=None,
+        ):
+
+        if solver_name not in ['highs', 'gurobi']:
+            raise ValueError(f"Persistent solves are only supported for highs and gurobi, not {solver_name}.")
+
+        self.n = n
+        self.solver_name = solver_name
+
+        # row and column ordering of the matrix that is handed to the solver; linopy caches the flat
+        # constraints, which may predate the CFE constraints or their last in-place update
+        matrices = n.model.matrices
+        matrices.clean_cached_properties()
+        self.vlabels = pd.Index(matrices.vlabels)
+        self.clabels = pd.Index(matrices.clabels)
+
+        if solver_name == 'highs':
+            self.solver_model = n.model.to_highspy()
+            for k, v in solver_options.items():
+                self.solver_model.setOptionValue(k, v)
+        else:
+            self.solver_model = n.model.to_gurobipy(env=env)
+            for k, v in solver_options.items():
+                self.solver_model.setParam(k, v)
+            self._vars = self.solver_model.getVars()
+            self._constrs = self.solver_model.getConstrs()
+
+        # the solver log is kept for the presolve statistics of each solve (see solve_stats)
+        fd, self.log_fn = tempfile.mkstemp(prefix='persistent-solver-', suffix='.log')
+        os.close(fd)
+        weakref.finalize(self, os.remove, self.log_fn)
+        if solver_name == 'highs':
+            self.solver_model.setOptionValue('log_file', self.log_fn)
+        else:
+            self.solver_model.setParam('LogFile', self.log_fn)
+
+        # coefficients and right-hand sides of the constraints as last pushed (see update_constraints)
+        self._pushed = {}
+
+        # statistics of the last solve
+        self.stats = None
+
+    def update_constraints(self, names: list) -> None:
+        '''Push the current coefficients and right-hand sides of linopy constraints to the solver model
+
+        The linopy constraints are updated in place first (e.g. with cfe.update_grid_cfe or
+        cfe.update_cfe_score); this copies the changes to the solver without rebuilding it. Only the
+        rows that changed since they were last pushed are sent, in a single batch: rows whose
+        coefficients changed are replaced (neither highspy nor gurobipy can change many coefficients
+        at once), and rows whose right-hand side only changed get new bounds.
+        '''
+        labels, term_vars, term_coeffs, rhs, sign, coeffs_changed, rhs_changed = [], [], [], [], [], [], []
+        for name in names:
+            con = self.n.model.constraints[name]
+            con_labels = con.labels.values.ravel()
+            con_vars = con.vars.transpose(*con.labels.dims, '_term').values.reshape(con_labels.size, -1)
+            con_coeffs = con.coeffs.transpose(*con.labels.dims, '_term').values.reshape(con_labels.size, -1)
+            con_rhs = np.broadcast_to(con.rhs.values, con.labels.shape).ravel().astype(float)
+
+            previous = self._pushed.get(name)
+            if previous is None or previous[0].shape != con_vars.shape:
+                new_terms = np.ones(con_labels.size, dtype=bool)
+                new_rhs = np.ones(con_labels.size, dtype=bool)
+            else:
+                new_terms = (con_vars != previous[0]).any(axis=1) | _differs(con_coeffs, previous[1]).any(axis=1)
+                new_rhs = _differs(con_rhs, previous[2])
+            self._pushed[name] = (con_vars.copy(), con_coeffs.copy(), con_rhs.copy())
+
+            labels.append(con_labels)
+            term_vars.append(con_vars)
+            term_coeffs.append(con_coeffs)
+            rhs.append(con_rhs)
+            sign.append(np.broadcast_to(con.sign.values, con.labels.shape).ravel())
+            coeffs_changed.append(new_terms)
+            rhs_changed.append(new_rhs & ~new_terms)
+
+        if not labels:
+            return
+
+        # one row per constraint label, with its terms
+        rows = pd.DataFrame({
+            'label': np.concatenate(labels),
+            'rhs': np.concatenate(rhs),
+            'sign': np.concatenate(sign),
+            'coeffs_changed': np.concatenate(coeffs_changed),
+            'rhs_changed': np.concatenate(rhs_changed),
+        })
+        rows['row'] = self.clabels.get_indexer(rows.label)
+        in_model = (rows.row != -1).values
+
+        replace = in_model & rows.coeffs_changed.values
+        if replace.any():
+            n_terms = max(v.shape[1] for v in term_vars)
+            term_vars = np.concatenate([np.pad(v, ((0, 0), (0, n_terms - v.shape[1])), constant_values=-1) for v in term_vars])
+            term_coeffs = np.concatenate([np.pad(c, ((0, 0), (0, n_terms - c.shape[1]))) for c in term_coeffs])
+            # duplicate (row, column) terms are summed in the solver matrix
+            terms = (
+                pd.DataFrame({
+                    'label': np.repeat(rows.label.values[replace], n_terms),
+                    'col': self.vlabels.get_indexer(term_vars[replace].ravel()),
+                    'coeff': term_coeffs[replace].ravel(),
+                })
+                .query("col != -1")
+                .groupby(['label', 'col'])['coeff']
+                .sum()
+                .reset_index()
+            )
+            self._replace_rows(rows[replace].sort_values('label'), terms)
+
+        bounds = in_model & rows.rhs_changed.values
+        if bounds.any():
+            self._change_rhs(rows[bounds])
+
+    def _replace_rows(self, rows: pd.DataFrame, terms: pd.DataFrame) -> None:
+        '''Removes rows from the solver model and appends them again with their current terms
+
+        `rows` are sorted by label and `terms` by label and column. The solver row of each
+        constraint label is tracked in `clabels`.
+        '''
+        labels = rows.label.values
+        starts = np.searchsorted(terms.label.values, labels).astype(np.int32)
+        cols = terms.col.values.astype(np.int32)
+        coeffs = terms.coeff.values.astype(float)
+
+        keep = np.ones(len(self.clabels), dtype=bool)
+        keep[rows.row.values] = False
+        self.clabels = self.clabels[keep].append(pd.Index(labels))
+
+        if self.solver_name == 'highs':
+            import highspy
+
+            lower, upper = _row_bounds(rows, highspy.kHighsInf)
+            removed = np.sort(rows.row.values).astype(np.int32)
+            self.solver_model.deleteRows(len(removed), removed)
+            self.solver_model.addRows(len(labels), lower, upper, len(cols), starts, cols, coeffs)
+        else:
+            import gurobipy
+            import scipy.sparse
+
+            self.solver_model.remove([self._constrs[row] for row in rows.row.values])
+            A = scipy.sparse.csr_matrix(
+                (coeffs, cols, np.append(starts, len(cols))), shape=(len(labels), len(self._vars))
+            )
+            sense = rows.sign.map({'<=': gurobipy.GRB.LESS_EQUAL, '>=': gurobipy.GRB.GREATER_EQUAL, '=': gurobipy.GRB.EQUAL})
+            self.solver_model.addMConstr(A, self._vars, sense.values, rows.rhs.values)
+            self.solver_model.update()
+            self._constrs = self.solver_model.getConstrs()
+
+    def _change_rhs(self, rows: pd.DataFrame) -> None:
+        if self.solver_name == 'highs':
+            import highspy
+
+            lower, upper = _row_bounds(rows, highspy.kHighsInf)
+            indices = rows.row.values.astype(np.int32)
+            if hasattr(self.solver_model, 'changeRowsBounds'):
+                self.solver_model.changeRowsBounds(len(indices), indices, lower, upper)
+            else:
+                # highspy < 1.13 only changes one row at a time
+                for row, row_lower, row_upper in zip(indices.tolist(), lower.tolist(), upper.tolist()):
+                    self.solver_model.changeRowBounds(row, row_lower, row_upper)
+        else:
+            self.solver_model.setAttr('RHS', [self._constrs[row] for row in rows.row.values], rows.rhs.values.tolist())
+
+    def solve(self) -> tuple:
+        '''Re-optimise the solver model and write the solution back to the network
+
+        Returns the same (status, termination_condition) tuple as `n.optimize.solve_model`. The
+        solution is only written back when the status is 'ok'; the statistics of the solve are kept
+        in `stats` (see solve_stats).
+        '''
+        log_offset = os.path.getsize(self.log_fn)
+        # the run time of a HiGHS model accumulates over its runs
+        run_time = self.solver_model.getRunTime() if self.solver_name == 'highs' else 0.0
+        start = time.perf_counter()
+
+        if self.solver_name == 'highs':
+            import highspy
+
+            self.solver_model.run()
+            model_status = self.solver_model.getModelStatus()
+            optimal = model_status == highspy.HighsModelStatus.kOptimal
+            condition = 'optimal' if optimal else self.solver_model.modelStatusToString(model_status).lower()
+            if optimal:
+                solution = self.solver_model.getSolution()
+                primal = np.asarray(solution.col_value)
+                dual = np.asarray(solution.row_dual) if solution.dual_valid else None
+                objective = self.solver_model.getInfo().objective_function_value
+        else:
+            import gurobipy
+
+            self.solver_model.optimize()
+            optimal = self.solver_model.Status == gurobipy.GRB.OPTIMAL
+            condition = 'optimal' if optimal else f'gurobi status {self.solver_model.Status}'
+            if optimal:
+                primal = np.asarray(self.solver_model.getAttr('X', self._vars))
+                try:
+                    dual = np.asarray(self.solver_model.getAttr('Pi', self._constrs))
+                except gurobipy.GurobiError:
+                    dual = None
+                objective = self.solver_model.ObjVal
+
+        wall_time = time.perf_counter() - start
+        m = self.n.model
+        m.termination_condition = condition
+        m.status = 'ok' if optimal else 'warning'
+        self.stats = solve_stats(
+            self.n,
+            self.solver_model,
+            self.solver_name,
+            log=_read_log(self.log_fn, log_offset),
+            solver_time_s=_solver_time(self.solver_model, self.solver_name) - run_time,
+            wall_time_s=wall_time,
+            objective=objective if optimal else None,
+        )
+
+        if not optimal:
+            # the previous solution is left on the network: callers must check the status
+            return m.status, condition
+
+        m.objective._value = objective
+        self._assign(primal, dual)
+
+        self.n.optimize.assign_solution()
+        self.n.optimize.assign_duals()
+        self.n.optimize.post_processing()
+
+        return m.status, condition
+
+    def _assign(self, primal: np.ndarray, dual: np.ndarray | None) -> None:
+        '''Map flat solver results back onto the labelled linopy variables and constraints
+        '''
+        m = self.n.model
+
+        solution = pd.Series(primal, index=self.vlabels, dtype=float)
+        solution.loc[-1] = np.nan
+        for _, var in m.variables.items():
+            idx = np.ravel(var.labels)
+            var.solution = xr.DataArray(
+                solution.reindex(idx).values.reshape(var.labels.shape), var.labels.coords
+            )
+
+        if dual is None:
+            return
+
+        duals = pd.Series(dual, index=self.clabels, dtype=float)
+        duals.loc[-1] = np.nan
+        for _, con in m.constraints.items():
+            idx = np.ravel(con.labels)
+            con.dual = xr.DataArray(
+                duals.reindex(idx).values.reshape(con.labels.shape), con.labels.coords
+            )
+
+
+def _differs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    '''Elementwise a != b, where NaN equals NaN
+    '''
+    return (a != b) & ~(np.isnan(a) & np.isnan(b))
+
+
+def _row_bounds(rows: pd.DataFrame, inf: float) -> tuple:
+    '''Returns the lower and upper bounds of rows with a right-hand side and sign
+    '''
+    rhs = rows.rhs.values.astype(float)
+    lower = np.where(rows.sign.isin(['>=', '=']), rhs, -inf)
+    upper = np.where(rows.sign.isin(['<=', '=']), rhs, inf)
+    return lower, upper
+
+
+def solve_network(n: pypsa.Network, configs: dict, env=None, **kwargs) -> dict:
+    '''Solves the linopy model of a network with the solver and options of the configs, and returns
+    the statistics of the solve (see solve_stats)
+
+    Keyword arguments are passed on to `n.optimize.solve_model`.
+    '''
+    solver_name = configs["solver"]["name"]
+    with tempfile.TemporaryDirectory() as tmp:
+        log_fn = os.path.join(tmp, f'{solver_name}.log')
+        start = time.perf_counter()
+        n.optimize.solve_model(
+            solver_name=solver_name,
+            solver_options=configs["solver_options"][configs["solver"]["options"]],
+            io_api="direct",
+            env=env,
+            log_fn=log_fn,
+            **kwargs,
+        )
+        wall_time = time.perf_counter() - start
+        log = _read_log(log_fn)
+
+    solver_model = n.model.solver_model
+    return solve_stats(
+        n,
+        solver_model,
+        solver_name,
+        log=log,
+        solver_time_s=_solver_time(solver_model, solver_name),
+        wall_time_s=wall_time,
+        objective=n.model.objective.value if n.model.status == 'ok' else None,
+    )
+
+
+def solve_stats(
+        n: pypsa.Network,
+        solver_model,
+        solver_name: str,
+        log: str = '',
+        solver_time_s: float = None,
+        wall_time_s: float = None,
+        objective: float = None,
+    ) -> dict:
+    '''Returns the statistics of the last solve of a network, with the keys of SOLVE_STATS
+
+    The model size and iteration counts are read from the solver model (highspy.Highs or
+    gurobipy.Model), the presolved model size from the solver log, and the status and termination
+    condition from the linopy model. Statistics that are not available are None.
+    '''
+    stats = dict.fromkeys(SOLVE_STATS)
+    stats.update(
+        solver=solver_name,
+        status=n.model.status,
+        termination=n.model.termination_condition,
+        objective=objective,
+        solver_time_s=solver_time_s,
+        wall_time_s=wall_time_s,
+    )
+
+    if solver_model is not None and solver_name == 'highs':
+        info = solver_model.getInfo()
+        stats.update(
+            rows=solver_model.getNumRow(),
+            columns=solver_model.getNumCol(),
+            nonzeros=solver_model.getNumNz(),
+            simplex_iterations=info.simplex_iteration_count,
+            barrier_iterations=info.ipm_iteration_count,
+            crossover_iterations=info.crossover_iteration_count,
+        )
+    elif solver_model is not None and solver_name == 'gurobi':
+        stats.update(
+            rows=solver_model.NumConstrs,
+            columns=solver_model.NumVars,
+            nonzeros=solver_model.NumNZs,
+            simplex_iterations=int(solver_model.IterCount),
+            barrier_iterations=solver_model.BarIterCount,
+        )
+
+    # the last presolve of the log is that of this solve
+    presolved = re.findall(PRESOLVE_PATTERNS.get(solver_name, r'(?!)'), log or '')
+    if presolved:
+        stats.update(zip(['presolved_rows', 'presolved_columns', 'presolved_nonzeros'], map(int, presolved[-1])))
+
+    return stats
+
+
+def save_stats(stats: list, path_to_network: str) -> None:
+    '''Saves the statistics of the solves of a network next to it, as `<network>.solves.csv`
+    '''
+    pd.DataFrame(stats).to_csv(os.path.splitext(path_to_network)[0] + '.solves.csv', index=False)
+
+
+def collect_stats(path_to_run_dir: str) -> pd.DataFrame:
+    '''Collects the statistics of every solve of a run into `solver_stats.csv`, and returns them
+
+    One row per solve, with the network it belongs to (and, for CFE scores, the iteration).
+    '''
+    files = sorted(glob.glob(os.path.join(path_to_run_dir, 'solved_networks', '*.solves.csv')))
+    if not files:
+        return pd.DataFrame()
+    stats = pd.concat(
+        [pd.read_csv(f).assign(network=os.path.basename(f)[:-len('.solves.csv')]) for f in files],
+        ignore_index=True,
+    )
+    stats = stats[['network'] + [c for c in stats.columns if c != 'network']]
+    stats.to_csv(os.path.join(path_to_run_dir, 'solver_stats.csv'), index=False)
+    return stats
+
+
+def summarise_stats(stats: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the number of solves, solve time, iterations and largest model of each network
+    '''
+    return stats.groupby('network').agg(
+        solves=('wall_time_s', 'size'),
+        wall_time_s=('wall_time_s', 'sum'),
+        solver_time_s=('solver_time_s', 'sum'),
+        simplex_iterations=('simplex_iterations', 'sum'),
+        barrier_iterations=('barrier_iterations', 'sum'),
+        rows=('rows', 'max'),
+        columns=('columns', 'max'),
+        nonzeros=('nonzeros', 'max'),
+    ).round(3)
+
+
+def _solver_time(solver_model, solver_name: str) -> float:
+    if solver_model is None:
+        return None
+    if solver_name == 'highs':
+        return solver_model.getRunTime()
+    return solver_model.Runtime
+
+
+def _read_log(path: str, offset: int = 0) -> str:
+    if not os.path.exists(path):
+        return ''
+    with open(path, errors='replace') as f:
+        f.seek(offset)
+        return f.read()
@@ -0,0 +1,222 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# files written in the output directory of a run
+TRACE = 'trace.jsonl'
+SUMMARY = 'trace_summary.csv'
+
+# the tracer that stage() and traced functions record to, if any
+_active = None
+
+
+def peak_rss_mb() -> float:
+    '''Returns the peak resident set size of this process so far, in MB (None where unsupported)
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+class Tracer:
+    """
+    Records the wall time, CPU time and peak memory of the stages of a run.
+
+    While a tracer is active (`with Tracer(...):`), every `trace.stage(...)` block and every call of a
+    function decorated with `traced` appends a record to `trace.jsonl` in the run directory. Stages
+    nest: a record carries the tags of its enclosing stages (e.g. the CFE score and iteration of a
+    `solve_model`) and the name of its parent stage. When the outermost activation ends, the
+    summary of the session is written to `trace_summary.csv` and printed.
+
+    Parameters:
+    -----------
+    path_to_run_dir : str
+        The output directory of the run.
+    **tags
+        Added to every record (e.g. run='ASEAN').
+
+    Notes:
+    -----------
+    - CPU time is the CPU time of the whole process (including solver threads) for stages on the
+      main thread, and of the calling thread for stages on other threads (e.g. background exports).
+    - Peak RSS is the high-water mark of the process at the end of the stage: a stage that raises it
+      is one that needs the memory.
+    - Pool workers forked while a tracer is active keep recording to the same trace and session.
+      Records of a session are told apart by their pid.
+
+    """
+
+    def __init__(self, path_to_run_dir: str, **tags):
+        self.path = path_to_run_dir
+        self.file = os.path.join(path_to_run_dir, TRACE)
+        self.tags = tags
+        # unique even for tracers of the same process started within the same second
+        self.session = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._previous = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(path_to_run_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ['_local', '_lock']:
+            del state[name]
+        state['_previous'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        global _active
+        self._previous.append(_active)
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous.pop()
+        if _active is not self:
+            self.save_summary()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def stage(self, name: str, **tags):
+        '''Context manager that records a stage, with the tags of its enclosing stages and `tags`
+        '''
+        return _Stage(self, name, tags)
+
+    def record(self, record: dict) -> None:
+        line = json.dumps({'session': self.session, 'pid': os.getpid(), **record}, default=str)
+        with self._lock, open(self.file, 'a') as f:
+            f.write(line + '\n')
+
+    def summary(self) -> 'pd.DataFrame':
+        '''Returns the number of calls, wall time, CPU time and peak RSS of each stage of the session
+        '''
+        records = read(self.path)
+        if records.empty:
+            return records
+        records = records[records['session'] == self.session]
+        return (
+            records.groupby('stage', sort=False)
+            .agg(
+                calls=('wall_s', 'size'),
+                wall_s=('wall_s', 'sum'),
+                mean_wall_s=('wall_s', 'mean'),
+                max_wall_s=('wall_s', 'max'),
+                cpu_s=('cpu_s', 'sum'),
+                peak_rss_mb=('peak_rss_mb', 'max'),
+            )
+            .round(3)
+        )
+
+    def save_summary(self) -> None:
+        summary = self.summary()
+        if summary.empty:
+            return
+        summary.to_csv(os.path.join(self.path, SUMMARY))
+        print(f"Stages of {self.tags.get('run', self.path)}:")
+        print(summary.to_string())
+
+
+class _Stage:
+
+    def __init__(self, tracer: Tracer, name: str, tags: dict):
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent, context = stack[-1] if stack else (None, self.tracer.tags)
+        self.context = {**context, **self.tags}
+        stack.append((self.name, self.context))
+        self._cpu = time.process_time if threading.current_thread() is threading.main_thread() else time.thread_time
+        self.start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu_start = self._cpu()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall, cpu = time.perf_counter() - self._wall, self._cpu() - self._cpu_start
+        self.tracer._stack().pop()
+        self.tracer.record({
+            'stage': self.name,
+            'parent': self.parent,
+            **self.context,
+            'start': self.start,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'error': None if exc is None else repr(exc),
+        })
+
+
+def active() -> Tracer:
+    '''Returns the active tracer, or None
+    '''
+    return _active
+
+
+def activate(tracer: Tracer) -> None:
+    '''Makes a tracer active for the rest of the process (e.g. as a pool initializer)
+    '''
+    global _active
+    _active = tracer
+
+
+def for_run(path_to_run_dir: str, **tags) -> Tracer:
+    '''Returns the active tracer if it traces this run directory, or a new tracer for it
+    '''
+    if _active is not None and os.path.abspath(_active.path) == os.path.abspath(path_to_run_dir):
+        return _active
+    return Tracer(path_to_run_dir, **tags)
+
+
+def stage(name: str, **tags):
+    '''Records a stage with the active tracer. Does nothing if no tracer is active.
+    '''
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, **tags)
+
+
+def traced(func):
+    '''Records every call of a function as a stage named after it
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def read(path_to_run_dir: str) -> 'pd.DataFrame':
+    '''Returns the trace of a run directory, one row per recorded stage
+    '''
+    # pandas is only needed to read traces, not to record them
+    import pandas as pd
+
+    file = os.path.join(path_to_run_dir, TRACE)
+    if not os.path.exists(file):
+        return pd.DataFrame()
+    with open(file) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
@@ -0,0 +1,100 @@
+'''Shared fixtures of the tests, on the synthetic stock models of docs/simple_model.py
+'''
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from docs import simple_model
+from src import cache, cfe
+
+# n.add warns for every attribute of the synthetic model that is not a pypsa default
+logging.getLogger('pypsa').setLevel(logging.ERROR)
+logging.getLogger('linopy').setLevel(logging.ERROR)
+
+# a small synthetic stock model: 3 buses, 6 technologies, 48 hourly snapshots
+STOCK_NETWORK = {'n_buses': 3, 'n_technologies': 6, 'n_snapshots': 48}
+
+CI_IDENTIFIER = 'C&I'
+
+CI_BUSES = ['BUS000', 'BUS001']
+
+CI_LOAD_FRACTION = 0.2
+
+MAX_EXCESS_EXPORT = 0.15
+
+# constraints added by cfe.apply_cfe_constraint
+CFE_CONSTRAINTS = [
+    f'cfe-constraint-{kind}-{bus}'
+    for bus in CI_BUSES for kind in ['hourly-matching', 'target', 'excess', 'storage', 'fossil-excess']
+]
+
+HIGHS_OPTIONS = {'log_to_console': False, 'random_seed': 123}
+
+
+@pytest.fixture
+def stock_network():
+    return simple_model.MakeStockNetwork(**STOCK_NETWORK)
+
+
+@pytest.fixture
+def prepared_network(stock_network):
+    return prepare(stock_network)
+
+
+@pytest.fixture(scope='session')
+def solved_networks_dir(tmp_path_factory):
+    '''Returns a directory of solved networks (with random solutions), named as run_scenarios exports them
+    '''
+    path = tmp_path_factory.mktemp('solved_networks')
+    scenarios = ['brownfield_2030', 'annual_matching_RES100_2030', 'hourly_matching_CFE90_2030', 'hourly_matching_CFE100_2030']
+    for seed, scenario in enumerate(scenarios):
+        n = simple_model.add_solution(prepare(simple_model.MakeStockNetwork(**STOCK_NETWORK)), seed)
+        n.export_to_netcdf(str(path / f'{scenario}.nc'))
+    return path
+
+
+def prepare(n):
+    '''Adds the C&I systems of CI_BUSES to a network, procuring every technology and batteries
+    '''
+    return cfe.PrepareNetworkForCFE(n, CI_BUSES, CI_LOAD_FRACTION, simple_model.palette(n, 6), True)
+
+
+def cfe_network(GridCFE, CFE_Score):
+    '''Returns a prepared network with its model and the CFE constraints built with GridCFE and CFE_Score
+    '''
+    n = prepare(simple_model.MakeStockNetwork(**STOCK_NETWORK))
+    n.optimize.create_model()
+    return cfe.apply_cfe_constraint(n, GridCFE, CI_BUSES, CI_IDENTIFIER, CFE_Score, MAX_EXCESS_EXPORT)
+
+
+def matrices(m, names):
+    '''Returns the rows of the constraints `names` of a linopy model, as their coefficients
+    (constraint x variable labels) and right-hand sides
+    '''
+    M = m.matrices
+    # the flat constraints are cached by linopy, and would miss the updates made in place since
+    M.clean_cached_properties()
+    labels = np.concatenate([m.constraints[name].labels.values.ravel() for name in names])
+    rows = pd.Index(M.clabels).get_indexer(labels)
+    A = pd.DataFrame(M.A[rows].toarray(), index=labels, columns=M.vlabels)
+    return A, pd.Series(M.b[rows], index=labels)
+
+
+def optimize(n, **kwargs):
+    '''Solves a network with HiGHS and checks that the solve is optimal
+    '''
+    status, condition = n.optimize(solver_name='highs', solver_options=HIGHS_OPTIONS, **kwargs)
+    assert status == 'ok', condition
+    return n
+
+
+def write_outputs(path_to_run_dir, stage, configs, content='solved'):
+    '''Writes placeholder outputs of a stage of a run (see cache.stage_outputs)
+    '''
+    for f in cache.stage_outputs(stage, configs):
+        os.makedirs(os.path.dirname(os.path.join(path_to_run_dir, f)), exist_ok=True)
+        with open(os.path.join(path_to_run_dir, f), 'w') as out:
+            out.write(content)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import optimize
+from docs import simple_model
+from src import aggregation
+
+
+def periodic_network(days: int = 3):
+    '''A network whose time series repeat every day, so that one representative day is exact
+    '''
+    n = simple_model.MakeStockNetwork(n_buses=2, n_technologies=6, n_snapshots=24 * days)
+    for df in [n.loads_t.p_set, n.generators_t.p_max_pu]:
+        df.iloc[:] = np.tile(df.values[:24], (days, 1))
+    # distinct marginal costs, so that the optimal dispatch is unique
+    n.generators.marginal_cost += np.arange(len(n.generators)) * 1e-2
+    n.storage_units.p_nom_extendable = False
+    return n
+
+
+def test_representative_day_matches_full_resolution():
+    full = optimize(periodic_network())
+    aggregated = aggregation.AggregateSnapshots(
+        periodic_network(), {'time_aggregation': {'enable': True, 'method': 'representative_days', 'n_periods': 1}},
+    )
+    assert len(aggregated.snapshots) == 24
+    assert aggregated.snapshot_weightings.objective.sum() == len(full.snapshots)
+    optimize(aggregated)
+
+    assert aggregated.objective == pytest.approx(full.objective, rel=1e-6)
+    dispatch = aggregation.disaggregate(aggregated.generators_t.p, aggregated)
+    pd.testing.assert_index_equal(dispatch.index, full.snapshots, check_names=False)
+    pd.testing.assert_frame_equal(dispatch, full.generators_t.p, check_names=False, atol=1e-3, rtol=1e-5)
+
+
+def test_segmentation_averages_time_series():
+    n = simple_model.MakeStockNetwork(n_buses=2, n_technologies=4, n_snapshots=48)
+    load = n.loads_t.p_set.copy()
+    aggregation.AggregateSnapshots(n, {'time_aggregation': {'enable': True, 'method': 'segmentation', 'n_segments': 12}})
+
+    assert len(n.snapshots) == 12
+    assert n.snapshot_weightings.objective.sum() == 48
+    # the total load is kept, weighted by the length of each segment
+    weighted = n.loads_t.p_set.mul(n.snapshot_weightings.objective, axis=0).sum()
+    pd.testing.assert_series_equal(weighted, load.sum(), check_names=False)
+
+    mapping = aggregation.snapshot_map(n)
+    pd.testing.assert_index_equal(mapping.index, load.index, check_names=False)
+    assert mapping.isin(n.snapshots).all()
+
+
+def test_disabled_aggregation_leaves_the_network_unchanged():
+    n = simple_model.MakeStockNetwork(n_buses=1, n_technologies=2, n_snapshots=24)
+    snapshots = n.snapshots
+    assert aggregation.AggregateSnapshots(n, {}) is n
+    assert n.snapshots.equals(snapshots)
+    assert aggregation.snapshot_map(n) is None
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from benchmarks import suite
+
+# the suite solves RunCFE, which imports the brownfield constraints of tza-pypsa
+pytest.importorskip('tz_pypsa')
+
+
+@pytest.mark.parametrize('persistent_solver', [False, True])
+def test_suite_runs_the_base_case(tmp_path, persistent_solver):
+    output = tmp_path / 'bench.json'
+    args = ['run', '--scale', '', '--repeats', '1', '--output', str(output)]
+    result = CliRunner().invoke(suite.cli, args + (['--persistent-solver'] if persistent_solver else []))
+    assert result.exit_code == 0, result.output
+
+    with open(output) as f:
+        benchmark = json.load(f)
+    [case] = benchmark['cases']
+    assert case['case'] == 'base'
+    assert set(case['stages']) >= {'PrepareNetworkForCFE', 'solve_brownfield', 'RunCFE', 'get.get_cfe_score_ts'}
+    assert case['results']['iterations'] >= 1
+    assert case['results']['cfe_score'] == pytest.approx(suite.CFE_SCORE, abs=0.05)
+
+    result = CliRunner().invoke(suite.cli, ['compare', str(output), str(output)])
+    assert result.exit_code == 0, result.output
+    assert 'Results are unchanged.' in result.output
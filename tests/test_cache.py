@@ -0,0 +1,369 @@
+import copy
+import json
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from conftest import write_outputs
+from src import cache
+
+STAGE = ('CFE', 0.9)
+
+
+@pytest.fixture
+def configs(tmp_path):
+    path_to_model = tmp_path / 'stock_model'
+    path_to_model.mkdir()
+    (path_to_model / 'generators.csv').write_text('name,p_nom\ngas,100\n')
+    return {
+        'paths': {'path_to_model': str(path_to_model)},
+        'global_vars': {
+            'year': 2030,
+            'maximum_excess_export_cfe': 0.15,
+            'background_export': True,
+            'persistent_solver': False,
+            'parametric_cfe_sweep': False,
+        },
+        'constraints': {'policy_targets': {'enable': False}},
+        'technology_palette': {'palette_1': ['solar', 'onwind']},
+        'solver': {'name': 'highs', 'options': 'highs-default'},
+        'solver_options': {'highs-default': {'threads': 4}},
+    }
+
+
+@pytest.fixture
+def run():
+    return {'name': 'test', 'palette': 'palette_1', 'ci_load_fraction': 0.2, 'cfe_score': [0.9, 1.0]}
+
+
+def test_run_key_ignores_execution_settings(run, configs):
+    key = cache.run_key(run, configs)
+    for flag in cache.EXECUTION_ONLY:
+        changed = copy.deepcopy(configs)
+        changed['global_vars'][flag] = not changed['global_vars'][flag]
+        assert cache.run_key(run, changed) == key, flag
+    assert cache.run_key({**run, 'cfe_score': [0.8, 0.9, 1.0]}, configs) == key
+
+
+def test_run_key_changes_with_the_inputs(run, configs):
+    key = cache.run_key(run, configs)
+    changed = copy.deepcopy(configs)
+    changed['global_vars']['maximum_excess_export_cfe'] = 0.2
+    assert cache.run_key(run, changed) != key
+    assert cache.run_key({**run, 'ci_load_fraction': 0.3}, configs) != key
+
+    changed = copy.deepcopy(configs)
+    changed['technology_palette']['palette_1'].append('nuclear')
+    assert cache.run_key(run, changed) != key
+
+    with open(os.path.join(configs['paths']['path_to_model'], 'generators.csv'), 'a') as f:
+        f.write('coal,50\n')
+    assert cache.run_key(run, configs) != key
+
+
+def test_restore_a_stored_stage(tmp_path, run, configs):
+    solved_networks = cache.SolvedNetworkCache(str(tmp_path / 'cache'))
+    key = cache.run_key(run, configs)
+    write_outputs(tmp_path / 'run', STAGE, configs)
+    solved_networks.store(key, STAGE, str(tmp_path / 'run'), configs)
+    # written to a temporary directory, then moved into place
+    assert os.listdir(tmp_path / 'cache') == [solved_networks.stage_key(key, STAGE)]
+
+    assert solved_networks.restore(key, STAGE, str(tmp_path / 'restored'), configs)
+    for f in cache.stage_outputs(STAGE, configs):
+        assert (tmp_path / 'restored' / f).read_text() == 'solved'
+
+
+def test_misses(tmp_path, run, configs):
+    solved_networks = cache.SolvedNetworkCache(str(tmp_path / 'cache'))
+    key = cache.run_key(run, configs)
+    write_outputs(tmp_path / 'run', STAGE, configs)
+    solved_networks.store(key, STAGE, str(tmp_path / 'run'), configs)
+
+    assert not solved_networks.restore(key, ('CFE', 1.0), str(tmp_path / 'restored'), configs)
+    changed = copy.deepcopy(configs)
+    changed['global_vars']['maximum_excess_export_cfe'] = 0.2
+    assert not solved_networks.restore(cache.run_key(run, changed), STAGE, str(tmp_path / 'restored'), configs)
+    assert not cache.SolvedNetworkCache(str(tmp_path / 'cache'), force=True).restore(
+        key, STAGE, str(tmp_path / 'restored'), configs
+    )
+    assert not (tmp_path / 'restored').exists()
+
+    # an incomplete entry is a miss
+    entry = tmp_path / 'cache' / solved_networks.stage_key(key, STAGE)
+    os.remove(entry / cache.stage_outputs(STAGE, configs)[-1])
+    assert not solved_networks.restore(key, STAGE, str(tmp_path / 'restored'), configs)
+
+
+def test_store_replaces_an_entry(tmp_path, run, configs):
+    solved_networks = cache.SolvedNetworkCache(str(tmp_path / 'cache'))
+    key = cache.run_key(run, configs)
+    write_outputs(tmp_path / 'run', STAGE, configs, 'first')
+    solved_networks.store(key, STAGE, str(tmp_path / 'run'), configs)
+    entry = tmp_path / 'cache' / solved_networks.stage_key(key, STAGE)
+    (entry / 'stale').write_text('')
+
+    write_outputs(tmp_path / 'run', STAGE, configs, 'second')
+    solved_networks.store(key, STAGE, str(tmp_path / 'run'), configs)
+    assert not (entry / 'stale').exists()
+    assert solved_networks.restore(key, STAGE, str(tmp_path / 'restored'), configs)
+    assert (tmp_path / 'restored' / cache.stage_outputs(STAGE, configs)[0]).read_text() == 'second'
+
+
+def test_eviction(tmp_path, run, configs):
+    path = str(tmp_path / 'cache')
+    key = cache.run_key(run, configs)
+    stages = [('RES', 100), ('CFE', 0.9), ('CFE', 1.0)]
+    solved_networks = cache.SolvedNetworkCache(path)
+    for i, stage in enumerate(stages):
+        write_outputs(tmp_path / 'run', stage, configs)
+        solved_networks.store(key, stage, str(tmp_path / 'run'), configs)
+        entry = os.path.join(path, solved_networks.stage_key(key, stage))
+        os.utime(entry, (time.time() - (3 - i) * 86400,) * 2)
+
+    # RES100 was last used three days ago
+    cache.SolvedNetworkCache(path, max_age_days=2.5)
+    assert not solved_networks.restore(key, ('RES', 100), str(tmp_path / 'restored'), configs)
+    # restoring marks CFE 1.0 as the most recently used: CFE 0.9 is evicted first
+    assert solved_networks.restore(key, ('CFE', 1.0), str(tmp_path / 'restored'), configs)
+    size = sum(len('solved') for _ in cache.stage_outputs(STAGE, configs))
+    cache.SolvedNetworkCache(path, max_size_gb=1.5 * size / 1e9)
+    assert os.listdir(path) == [solved_networks.stage_key(key, ('CFE', 1.0))]
+
+
+@pytest.fixture
+def stock_configs(configs, run):
+    run.update(stock_model='Japan', select_nodes=None, backstop=False)
+    configs['model_runs'] = [run]
+    configs['global_vars'].update(frequency='1h', timesteps=24, set_global_constraints=False)
+    return configs
+
+
+class Loader:
+    '''Builds a small stock model and counts how often it is called
+    '''
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        from docs import simple_model
+        self.calls += 1
+        return simple_model.MakeStockNetwork(n_buses=2, n_technologies=3, n_snapshots=24)
+
+
+def test_stock_model_is_parsed_once(tmp_path, run, stock_configs):
+    stock_models = cache.StockModelCache(str(tmp_path / 'cache'))
+    loader = Loader()
+    parsed = stock_models.load(run, stock_configs, loader)
+    # written to a temporary file, then moved into place
+    assert os.listdir(tmp_path / 'cache') == [f'{stock_models.key(run, stock_configs)}.nc']
+
+    cached = stock_models.load(run, stock_configs, loader)
+    assert loader.calls == 1
+    assert list(cached.generators.index) == list(parsed.generators.index)
+    assert (cached.generators_t.p_max_pu.values == parsed.generators_t.p_max_pu.values).all()
+
+
+def test_stock_model_key(tmp_path, run, stock_configs):
+    stock_models_key = cache.StockModelCache(str(tmp_path / 'cache')).key
+    key = stock_models_key(run, stock_configs)
+
+    # the nodes are selected after loading a model from CSVs
+    assert stock_models_key({**run, 'select_nodes': ['JPN01']}, stock_configs) == key
+    # settings of the run that are applied after loading
+    assert stock_models_key({**run, 'ci_load_fraction': 0.5}, stock_configs) == key
+
+    changed = copy.deepcopy(stock_configs)
+    changed['global_vars']['timesteps'] = 48
+    assert stock_models_key(run, changed) != key
+
+    # a model file is rewritten
+    model_file = os.path.join(stock_configs['paths']['path_to_model'], 'generators.csv')
+    mtime = os.stat(model_file).st_mtime_ns
+    os.utime(model_file, ns=(mtime + 10**9, mtime + 10**9))
+    assert stock_models_key(run, stock_configs) != key
+
+
+def test_stock_model_key_of_a_yaml_model(tmp_path, run, stock_configs):
+    stock_configs['model_runs'][0]['stock_model'] = 'ASEAN_yaml'
+    run.update(stock_model='ASEAN_yaml')
+    stock_models_key = cache.StockModelCache(str(tmp_path / 'cache')).key
+    key = stock_models_key(run, stock_configs)
+    assert stock_models_key({**run, 'select_nodes': ['MYS']}, stock_configs) != key
+    assert stock_models_key({**run, 'backstop': True}, stock_configs) != key
+    # the CSVs of path_to_model are not read
+    with open(os.path.join(stock_configs['paths']['path_to_model'], 'generators.csv'), 'a') as f:
+        f.write('coal,50\n')
+    assert stock_models_key(run, stock_configs) == key
+
+
+def test_stock_models_are_evicted(tmp_path, run, stock_configs):
+    path = str(tmp_path / 'cache')
+    stock_models = cache.StockModelCache(path, max_age_days=1)
+    stock_models.load(run, stock_configs, Loader())
+    entry = os.path.join(path, os.listdir(path)[0])
+    os.utime(entry, (time.time() - 2 * 86400,) * 2)
+
+    stock_models.evict()
+    assert os.listdir(path) == []
+
+
+def plot(solved_networks, path_to_run_dir, label):
+    with open(os.path.join(path_to_run_dir, 'results', 'plot.png'), 'w') as f:
+        f.write(label)
+
+
+def plot_v2(solved_networks, path_to_run_dir, label):
+    with open(os.path.join(path_to_run_dir, 'results', 'plot.png'), 'w') as f:
+        f.write(label.upper())
+
+
+# the same plot, with other code
+plot_v2.__name__ = 'plot'
+
+
+@pytest.fixture
+def results_dir(tmp_path):
+    (tmp_path / 'results').mkdir()
+    (tmp_path / 'solved_networks').mkdir()
+    (tmp_path / 'solved_networks' / 'brownfield_2030.nc').write_text('solved')
+    return tmp_path
+
+
+def results_manifest(results_dir):
+    return cache.ResultsManifest(str(results_dir / 'results'), [str(results_dir / 'solved_networks' / 'brownfield_2030.nc')])
+
+
+def draw(results_dir, func=plot, **kwargs):
+    kwargs = {'path_to_run_dir': str(results_dir), 'label': 'a', **kwargs}
+    func(None, **kwargs)
+    manifest = results_manifest(results_dir)
+    manifest.record(func, kwargs, ['plot.*'])
+    manifest.save()
+    return kwargs
+
+
+def test_drawn_plots_are_current(results_dir):
+    kwargs = draw(results_dir)
+    manifest = results_manifest(results_dir)
+    assert manifest.plots['plot']['outputs'] == ['plot.png']
+    assert manifest.is_current(plot, kwargs)
+    # the run directory may be moved
+    assert manifest.is_current(plot, {**kwargs, 'path_to_run_dir': 'elsewhere'})
+
+
+def test_plots_are_redrawn_when_an_input_changes(results_dir):
+    kwargs = draw(results_dir)
+    assert not results_manifest(results_dir).is_current(plot, {**kwargs, 'label': 'b'})
+    assert not results_manifest(results_dir).is_current(plot_v2, kwargs)
+
+    (results_dir / 'solved_networks' / 'brownfield_2030.nc').write_text('solved again')
+    assert not results_manifest(results_dir).is_current(plot, kwargs)
+
+
+def test_plots_are_redrawn_when_an_output_is_missing(results_dir):
+    kwargs = draw(results_dir)
+    (results_dir / 'results' / 'plot.png').unlink()
+    assert not results_manifest(results_dir).is_current(plot, kwargs)
+
+
+def test_discarded_plots_are_redrawn(results_dir):
+    kwargs = draw(results_dir)
+    manifest = results_manifest(results_dir)
+    manifest.discard(plot)
+    manifest.save()
+    assert not results_manifest(results_dir).is_current(plot, kwargs)
+    assert not [f for f in os.listdir(results_dir / 'results') if '.tmp-' in f]
+
+
+def test_inputs_are_only_rehashed_when_their_size_or_mtime_changes(results_dir, monkeypatch):
+    kwargs = draw(results_dir)
+    hashed = []
+    hash_files = cache.hash_files
+    monkeypatch.setattr(cache, 'hash_files', lambda paths: hashed.extend(paths) or hash_files(paths))
+    network = results_dir / 'solved_networks' / 'brownfield_2030.nc'
+
+    assert results_manifest(results_dir).is_current(plot, kwargs)
+    assert str(network) not in hashed
+
+    # same contents, touched
+    stat = network.stat()
+    os.utime(network, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert results_manifest(results_dir).is_current(plot, kwargs)
+    assert hashed.count(str(network)) == 1
+
+
+def test_completed_stages_are_kept_for_the_same_inputs(tmp_path, configs):
+    checkpoint = cache.RunManifest(str(tmp_path), 'key')
+    write_outputs(str(tmp_path), ('brownfield', None), configs)
+    checkpoint.complete(('brownfield', None))
+    # a stage whose outputs were lost
+    checkpoint.complete(('RES', 100))
+
+    resumed = cache.RunManifest(str(tmp_path), 'key')
+    assert resumed.completed(('brownfield', None), configs)
+    assert not resumed.completed(('RES', 100), configs)
+    assert not resumed.completed(STAGE, configs)
+
+
+def grid_cfe_iterations():
+    '''Returns the GridCFE iterations (stacked, one column per iteration) and next GridCFE of a CFE score,
+    as RunCFE stores them
+    '''
+    grid_cfe = pd.DataFrame(
+        {'BUS0': [0.25, 0.5], 'BUS1': [0.75, 1.0]},
+        index=pd.date_range('2030-01-01', periods=2, freq='h', name='snapshot'),
+    ).T
+    iterations = pd.DataFrame({'iteration_1': 0.0, 'iteration_2': grid_cfe.stack() / 2})
+    return iterations, grid_cfe
+
+
+@pytest.mark.parametrize('key, reset', [('other', False), ('key', True)])
+def test_checkpoints_are_discarded(tmp_path, configs, key, reset):
+    checkpoint = cache.RunManifest(str(tmp_path), 'key')
+    write_outputs(str(tmp_path), ('brownfield', None), configs)
+    checkpoint.complete(('brownfield', None))
+    checkpoint.save_grid_cfe(0.9, *grid_cfe_iterations())
+
+    resumed = cache.RunManifest(str(tmp_path), key, reset=reset)
+    assert not resumed.completed(('brownfield', None), configs)
+    assert resumed.load_grid_cfe(0.9) is None
+    assert not os.path.exists(tmp_path / 'checkpoints')
+
+
+def test_grid_cfe_checkpoint(tmp_path):
+    checkpoint = cache.RunManifest(str(tmp_path), 'key')
+    assert checkpoint.load_grid_cfe(0.9) is None
+
+    iterations, grid_cfe = grid_cfe_iterations()
+    checkpoint.save_grid_cfe(0.9, iterations, grid_cfe)
+    assert sorted(os.listdir(tmp_path / 'checkpoints')) == ['cfe90.parquet']
+
+    stored_iterations, stored_grid_cfe = cache.RunManifest(str(tmp_path), 'key').load_grid_cfe(0.9)
+    pd.testing.assert_frame_equal(stored_iterations, iterations)
+    pd.testing.assert_frame_equal(stored_grid_cfe.unstack(), grid_cfe)
+
+
+def complete_in_child(checkpoint, stage):
+    checkpoint.complete(stage)
+
+
+def test_only_the_creating_process_writes_the_manifest(tmp_path):
+    checkpoint = cache.RunManifest(str(tmp_path), 'key')
+
+    # e.g. a pool worker, with a fork or a copy of the manifest
+    for method in ['fork', 'spawn']:
+        process = multiprocessing.get_context(method).Process(target=complete_in_child, args=(checkpoint, STAGE))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        with open(tmp_path / 'manifest.json') as f:
+            assert json.load(f)['stages'] == {}
+
+    checkpoint.complete(STAGE)
+    with open(tmp_path / 'manifest.json') as f:
+        assert list(json.load(f)['stages']) == ['CFE-0.9']
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import CFE_CONSTRAINTS, CI_BUSES, CI_IDENTIFIER, cfe_network, matrices
+from docs import simple_model
+from src import cfe
+
+
+def test_ci_index_matches_the_component_names(prepared_network):
+    index = cfe.get_ci_index(prepared_network, CI_IDENTIFIER)
+    assert len(index) == sum(len(prepared_network.static(c).filter(like=CI_IDENTIFIER, axis=0)) for c in cfe.CI_COMPONENTS)
+    assert set(index.parent_bus) == set(CI_BUSES)
+
+    # networks without the metadata columns (e.g. older solved networks) parse the names instead
+    parsed = pd.concat(
+        [cfe._parse_ci_names(prepared_network.static(c).index, c, CI_IDENTIFIER) for c in cfe.CI_COMPONENTS],
+        ignore_index=True,
+    )
+    pd.testing.assert_frame_equal(index, parsed)
+
+
+def test_get_ci_components_filters(prepared_network):
+    bus = CI_BUSES[0]
+    imports = cfe.get_ci_components(prepared_network, 'Link', 'import', bus)
+    assert list(imports) == [f'{bus} {CI_IDENTIFIER} Grid Imports']
+
+    fossil = cfe.get_ci_components(prepared_network, 'Generator', 'ppa', bus, clean=False)
+    assert len(fossil) == 2
+    assert fossil.str.endswith('Fossil').all()
+    assert prepared_network.generators.carrier[fossil].map(prepared_network.carriers.co2_emissions).gt(0).all()
+
+    clean = cfe.get_ci_components(prepared_network, 'Generator', parent_bus=CI_BUSES, clean=True)
+    assert len(clean) == 4 * len(CI_BUSES)
+
+
+def test_ci_index_cache(prepared_network):
+    index = cfe.get_ci_index(prepared_network, CI_IDENTIFIER)
+    assert cfe.get_ci_index(prepared_network, CI_IDENTIFIER) is index
+
+    # adding components changes the index of their table, which invalidates the cache
+    prepared_network.add(
+        'Load', 'BUS002 C&I Load', bus='BUS002', p_set=1.0, **cfe.ci_metadata('BUS002 C&I Grid', 'load', 'BUS002'),
+    )
+    assert len(cfe.get_ci_index(prepared_network, CI_IDENTIFIER)) == len(index) + 1
+
+    # edits in place need an explicit clear
+    prepared_network.generators.loc[prepared_network.generators.ci_role == 'ppa', 'ci_clean'] = False
+    cfe.clear_ci_cache(prepared_network)
+    assert cfe.get_ci_components(prepared_network, 'Generator', 'ppa', clean=True).empty
+
+
+def test_prepare_network_adds_a_ci_system_per_bus(stock_network):
+    load = stock_network.loads_t.p_set.copy()
+    palette = simple_model.palette(stock_network, 6)
+    n = cfe.PrepareNetworkForCFE(stock_network, CI_BUSES, 0.2, palette, True)
+
+    for bus in CI_BUSES:
+        ci_bus = f'{bus} {CI_IDENTIFIER} Grid'
+        assert {ci_bus, f'{bus} {CI_IDENTIFIER} Storage'} <= set(n.buses.index)
+        # the C&I load is taken out of the load of the bus, so the total load is unchanged
+        ci_load = n.loads_t.p_set[f'{bus} {CI_IDENTIFIER} Load']
+        pd.testing.assert_series_equal(ci_load, 0.2 * load[bus], check_names=False)
+        pd.testing.assert_series_equal(n.loads_t.p_set[bus] + ci_load, load[bus], check_names=False)
+
+        ppa = n.generators[n.generators.bus == ci_bus]
+        assert list(ppa.type) == palette[:-1]
+        assert ppa.p_nom_extendable.all()
+        for name, generator in ppa.iterrows():
+            # renewable PPAs take the profile of the extendable generator of their technology on the bus
+            extendable = f'{bus} {generator.type} ext 0'
+            if extendable in stock_network.generators_t.p_max_pu:
+                pd.testing.assert_series_equal(
+                    n.generators_t.p_max_pu[name], n.generators_t.p_max_pu[extendable], check_names=False,
+                )
+            else:
+                assert name not in n.generators_t.p_max_pu or (n.generators_t.p_max_pu[name] == 1).all()
+        assert list(n.storage_units.index[n.storage_units.bus == f'{bus} {CI_IDENTIFIER} Storage']) == [f'{ci_bus}-Batteries']
+
+    # every other bus is left as it is
+    assert not n.buses.index.str.startswith('BUS002 ').any()
+    pd.testing.assert_series_equal(n.loads_t.p_set['BUS002'], load['BUS002'])
+
+
+def test_prepare_network_rejects_unknown_technologies(stock_network):
+    with pytest.raises(ValueError, match='Invalid technology'):
+        cfe.PrepareNetworkForCFE(stock_network, CI_BUSES, 0.2, ['fusion'], True)
+
+
+def baseline_grid_cfe(n, bus, ci_identifier):
+    '''The GridCFE of one bus, as computed by the per-bus loop GetGridCFE replaced
+    '''
+    clean_carriers = [
+        i for i in n.carriers.query('co2_emissions <= 0').index.tolist() if i in n.generators.carrier.tolist()
+    ]
+    grid = n.generators.index.str.contains(bus) & ~n.generators.index.str.contains(ci_identifier)
+    clean = n.generators.index[grid & n.generators.carrier.isin(clean_carriers)]
+    total_clean_generation = n.generators_t.p[clean].sum(axis=1)
+    total_generation = n.generators_t.p[n.generators.index[grid]].sum(axis=1)
+    return (total_clean_generation / total_generation).round(2)
+
+
+def test_grid_cfe_matches_the_per_bus_loop(prepared_network):
+    n = simple_model.add_solution(prepared_network)
+    # an hour without generation on a bus gives NaN, as in the loop
+    n.generators_t.p.loc[n.snapshots[0], n.generators.bus == CI_BUSES[1]] = 0.0
+
+    GridCFE = cfe.GetGridCFE(n, CI_BUSES, CI_IDENTIFIER)
+    assert list(GridCFE.index) == CI_BUSES
+    pd.testing.assert_index_equal(GridCFE.columns, n.snapshots, check_names=False)
+    for bus in CI_BUSES:
+        pd.testing.assert_series_equal(GridCFE.loc[bus], baseline_grid_cfe(n, bus, CI_IDENTIFIER), check_names=False)
+    assert GridCFE.loc[CI_BUSES[1]].isna().sum() == 1
+
+    # the cached generator map is re-used for the GridCFE of the next iteration
+    n.generators_t.p = n.generators_t.p * 0.5
+    pd.testing.assert_frame_equal(cfe.GetGridCFE(n, CI_BUSES, CI_IDENTIFIER), GridCFE)
+
+
+def test_grid_of_a_bus_is_made_of_the_generators_connected_to_it(prepared_network):
+    n = prepared_network
+    # a bus whose name is contained in the names of the others (as IND1 in IND10)
+    n.add('Bus', 'BUS00', carrier='AC')
+    n.add('Generator', 'BUS00 gas', bus='BUS00', carrier='gas', p_nom=100)
+    n.add('Generator', 'gas at BUS001', bus='BUS001', carrier='gas', p_nom=100)
+    n = simple_model.add_solution(n)
+
+    GridCFE = cfe.GetGridCFE(n, ['BUS00', 'BUS001'], CI_IDENTIFIER)
+    assert (GridCFE.loc['BUS00'] == 0.0).all()
+    grid = (n.generators.bus == 'BUS001') & ~n.generators.index.str.contains(CI_IDENTIFIER)
+    assert grid['gas at BUS001']
+    clean = grid & (n.generators.carrier.map(n.carriers.co2_emissions) <= 0)
+    expected = n.generators_t.p.loc[:, clean].sum(axis=1) / n.generators_t.p.loc[:, grid].sum(axis=1)
+    pd.testing.assert_series_equal(GridCFE.loc['BUS001'], expected.round(2), check_names=False)
+
+
+def test_updated_cfe_constraints_match_a_rebuilt_model():
+    rng = np.random.default_rng(0)
+    n = cfe_network(0.0, 0.8)
+    # each score after the GridCFE of the previous one, as in RunCFESweep
+    for CFE_Score in [0.9, 1.0]:
+        cfe.update_cfe_score(n, CFE_Score, CI_BUSES, CI_IDENTIFIER)
+        GridCFE = pd.DataFrame(rng.uniform(0, 0.5, (len(CI_BUSES), len(n.snapshots))), index=CI_BUSES, columns=n.snapshots)
+        cfe.update_grid_cfe(n, GridCFE, CI_BUSES, CI_IDENTIFIER)
+
+        A, b = matrices(n.model, CFE_CONSTRAINTS)
+        A_rebuilt, b_rebuilt = matrices(cfe_network(GridCFE, CFE_Score).model, CFE_CONSTRAINTS)
+        pd.testing.assert_frame_equal(A, A_rebuilt, atol=1e-12)
+        pd.testing.assert_series_equal(b, b_rebuilt, atol=1e-12)
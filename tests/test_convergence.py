@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from src.convergence import GridCFEConvergence
+
+
+def iterate(convergence, F, G):
+    '''Runs the fixed-point iteration of IterateGridCFE on the map F, from G
+    '''
+    for _ in range(convergence.max_iterations):
+        G_next = convergence.update(G, F(G))
+        if convergence.converged:
+            break
+        G = G_next
+    return G
+
+
+# an affine map whose Jacobian has a negative eigenvalue close to -1 in every hour: a plain Picard
+# iteration oscillates around the fixed point and converges slowly
+SLOPES = -np.linspace(0.7, 0.9, 24)
+FIXED_POINT = np.linspace(0.2, 0.6, 24)
+
+
+def oscillating_map(G):
+    return FIXED_POINT + SLOPES * (G - FIXED_POINT)
+
+
+@pytest.mark.parametrize('method', ['picard', 'relaxation', 'aitken', 'anderson'])
+def test_methods_converge_to_the_fixed_point(method):
+    relaxation = 0.5 if method == 'relaxation' else 1.0
+    convergence = GridCFEConvergence(method=method, atol=1e-4, relaxation=relaxation, max_iterations=200)
+    G = iterate(convergence, oscillating_map, np.zeros(24))
+
+    assert convergence.converged
+    np.testing.assert_allclose(G, FIXED_POINT, atol=1e-3)
+    residuals = convergence.residuals
+    assert residuals.index[-1] == len(residuals)
+    assert residuals.converged.iloc[-1] and not residuals.converged.iloc[:-1].any()
+
+
+def test_accelerated_methods_need_fewer_solves():
+    iterations = {}
+    for method in ['picard', 'aitken', 'anderson']:
+        convergence = GridCFEConvergence(method=method, atol=1e-4, max_iterations=200)
+        iterate(convergence, oscillating_map, np.zeros(24))
+        iterations[method] = len(convergence.residuals)
+    assert iterations['aitken'] < iterations['picard']
+    assert iterations['anderson'] < iterations['picard']
+
+
+def test_picard_is_the_plain_iteration():
+    convergence = GridCFEConvergence(method='picard')
+    G = np.full(24, 0.3)
+    np.testing.assert_array_equal(convergence.update(G, oscillating_map(G)), oscillating_map(G))
+
+
+def test_next_grid_cfe_is_clipped():
+    convergence = GridCFEConvergence(method='relaxation', relaxation=1.0)
+    np.testing.assert_array_equal(convergence.update(np.zeros(3), np.array([-0.5, 0.5, 1.5])), [0.0, 0.5, 1.0])
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError, match='Invalid convergence method'):
+        GridCFEConvergence(method='newton')
+    with pytest.raises(ValueError, match='relaxation'):
+        GridCFEConvergence(relaxation=0.0)
+
+
+def test_hours_without_generation_converge():
+    # no grid generation in hour 5: GetGridCFE returns NaN there
+    def without_generation(G):
+        F = oscillating_map(G)
+        F[5] = np.nan
+        return F
+
+    convergence = GridCFEConvergence(method='anderson', atol=1e-4)
+    G = iterate(convergence, without_generation, np.zeros(24))
+    assert convergence.converged
+    assert len(convergence.residuals) < convergence.max_iterations
+    assert G[5] == 0.0
+    np.testing.assert_allclose(np.delete(G, 5), np.delete(FIXED_POINT, 5), atol=1e-3)
+
+
+# a map whose Jacobian has an eigenvalue below -1: a plain Picard iteration diverges in a growing oscillation
+def diverging_map(G):
+    return 0.5 - 1.5 * (G - 0.5)
+
+
+def test_oscillations_are_damped():
+    convergence = GridCFEConvergence(method='relaxation', atol=1e-4, relaxation=1.0, max_iterations=100)
+    G = iterate(convergence, diverging_map, np.full(24, 0.45))
+
+    assert convergence.converged
+    np.testing.assert_allclose(G, 0.5, atol=1e-3)
+    residuals = convergence.residuals
+    assert residuals.oscillating.iloc[1]
+    assert residuals.relaxation.iloc[1] == 0.5
+
+
+def test_oscillations_restart_the_anderson_history():
+    convergence = GridCFEConvergence(method='anderson', anderson_depth=3)
+    G = np.full(24, 0.45)
+    for _ in range(2):
+        G = convergence.update(G, diverging_map(G))
+    assert convergence.records[-1]['oscillating']
+    # only the iterate before the oscillation is kept
+    assert len(convergence.history) == 2
+
+
+def test_relaxation_is_bounded():
+    convergence = GridCFEConvergence(method='aitken', relaxation=1.0, min_relaxation=0.2, max_iterations=30)
+    iterate(convergence, lambda G: 0.5 - 20 * (G - 0.5), np.full(24, 0.49))
+    assert convergence.residuals.relaxation.min() >= 0.2
+
+
+def test_picard_is_not_damped():
+    convergence = GridCFEConvergence(method='picard', atol=1e-4, max_iterations=20)
+    iterate(convergence, diverging_map, np.full(24, 0.45))
+    assert not convergence.converged
+    assert convergence.residuals.oscillating.any()
+    assert (convergence.residuals.relaxation == 1.0).all()
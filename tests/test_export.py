@@ -0,0 +1,41 @@
+import os
+import threading
+
+import pytest
+import xarray as xr
+
+from docs import simple_model
+from src import export
+
+
+@pytest.fixture
+def network():
+    return simple_model.add_solution(simple_model.MakeStockNetwork(n_buses=3, n_technologies=6, n_snapshots=48))
+
+
+def test_background_export_matches_synchronous_export(network, tmp_path):
+    written = []
+    export.export_network(network, str(tmp_path / 'sync.nc'))
+    with export.BackgroundExporter() as exporter:
+        # hold the writer until the network has changed
+        changed = threading.Event()
+        exporter._pool.submit(changed.wait)
+        exporter.export(network, str(tmp_path / 'background.nc'), callback=lambda: written.append(True))
+        assert written == []
+        # the network may be changed (e.g. re-solved) as soon as export returns
+        network.generators.loc[:, 'p_nom_opt'] = -1.0
+        network.generators_t.p.loc[:, :] = -1.0
+        changed.set()
+    assert written == [True]
+
+    xr.testing.assert_identical(xr.load_dataset(tmp_path / 'background.nc'), xr.load_dataset(tmp_path / 'sync.nc'))
+    assert sorted(os.listdir(tmp_path)) == ['background.nc', 'sync.nc']
+
+
+def test_failed_export_is_raised_on_flush(network, tmp_path):
+    exporter = export.BackgroundExporter()
+    exporter.export(network, str(tmp_path / 'missing' / 'network.nc'))
+    with pytest.raises(OSError):
+        exporter.flush()
+    exporter.close()
+    assert not os.path.exists(tmp_path / 'missing')
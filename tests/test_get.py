@@ -0,0 +1,114 @@
+import pandas as pd
+
+from docs import simple_model
+from src import get
+
+
+def baseline_ci_cost_summary(n):
+    '''get_ci_cost_summary before it was vectorised, with its per-generator loop and name matching
+    '''
+    ci_generator_costs = n.generators.loc[n.generators.index.str.contains('C&I')][
+        ['carrier', 'p_nom', 'p_nom_opt', 'capital_cost', 'marginal_cost', 'p_max_pu']
+    ]
+    ci_generator_p_max_pu = n.generators_t.p_max_pu.transpose().loc[
+        n.generators_t.p_max_pu.transpose().index.str.contains('C&I')
+    ].transpose()
+    ci_generator_costs['dispatch'] = n.generators_t.p[ci_generator_costs.index].sum()
+    potential_dispatch = []
+    for gen_id in ci_generator_costs.index:
+        if gen_id in ci_generator_p_max_pu.columns:
+            potential = (ci_generator_costs.loc[gen_id, 'p_nom_opt'] * ci_generator_p_max_pu[gen_id]).sum()
+        else:
+            potential = (
+                ci_generator_costs.loc[gen_id, 'p_nom_opt'] * ci_generator_costs.loc[gen_id, 'p_max_pu'] * len(ci_generator_p_max_pu)
+            )
+        potential_dispatch.append(potential)
+    ci_generator_costs['potential_dispatch'] = potential_dispatch
+    ci_generator_costs['curtailment'] = ci_generator_costs['potential_dispatch'] - ci_generator_costs['dispatch']
+    ci_generator_costs['curtailment_perc'] = ci_generator_costs['curtailment'] / ci_generator_costs['potential_dispatch']
+
+    ci_storage_costs = n.storage_units.loc[n.storage_units.index.str.contains('C&I')][
+        ['carrier', 'p_nom', 'p_nom_opt', 'capital_cost', 'marginal_cost']
+    ]
+    ci_storage_costs['dispatch'] = n.storage_units_t.p_dispatch[ci_storage_costs.index].sum()
+
+    ci_links_costs = n.links.loc[n.links.index.str.contains('C&I')][
+        ['carrier', 'p_nom', 'p_nom_opt', 'capital_cost', 'marginal_cost']
+    ]
+    ci_links_costs['capital_cost'] = 0
+    ci_links_costs['marginal_cost'] = 0
+    ci_links_costs['dispatch'] = n.links_t.p0[ci_links_costs.index].sum()
+
+    df = pd.concat([ci_generator_costs, ci_storage_costs, ci_links_costs]).round(3)
+    df.loc[:, 'capex'] = df['p_nom_opt'] * df['capital_cost']
+    df.loc[:, 'opex'] = df['dispatch'] * df['marginal_cost']
+
+    ci_brown_bus = n.buses[n.buses.index.str.contains('C&I')].index.str.split('C&I').str[0].str.strip()[0]
+    import_links_t = n.links_t.p0.filter(regex='C&I').filter(regex='Import').sum(axis=1)
+    import_cost = (import_links_t * n.buses_t.marginal_price[ci_brown_bus]).sum()
+    df.loc[df.index.str.contains('Import'), 'import_cost'] = import_cost
+
+    export_links_t = n.links_t.p0.filter(regex='C&I').filter(regex='Export').sum(axis=1)
+    export_link_p = n.buses_t.marginal_price.filter(regex='^(?!.*C&I)').mean(axis=1)
+    df.loc[df.index.str.contains('Export'), 'export_revenue'] = -(export_links_t * export_link_p).sum().sum()
+
+    df.fillna(0, inplace=True)
+    df.loc[:, 'unit_cost'] = (df['capex'] + df['opex'] + df['import_cost'] + df['export_revenue']) / df['dispatch']
+    return df
+
+
+def test_ci_cost_summary_matches_the_loop(prepared_network):
+    n = simple_model.add_solution(prepared_network)
+    # a C&I generator with a static p_max_pu only
+    static = n.generators.index[n.generators.index.str.contains('C&I') & (n.generators.type == 'nuclear-unspecified')]
+    n.generators_t.p_max_pu = n.generators_t.p_max_pu.drop(columns=static)
+    n.generators.loc[static, 'p_max_pu'] = 0.9
+
+    pd.testing.assert_frame_equal(get.get_ci_cost_summary(n), baseline_ci_cost_summary(n), check_names=False)
+
+
+def test_parallel_loading_matches_sequential_loading(solved_networks_dir):
+    sequential = get.load_from_dir(str(solved_networks_dir), lazy=False)
+    assert set(sequential) == {'n_bf', 'n_am_RES100_2030', 'n_hm_CFE90_2030', 'n_hm_CFE100_2030'}
+
+    # a bound under the size of any network loads them one at a time
+    for kwargs in [{'workers': 2}, {'workers': 2, 'max_memory_gb': 1e-6}]:
+        parallel = get.load_from_dir(str(solved_networks_dir), lazy=False, **kwargs)
+        assert list(parallel) == list(sequential)
+        for k, n in sequential.items():
+            pd.testing.assert_frame_equal(parallel[k].generators, n.generators)
+            pd.testing.assert_frame_equal(parallel[k].generators_t.p, n.generators_t.p)
+            pd.testing.assert_frame_equal(parallel[k].storage_units_t.p_dispatch, n.storage_units_t.p_dispatch)
+
+    assert list(get.load_from_dir(str(solved_networks_dir))) == list(sequential)
+
+
+def test_cfe_score_counts_each_ppa_once_with_the_grid_cfe_of_each_bus(prepared_network):
+    n = prepared_network
+    for c, attr in [('Generator', 'p'), ('Link', 'p0'), ('Load', 'p')]:
+        n.dynamic(c)[attr] = pd.DataFrame(0.0, index=n.snapshots, columns=n.static(c).index)
+    flows = {
+        # BUS000: GridCFE 30 / (30 + 10) = 0.75
+        ('Generator', 'p'): {
+            'BUS000 solar-unspecified existing 0': 30, 'BUS000 gas-ccgt existing 0': 10,
+            'BUS000 C&I Grid-solar-unspecified-ext-2030-PPA-Clean': 4, 'BUS000 C&I Grid-gas-ccgt-ext-2030-PPA-Fossil': 1,
+            # BUS001: GridCFE 20 / (20 + 20) = 0.5
+            'BUS001 nuclear-unspecified existing 0': 20, 'BUS001 gas-ccgt existing 0': 20,
+            'BUS001 C&I Grid-nuclear-unspecified-ext-2030-PPA-Clean': 8,
+        },
+        ('Link', 'p0'): {
+            'BUS000 C&I Grid Imports': 6, 'BUS000 C&I Grid Exports': 1,
+            'BUS000 C&I Storage Charge': 2, 'BUS000 C&I Storage Discharge': 2,
+            'BUS001 C&I Grid Imports': 2,
+        },
+        ('Load', 'p'): {'BUS000 C&I Load': 10, 'BUS001 C&I Load': 10},
+    }
+    for (c, attr), values in flows.items():
+        for name, value in values.items():
+            n.dynamic(c)[attr][name] = float(value)
+
+    score = get.get_cfe_score_ts(n, {'nodes_with_ci_load': ['BUS000', 'BUS001']})
+    # BUS000: 4 + 1 - 1 + 6 * 0.75 - 2 + 2 = 8.5, BUS001: 8 + 2 * 0.5 = 9, over a demand of 20
+    # (before the C&I metadata, both PPAs were counted twice and every import had the GridCFE of BUS001: 1.45)
+    assert list(score.columns) == ['CFE Score']
+    assert (score['CFE Score'] == 17.5 / 20).all()
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from conftest import optimize
+from src import helpers
+
+
+def snapshot(n) -> dict:
+    '''Copies of every static table and time series of a network
+    '''
+    tables = {}
+    for c in n.all_components:
+        tables[c] = n.static(c).copy()
+        for k, df in n.dynamic(c).items():
+            tables[(c, k)] = df.copy()
+    return tables
+
+
+def test_solving_a_fork_leaves_the_parent_unchanged(stock_network):
+    parent = optimize(stock_network)
+    before = snapshot(parent)
+
+    fork = helpers.fork_network(parent)
+    assert not hasattr(fork, 'model')
+    # as for RES100/CFE: fix the brownfield capacities in place, edit the loads and re-solve
+    for c in ['Generator', 'StorageUnit', 'Link']:
+        static = fork.static(c)
+        static.loc[:, 'p_nom'] = static.p_nom_opt.values
+        static.loc[:, 'p_nom_extendable'] = False
+    fork.generators.loc[fork.generators.index.str.contains('ext'), 'p_nom_extendable'] = True
+    bus = fork.loads.index[0]
+    fork.loads_t.p_set[bus] = fork.loads_t.p_set[bus] * 0.9
+    optimize(fork)
+    assert fork.objective != parent.objective
+
+    after = snapshot(parent)
+    assert before.keys() == after.keys()
+    for key, df in before.items():
+        pd.testing.assert_frame_equal(after[key], df, obj=str(key))
@@ -0,0 +1,53 @@
+import pandas as pd
+import pypsa
+import pytest
+
+from conftest import CI_BUSES, CI_IDENTIFIER
+from src import get
+from src.lazy import _EAGER, LazyNetwork
+
+
+@pytest.fixture
+def networks(solved_networks_dir):
+    path = str(solved_networks_dir / 'hourly_matching_CFE90_2030.nc')
+    return LazyNetwork(path), pypsa.Network(path)
+
+
+def test_tables_match_a_full_load(networks):
+    lazy, n = networks
+    pd.testing.assert_index_equal(lazy.snapshots, n.snapshots)
+    pd.testing.assert_frame_equal(lazy.snapshot_weightings, n.snapshot_weightings)
+    # the standard types and geometries are always loaded in full
+    for c in sorted(n.all_components - set(_EAGER)):
+        # empty tables only differ in the dtype of their index
+        if not n.static(c).empty:
+            pd.testing.assert_frame_equal(lazy.static(c), n.static(c), check_like=True, obj=c)
+        for attr, df in n.dynamic(c).items():
+            if not df.empty:
+                pd.testing.assert_frame_equal(lazy.dynamic(c)[attr], df, check_like=True, obj=f'{c} {attr}')
+    assert not lazy.loaded
+
+
+def test_list_names_are_served_lazily(networks):
+    lazy, n = networks
+    pd.testing.assert_frame_equal(lazy.generators, n.generators, check_like=True)
+    pd.testing.assert_frame_equal(lazy.links_t.p0, n.links_t.p0)
+    pd.testing.assert_frame_equal(lazy.storage_units_t['p_dispatch'], n.storage_units_t.p_dispatch)
+    assert lazy.name == n.name and lazy.meta == n.meta
+    assert not lazy.loaded
+
+
+def test_metrics_match_a_full_load(networks):
+    lazy, n = networks
+    run = {'nodes_with_ci_load': CI_BUSES}
+    pd.testing.assert_frame_equal(get.get_ci_cost_summary(lazy), get.get_ci_cost_summary(n))
+    pd.testing.assert_frame_equal(get.get_cfe_score_ts(lazy, run, CI_IDENTIFIER), get.get_cfe_score_ts(n, run, CI_IDENTIFIER))
+    pd.testing.assert_frame_equal(get.get_ci_procurement(lazy, CI_IDENTIFIER), get.get_ci_procurement(n, CI_IDENTIFIER))
+    assert get.get_emissions(lazy) == pytest.approx(get.get_emissions(n))
+
+
+def test_other_attributes_load_the_network(networks):
+    lazy, n = networks
+    pd.testing.assert_frame_equal(lazy.statistics(), n.statistics())
+    assert lazy.loaded
+    pd.testing.assert_frame_equal(lazy.generators, n.generators)
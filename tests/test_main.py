@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+
+import main
+from conftest import write_outputs
+from src import helpers
+
+CONFIGS = {'solver': {'name': 'highs', 'options': 'highs-default'}, 'solver_options': {'highs-default': {'threads': 4}}}
+
+SCENARIOS = [('RES', 100), ('CFE', 0.9), ('CFE', 1.0)]
+
+
+class Checkpoint:
+    '''Records the stages completed by solve_scenarios_in_pool
+    '''
+
+    def __init__(self):
+        self.stages = []
+
+    def complete(self, stage):
+        self.stages.append(stage)
+
+
+def solve_scenario(scenario, run, configs, **kwargs):
+    '''Records the solver options of a scenario, and fails the CFE 90 scenario
+    '''
+    kind, target = scenario
+    with open(os.path.join(run['path'], f'{kind}-{target}.json'), 'w') as f:
+        json.dump(configs['solver_options']['highs-default'], f)
+    if scenario == ('CFE', 0.9):
+        raise RuntimeError('infeasible')
+    return scenario
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    # forked pool workers inherit the patched module
+    monkeypatch.setattr(main, 'solve_scenario', solve_scenario)
+    return {'name': 'test', 'path': str(tmp_path)}
+
+
+def test_split_solver_threads():
+    options = {'threads': 8, 'solver': 'ipm'}
+    assert helpers.split_solver_threads(options, 3) == {'threads': 2, 'solver': 'ipm'}
+    assert helpers.split_solver_threads(options, 16)['threads'] == 1
+    assert options['threads'] == 8
+    assert helpers.split_solver_threads({}, 1)['threads'] == (os.cpu_count() or 1)
+
+
+def test_serial_failures_do_not_stop_the_run(run):
+    failures = main.solve_scenarios(SCENARIOS, run, CONFIGS)
+    assert [(scenario, repr(e)) for scenario, e in failures] == [(('CFE', 0.9), "RuntimeError('infeasible')")]
+    assert sorted(os.listdir(run['path'])) == ['CFE-0.9.json', 'CFE-1.0.json', 'RES-100.json']
+
+
+def test_pool_failures_match_serial_failures(run):
+    checkpoint = Checkpoint()
+    failures = main.solve_scenarios_in_pool(SCENARIOS, run, CONFIGS, workers=2, checkpoint=checkpoint)
+    assert [(scenario, repr(e)) for scenario, e in failures] == [(('CFE', 0.9), "RuntimeError('infeasible')")]
+    assert sorted(checkpoint.stages) == [('CFE', 1.0), ('RES', 100)]
+
+    # the solver threads are split across the workers
+    for scenario in SCENARIOS:
+        with open(os.path.join(run['path'], '{}-{}.json'.format(*scenario))) as f:
+            assert json.load(f) == {'threads': 2}
+    assert CONFIGS['solver_options']['highs-default'] == {'threads': 4}
+
+
+@pytest.fixture
+def configs(tmp_path):
+    path_to_model = tmp_path / 'stock_model'
+    path_to_model.mkdir()
+    (path_to_model / 'generators.csv').write_text('name,p_nom\ngas,100\n')
+    return {
+        'paths': {'path_to_model': str(path_to_model), 'output_model_runs': f'{tmp_path}/runs/'},
+        'global_vars': {'year': 2030, 'ci_label': 'C&I', 'background_export': False},
+        'constraints': {'policy_targets': {'enable': False}},
+        'technology_palette': {'palette_1': ['solar', 'onwind']},
+        'model_runs': [{
+            'name': 'test', 'palette': 'palette_1', 'ci_load_fraction': 0.2,
+            'cfe_score': [0.9, 1.0], 'nodes_with_ci_load': ['BUS000'],
+        }],
+        **CONFIGS,
+    }
+
+
+def test_interrupted_runs_resume_from_the_last_completed_stage(configs, monkeypatch):
+    pytest.importorskip('tz_pypsa')
+    from run import run_scenarios
+    from src import postprocess
+
+    solved = []
+
+    def solve(stage, configs, checkpoint):
+        solved.append(stage)
+        write_outputs(os.path.join(configs['paths']['output_model_runs'], 'test'), stage, configs)
+        checkpoint.complete(stage)
+
+    def solve_scenario(scenario, run, configs, checkpoint=None, **kwargs):
+        if scenario == ('CFE', 1.0) and interrupted:
+            raise KeyboardInterrupt
+        solve(scenario, configs, checkpoint)
+        return scenario
+
+    monkeypatch.setattr(
+        run_scenarios, 'RunBrownfieldSimulation',
+        lambda run, configs, checkpoint=None, **kwargs: solve(('brownfield', None), configs, checkpoint),
+    )
+    monkeypatch.setattr(main, 'solve_scenario', solve_scenario)
+    monkeypatch.setattr(helpers, 'load_brownfield_network', lambda run, configs: None)
+    monkeypatch.setattr(postprocess, 'plot_results', lambda *args, **kwargs: [])
+
+    interrupted = True
+    with pytest.raises(KeyboardInterrupt):
+        main.run_scenarios(configs)
+    assert solved == [('brownfield', None), ('RES', 100), ('CFE', 0.9)]
+
+    interrupted = False
+    solved.clear()
+    main.run_scenarios(configs)
+    assert solved == [('CFE', 1.0)]
+
+    # nothing is left to solve, unless an input changes
+    solved.clear()
+    main.run_scenarios(configs)
+    assert solved == []
+    configs['global_vars']['maximum_excess_export_cfe'] = 0.1
+    main.run_scenarios(configs)
+    assert solved == [('brownfield', None), ('RES', 100), ('CFE', 0.9), ('CFE', 1.0)]
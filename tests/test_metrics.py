@@ -0,0 +1,73 @@
+import pandas as pd
+import pypsa
+import pytest
+
+from conftest import CI_BUSES, CI_IDENTIFIER
+from src import get, metrics, postprocess
+
+RUN = {'nodes_with_ci_load': CI_BUSES}
+
+# the statistics and metrics of compute_metrics, on a network
+METRICS = {
+    'statistics': lambda n: n.statistics(),
+    'statistics by bus': lambda n: n.statistics(groupby=['bus', 'carrier']),
+    'statistics.expanded_capacity': lambda n: n.statistics.expanded_capacity(),
+    'statistics.energy_balance': lambda n: n.statistics.energy_balance(),
+    'get_emissions': lambda n: get.get_emissions(n),
+    'get_ci_parent_emissions': lambda n: get.get_ci_parent_emissions(n, CI_BUSES[0]),
+    'get_ci_cost_summary': lambda n: get.get_ci_cost_summary(n),
+    'get_ci_procurement': lambda n: get.get_ci_procurement(n, CI_IDENTIFIER),
+    'get_total_ci_procurement_cost': lambda n: get.get_total_ci_procurement_cost(n),
+    'get_total_annual_system_cost': lambda n: get.get_total_annual_system_cost(n),
+    'get_cfe_score_ts': lambda n: get.get_cfe_score_ts(n, RUN, CI_IDENTIFIER),
+}
+
+
+@pytest.fixture
+def network(solved_networks_dir):
+    return pypsa.Network(str(solved_networks_dir / 'hourly_matching_CFE90_2030.nc'))
+
+
+def assert_same(left, right):
+    if isinstance(right, pd.DataFrame):
+        pd.testing.assert_frame_equal(left, right)
+    elif isinstance(right, pd.Series):
+        pd.testing.assert_series_equal(left, right)
+    else:
+        assert left == pytest.approx(right)
+
+
+def test_cached_metrics_match_uncached_metrics(network):
+    cache = metrics.MetricsCache(network)
+    postprocess.compute_metrics({'n_hm_CFE90_2030': cache}, RUN, CI_BUSES[0])
+    misses = sum(cache.misses.values())
+
+    # the plots are served from the cache
+    for name, metric in METRICS.items():
+        assert_same(metric(cache), metric(network))
+    assert sum(cache.misses.values()) == misses
+
+
+def test_cached_results_are_copies(network):
+    cache = metrics.MetricsCache(network)
+    summary = get.get_ci_cost_summary(cache)
+    summary.loc[:, 'capex'] = -1
+    pd.testing.assert_frame_equal(get.get_ci_cost_summary(cache), get.get_ci_cost_summary(network))
+
+
+def test_summary(network):
+    caches = {k: metrics.MetricsCache(network) for k in ['a', 'b']}
+    for cache in caches.values():
+        get.get_emissions(cache)
+        get.get_emissions(cache)
+    get.get_ci_cost_summary(caches['a'])
+    summary = metrics.summary(caches)
+    assert summary.loc['get_emissions'].tolist() == [2, 2]
+    assert summary.loc['get_ci_cost_summary'].tolist() == [0, 1]
+
+
+def test_only_the_metrics_of_the_figures_are_computed(network):
+    cache = metrics.MetricsCache(network)
+    figures = [(postprocess.plot_monthly_cfe_score_heatmaps, {})]
+    postprocess.compute_metrics({'n_hm_CFE90_2030': cache}, RUN, CI_BUSES[0], figures=figures)
+    assert {k for k, v in cache.misses.items() if v} == {'get_cfe_score_ts'}
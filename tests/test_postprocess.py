@@ -0,0 +1,91 @@
+import glob
+import os
+import shutil
+
+import pytest
+
+from conftest import CI_BUSES
+from src import cache, get, postprocess
+
+RUN = {'name': 'test', 'nodes_with_ci_load': CI_BUSES}
+
+# the plots of plot_results
+PLOTS = sorted(set(postprocess.OUTPUTS) - {'plot_system_unit_cost_by_scenario'})
+
+
+@pytest.fixture
+def run_dir(tmp_path, solved_networks_dir, monkeypatch):
+    shutil.copytree(solved_networks_dir, tmp_path / 'solved_networks')
+    # the plots read their fonts from ./assets
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(__file__)))
+    return tmp_path
+
+
+@pytest.mark.parametrize('stale, loaded', [
+    ('plot_monthly_cfe_score_heatmaps', False),
+    ('plot_ci_energy_balance', False),
+    ('plot_system_generation_mix', True),
+])
+def test_networks_are_only_loaded_in_full_for_plots_of_statistics(run_dir, monkeypatch, stale, loaded):
+    # every figure but one is up to date
+    monkeypatch.setattr(cache.ResultsManifest, 'is_current', lambda self, func, kwargs: func.__name__ != stale)
+    networks = {}
+    load_from_dir = get.load_from_dir
+    monkeypatch.setattr(get, 'load_from_dir', lambda *args, **kwargs: networks.update(load_from_dir(*args, **kwargs)) or networks)
+
+    assert postprocess.plot_results(str(run_dir), RUN, CI_BUSES[0]) == []
+    assert all(glob.glob(str(run_dir / 'results' / pattern)) for pattern in postprocess.OUTPUTS[stale])
+    # tables are decoded lazily, the statistics need the full networks
+    assert networks and all(n.loaded == loaded for n in networks.values())
+
+
+def test_up_to_date_plots_do_not_load_networks(run_dir, monkeypatch):
+    monkeypatch.setattr(cache.ResultsManifest, 'is_current', lambda self, func, kwargs: True)
+    monkeypatch.setattr(get, 'load_from_dir', lambda *args, **kwargs: pytest.fail('networks were loaded'))
+    assert postprocess.plot_results(str(run_dir), RUN, CI_BUSES[0]) == []
+
+
+def test_metrics_are_those_of_the_figures():
+    assert set(postprocess.FIGURE_METRICS) == set(postprocess.OUTPUTS)
+    assert {m for metrics in postprocess.FIGURE_METRICS.values() for m in metrics} == set(postprocess.METRICS)
+
+
+def test_only_plots_whose_inputs_changed_are_redrawn(run_dir, monkeypatch):
+    rendered = []
+
+    def render_figures(figures, solved_networks, workers=1):
+        # writes the outputs of each plot
+        for func, kwargs in figures:
+            rendered.append(func.__name__)
+            for pattern in postprocess.OUTPUTS[func.__name__]:
+                (run_dir / 'results' / pattern.replace('*', 'png')).write_text(func.__name__)
+        return []
+
+    monkeypatch.setattr(postprocess, 'render_figures', render_figures)
+    postprocess.plot_results(str(run_dir), RUN, CI_BUSES[0])
+    assert sorted(rendered) == PLOTS
+
+    rendered.clear()
+    postprocess.plot_results(str(run_dir), RUN, CI_BUSES[0])
+    assert rendered == []
+
+    # a missing output
+    (run_dir / 'results' / '14_ci_curtailment.png').unlink()
+    postprocess.plot_results(str(run_dir), RUN, CI_BUSES[0])
+    assert rendered == ['plot_ci_curtailment']
+
+    # other arguments
+    rendered.clear()
+    postprocess.plot_results(str(run_dir), {**RUN, 'name': 'other'}, CI_BUSES[0])
+    assert sorted(rendered) == ['plot_cfe_score_heatmaps', 'plot_ci_emission_rate_by_scenario', 'plot_monthly_cfe_score_heatmaps']
+
+    # another solved network
+    rendered.clear()
+    os.remove(run_dir / 'solved_networks' / 'hourly_matching_CFE90_2030.nc')
+    postprocess.plot_results(str(run_dir), {**RUN, 'name': 'other'}, CI_BUSES[0])
+    assert sorted(rendered) == PLOTS
+
+    # forced
+    rendered.clear()
+    postprocess.plot_results(str(run_dir), {**RUN, 'name': 'other'}, CI_BUSES[0], force=True)
+    assert sorted(rendered) == PLOTS
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pytest
+
+from src import results
+
+# a wide table, as plot_ci_portfolio_capacity saves it
+CAPACITY = pd.DataFrame(
+    {'Solar': [1.0, 2.0, 3.0], 'Batteries': [np.nan, 0.5, 1.5]},
+    index=pd.Index(['100% RES', 90.0, 100.0]),
+)
+
+# a long table, as plot_ci_curtailment saves it
+CURTAILMENT = pd.DataFrame({
+    'Scenario': ['100% RES', 'CFE-90', 'CFE-90'],
+    'CFE Score': [np.nan, 90.0, 90.0],
+    'carrier': ['Solar', 'Solar', 'Onshore Wind'],
+    'dispatch': [10.0, 20.0, 30.0],
+    'curtailment_perc': [0.1, 0.2, np.nan],
+})
+
+
+@pytest.fixture
+def run_dirs(tmp_path):
+    '''Returns two run directories, with the tables of both saved'''
+    dirs = []
+    for i, run in enumerate(['run_a', 'run_b']):
+        path = tmp_path / run
+        (path / 'results').mkdir(parents=True)
+        results.save(CAPACITY * (i + 1), str(path), '01_ci_capacity')
+        results.save(CURTAILMENT, str(path), '14_ci_curtailment', index=False)
+        dirs.append(str(path))
+    return dirs
+
+
+def test_wide_tables_have_one_row_per_scenario_and_carrier():
+    tidy = results.to_tidy(CAPACITY, '01_ci_capacity')
+    assert list(tidy.columns) == ['table', 'scenario', 'cfe_score', 'metric', 'carrier', 'value']
+    # the missing battery capacity of 100% RES is dropped
+    assert len(tidy) == 5
+    assert set(tidy['metric']) == {'ci_capacity'}
+    row = tidy.query("carrier == 'Batteries' and cfe_score == 90")
+    assert row['scenario'].tolist() == ['CFE'] and row['value'].tolist() == [0.5]
+    assert tidy.loc[tidy['scenario'] == '100% RES', 'cfe_score'].isna().all()
+
+
+def test_two_column_levels_are_carriers_and_metrics():
+    df = pd.DataFrame(
+        [[1.0, 2.0, 3.0]],
+        index=['CFE-90'],
+        columns=pd.MultiIndex.from_tuples([('Solar', 'CapEx'), ('Solar', 'OpEx'), ('Gas', 'OpEx')]),
+    )
+    tidy = results.to_tidy(df, '13b_system_costs_benefits_raw')
+    assert tidy[['scenario', 'cfe_score', 'carrier', 'metric', 'value']].values.tolist() == [
+        ['CFE', 90.0, 'Solar', 'CapEx', 1.0],
+        ['CFE', 90.0, 'Solar', 'OpEx', 2.0],
+        ['CFE', 90.0, 'Gas', 'OpEx', 3.0],
+    ]
+
+
+def test_long_tables_have_one_row_per_metric():
+    tidy = results.to_tidy(CURTAILMENT, '14_ci_curtailment')
+    assert set(tidy['metric']) == {'dispatch', 'curtailment_perc'}
+    assert len(tidy) == 5
+    assert tidy.loc[tidy['scenario'] == 'CFE', 'cfe_score'].eq(90).all()
+    assert tidy.loc[tidy['scenario'] == '100% RES', 'carrier'].unique().tolist() == ['Solar']
+
+
+def test_save_writes_the_csv_and_the_store(run_dirs):
+    files = sorted(os.listdir(os.path.join(run_dirs[0], 'results')))
+    assert files == ['01_ci_capacity.csv', '14_ci_curtailment.csv', 'store']
+    assert sorted(os.listdir(os.path.join(run_dirs[0], 'results', results.STORE))) == [
+        '01_ci_capacity.parquet', '14_ci_curtailment.parquet',
+    ]
+    pd.testing.assert_frame_equal(
+        pd.read_csv(os.path.join(run_dirs[0], 'results', '14_ci_curtailment.csv')), CURTAILMENT,
+    )
+
+
+def test_query_reads_the_stores_of_all_runs(run_dirs, tmp_path):
+    rows = results.query(str(tmp_path / '*'))
+    assert list(rows.columns) == results.SCHEMA.names
+    assert rows.groupby('run').size().to_dict() == {'run_a': 10, 'run_b': 10}
+
+
+def test_query_filters(run_dirs, tmp_path):
+    rows = results.query(str(tmp_path / '*'), table='01_ci_capacity', carrier='Solar', cfe_score=[90, 100])
+    assert sorted(rows['value']) == [2.0, 3.0, 4.0, 6.0]
+
+    rows = results.query(run_dirs, columns=['run', 'value'], filter=pc.field('value') > 3, table='01_ci_capacity')
+    assert rows.values.tolist() == [['run_b', 4.0], ['run_b', 6.0]]
+
+
+def test_table_selection_only_reads_the_files_of_the_table(run_dirs):
+    files = results.dataset(run_dirs, tables=['14_ci_curtailment']).files
+    assert [os.path.basename(f) for f in files] == ['14_ci_curtailment.parquet'] * 2
+    assert set(results.query(run_dirs, table=['14_ci_curtailment'])['table']) == {'14_ci_curtailment'}
+
+
+def test_read_restores_the_saved_table(run_dirs):
+    pd.testing.assert_frame_equal(results.read(run_dirs[0], '01_ci_capacity'), CAPACITY)
+
+    curtailment = results.read(run_dirs[0], '14_ci_curtailment', metric='curtailment_perc')
+    expected = pd.DataFrame({'Solar': [0.1, 0.2]}, index=pd.Index(['100% RES', 90.0], dtype=object))
+    pd.testing.assert_frame_equal(curtailment, expected)
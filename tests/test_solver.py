@@ -0,0 +1,154 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+
+from conftest import CFE_CONSTRAINTS, CI_BUSES, CI_IDENTIFIER, HIGHS_OPTIONS, cfe_network, matrices
+from src import cfe, solver
+
+# the constraints that change between solves of RunCFESweep
+UPDATED = [f'cfe-constraint-{kind}-{bus}' for bus in CI_BUSES for kind in ['target', 'fossil-excess']]
+
+
+def highs_rows(persistent, labels) -> tuple:
+    '''Returns the rows of the HiGHS model of a persistent solver, as coefficients and bounds by constraint label
+    '''
+    lp = persistent.solver_model.getLp()
+    a = lp.a_matrix_
+    A = scipy.sparse.csc_matrix((a.value_, a.index_, a.start_), shape=(lp.num_row_, lp.num_col_)).tocsr()
+    rows = persistent.clabels.get_indexer(labels)
+    bounds = pd.DataFrame({'lower': np.array(lp.row_lower_)[rows], 'upper': np.array(lp.row_upper_)[rows]}, index=labels)
+    return pd.DataFrame(A[rows].toarray(), index=labels, columns=persistent.vlabels), bounds
+
+
+def test_persistent_solves_match_fresh_solves():
+    rng = np.random.default_rng(0)
+    n = cfe_network(0.0, 0.8)
+    persistent = solver.PersistentSolver(n, 'highs', HIGHS_OPTIONS)
+
+    for CFE_Score in [0.9, 1.0]:
+        cfe.update_cfe_score(n, CFE_Score, CI_BUSES, CI_IDENTIFIER)
+        GridCFE = pd.DataFrame(rng.uniform(0, 0.5, (len(CI_BUSES), len(n.snapshots))), index=CI_BUSES, columns=n.snapshots)
+        cfe.update_grid_cfe(n, GridCFE, CI_BUSES, CI_IDENTIFIER)
+        persistent.update_constraints(UPDATED)
+        assert persistent.solve() == ('ok', 'optimal')
+        assert persistent.stats['status'] == 'ok'
+
+        fresh = cfe_network(GridCFE, CFE_Score)
+        status, _ = fresh.optimize.solve_model(solver_name='highs', solver_options=HIGHS_OPTIONS, sanitize_zeros=False)
+        assert status == 'ok'
+        assert n.objective == pytest.approx(fresh.objective, rel=1e-6)
+        pd.testing.assert_series_equal(
+            n.generators.p_nom_opt, fresh.generators.p_nom_opt, check_exact=False, atol=1e-3, rtol=1e-5,
+        )
+
+        # the solver holds the same CFE constraints as the rebuilt model
+        A, b = matrices(fresh.model, CFE_CONSTRAINTS)
+        A_solver, bounds = highs_rows(persistent, A.index)
+        pd.testing.assert_frame_equal(A_solver.reindex(columns=A.columns), A, check_names=False, atol=1e-12)
+        sign = pd.Series(np.concatenate([fresh.model.constraints[name].sign.values.ravel() for name in CFE_CONSTRAINTS]), index=A.index)
+        np.testing.assert_allclose(bounds.lower[sign != '<='], b[sign != '<='])
+        np.testing.assert_allclose(bounds.upper[sign != '>='], b[sign != '>='])
+
+
+def test_non_optimal_persistent_solve_keeps_the_previous_solution():
+    n = cfe_network(0.0, 0.8)
+    persistent = solver.PersistentSolver(n, 'highs', HIGHS_OPTIONS)
+    assert persistent.solve()[0] == 'ok'
+    objective = n.objective
+
+    # more clean supply than the excess export limit allows
+    cfe.update_cfe_score(n, 5.0, CI_BUSES, CI_IDENTIFIER)
+    persistent.update_constraints(UPDATED)
+    status, condition = persistent.solve()
+    assert status == 'warning' and condition != 'optimal'
+    assert persistent.stats['status'] == 'warning'
+    assert n.objective == objective
+
+
+def test_unsupported_solver():
+    with pytest.raises(ValueError, match='only supported for highs and gurobi'):
+        solver.PersistentSolver(cfe_network(0.0, 0.8), 'glpk', {})
+
+
+HIGHS_LOG = '''
+Presolving model
+Presolve : Reductions: rows 120(-40); columns 90(-10); elements 400(-100)
+Solving the presolved LP
+Presolve : Reductions: rows 110(-50); columns 80(-20); elements 350(-150)
+'''
+
+GUROBI_LOG = '''
+Presolve removed 40 rows and 10 columns
+Presolved: 120 rows, 90 columns, 400 nonzeros
+'''
+
+
+def solved(status='ok'):
+    '''Returns a network-like object whose model solved with a status'''
+    return SimpleNamespace(model=SimpleNamespace(status=status, termination_condition='optimal'))
+
+
+def test_solve_network_stats():
+    n = cfe_network(0.0, 0.8)
+    configs = {'solver': {'name': 'highs', 'options': 'test'}, 'solver_options': {'test': HIGHS_OPTIONS}}
+    stats = solver.solve_network(n, configs, sanitize_zeros=False)
+
+    assert list(stats) == solver.SOLVE_STATS
+    assert (stats['solver'], stats['status'], stats['termination']) == ('highs', 'ok', 'optimal')
+    assert stats['objective'] == pytest.approx(n.objective)
+    assert (stats['rows'], stats['columns']) == (n.model.solver_model.getNumRow(), n.model.solver_model.getNumCol())
+    # the presolved size is read from the log of the solve
+    assert 0 < stats['presolved_rows'] <= stats['rows']
+    assert 0 < stats['presolved_nonzeros'] <= stats['nonzeros']
+    assert stats['simplex_iterations'] > 0
+    assert stats['wall_time_s'] >= stats['solver_time_s'] > 0
+
+
+@pytest.mark.parametrize('solver_name, log, presolved', [
+    ('highs', HIGHS_LOG, (110, 80, 350)),
+    ('gurobi', GUROBI_LOG, (120, 90, 400)),
+    ('highs', '', (None, None, None)),
+    ('cplex', HIGHS_LOG, (None, None, None)),
+])
+def test_presolved_size_is_that_of_the_last_presolve_of_the_log(solver_name, log, presolved):
+    stats = solver.solve_stats(solved(), None, solver_name, log=log)
+    assert (stats['presolved_rows'], stats['presolved_columns'], stats['presolved_nonzeros']) == presolved
+    assert stats['rows'] is None and stats['status'] == 'ok'
+
+
+def test_stats_are_collected_per_run(tmp_path):
+    (tmp_path / 'solved_networks').mkdir()
+    assert solver.collect_stats(str(tmp_path)).empty
+
+    def stats(iteration, wall_time_s):
+        return {
+            **solver.solve_stats(solved(), None, 'highs', log=HIGHS_LOG, solver_time_s=1.0, wall_time_s=wall_time_s),
+            'rows': 100 * iteration, 'columns': 10, 'nonzeros': 1000, 'simplex_iterations': 5, 'barrier_iterations': 0,
+        }
+
+    solver.save_stats([stats(1, 2.0)], str(tmp_path / 'solved_networks' / 'brownfield_2030.nc'))
+    solver.save_stats(
+        [{'cfe_score': 0.9, 'iteration': i, **stats(i, 1.5)} for i in [1, 2]],
+        str(tmp_path / 'solved_networks' / 'hourly_matching_CFE90_2030.nc'),
+    )
+    assert sorted(os.listdir(tmp_path / 'solved_networks')) == [
+        'brownfield_2030.solves.csv', 'hourly_matching_CFE90_2030.solves.csv',
+    ]
+
+    collected = solver.collect_stats(str(tmp_path))
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'solver_stats.csv'), collected)
+    assert collected.columns[0] == 'network'
+    assert collected['network'].tolist() == ['brownfield_2030'] + ['hourly_matching_CFE90_2030'] * 2
+    assert collected['iteration'].tolist()[1:] == [1, 2]
+    assert collected['presolved_rows'].tolist() == [110] * 3
+
+    summary = solver.summarise_stats(collected)
+    assert summary.loc['hourly_matching_CFE90_2030'].to_dict() == {
+        'solves': 2, 'wall_time_s': 3.0, 'solver_time_s': 2.0, 'simplex_iterations': 10,
+        'barrier_iterations': 0, 'rows': 200, 'columns': 10, 'nonzeros': 1000,
+    }
+    assert summary.loc['brownfield_2030', 'solves'] == 1
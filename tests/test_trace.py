@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src import trace
+
+
+@trace.traced
+def build(n):
+    return n
+
+
+def work(i):
+    '''A task of a pool worker'''
+    with trace.stage('work', task=i):
+        return os.getpid()
+
+
+def test_nested_stages(tmp_path):
+    with trace.Tracer(str(tmp_path), run='test'):
+        with trace.stage('run'):
+            with trace.stage('CFE', cfe_score=0.9):
+                with trace.stage('iteration', iteration=2):
+                    assert build(1) == 1
+                with pytest.raises(ValueError), trace.stage('iteration', iteration=3):
+                    raise ValueError('infeasible')
+
+    with open(tmp_path / trace.TRACE) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['stage'] for line in lines] == ['build', 'iteration', 'iteration', 'CFE', 'run']
+    assert len({line['session'] for line in lines}) == 1
+
+    records = trace.read(str(tmp_path)).set_index('stage')
+    build_record = records.loc['build']
+    assert build_record['parent'] == 'iteration'
+    assert (build_record['run'], build_record['cfe_score'], build_record['iteration']) == ('test', 0.9, 2)
+    assert records.loc['run', 'parent'] is None and pd.isna(records.loc['run', 'cfe_score'])
+    assert records['error'].dropna().tolist() == ["ValueError('infeasible')"]
+    assert (records['wall_s'] >= 0).all()
+    assert records.loc['run', 'wall_s'] >= records.loc['CFE', 'wall_s']
+
+
+def test_summary(tmp_path):
+    with trace.Tracer(str(tmp_path)):
+        for i in range(3):
+            build(i)
+        # a tracer of the same run directory is re-used, and the summary written once it ends
+        with trace.for_run(str(tmp_path)):
+            with trace.stage('plot'):
+                pass
+        assert not os.path.exists(tmp_path / trace.SUMMARY)
+
+    summary = pd.read_csv(tmp_path / trace.SUMMARY, index_col='stage')
+    assert summary['calls'].to_dict() == {'build': 3, 'plot': 1}
+    assert list(summary.columns) == ['calls', 'wall_s', 'mean_wall_s', 'max_wall_s', 'cpu_s', 'peak_rss_mb']
+
+    # sessions are summarised separately
+    with trace.Tracer(str(tmp_path)):
+        build(0)
+    assert pd.read_csv(tmp_path / trace.SUMMARY, index_col='stage')['calls'].to_dict() == {'build': 1}
+    assert len(trace.read(str(tmp_path))) == 5
+
+
+def test_nothing_is_recorded_without_a_tracer(tmp_path):
+    with trace.stage('run'):
+        build(0)
+    assert trace.active() is None
+    assert trace.read(str(tmp_path)).empty
+
+
+def test_threads_have_their_own_stages(tmp_path):
+    with trace.Tracer(str(tmp_path)):
+        with trace.stage('run'):
+            thread = threading.Thread(target=build, args=(0,))
+            thread.start()
+            thread.join()
+    records = trace.read(str(tmp_path)).set_index('stage')
+    assert records.loc['build', 'parent'] is None
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_pool_workers_record_to_the_trace_of_the_run(tmp_path, method):
+    with trace.Tracer(str(tmp_path), run='test') as tracer:
+        with ProcessPoolExecutor(
+            max_workers=2,
+            mp_context=multiprocessing.get_context(method),
+            initializer=trace.activate,
+            initargs=(trace.active(),),
+        ) as pool:
+            pids = set(pool.map(work, range(4)))
+        summary = tracer.summary()
+
+    records = trace.read(str(tmp_path))
+    assert sorted(records['task']) == [0, 1, 2, 3]
+    assert set(records['pid']) == pids and os.getpid() not in pids
+    assert set(records['session']) == {tracer.session}
+    assert set(records['run']) == {'test'}
+    assert summary.loc['work', 'calls'] == 4